@@ -335,8 +335,8 @@ def view_payment_image(db, payment_id):
 
 def approve_payment(db, payment_id, admin_notes=""):
     """Approve a payment and activate the subscription."""
-    # Get payment
-    payment = db.get_payment(payment_id)
+    # Get payment, with its linked subscription
+    payment = db.get_payment_with_subscription(payment_id)
     if not payment:
         print(f"Payment with ID {payment_id} not found.")
         return
@@ -354,14 +354,10 @@ def approve_payment(db, payment_id, admin_notes=""):
     service = payment["service"]
     plan = payment["plan"]
     
-    subscriptions = db.get_all_user_subscriptions(user_id)
     subscription_activated = False
-    
-    for sub in subscriptions:
-        if "payment_id" in sub and str(sub["payment_id"]) == str(payment_id):
-            db.activate_subscription(sub["_id"])
-            subscription_activated = True
-            break
+    if payment["subscription"]:
+        db.activate_subscription(payment["subscription"]["_id"])
+        subscription_activated = True
     
     if subscription_activated:
         print(f"✅ Payment {payment_id} approved and subscription activated for user {user_id}.")
@@ -1,10 +1,17 @@
 import logging
 import datetime
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure
 from bson.objectid import ObjectId
 
 logger = logging.getLogger(__name__)
 
+def _project(document, fields):
+    """Mimic a MongoDB projection on an in-memory document."""
+    if document is None or fields is None:
+        return document
+    return {k: v for k, v in document.items() if k == "_id" or k in fields}
+
 class MockDatabase:
     """Mock database for when MongoDB connection fails. Implements in-memory storage."""
     
@@ -41,9 +48,9 @@ class MockDatabase:
             }
         ]
     
-    def get_user(self, user_id):
-        """Get user by Telegram user ID."""
-        return self.users.get(user_id)
+    def get_user(self, user_id, fields=None):
+        """Get user by Telegram user ID, optionally limited to the given fields."""
+        return _project(self.users.get(user_id), fields)
     
     def create_or_update_user(self, user_id, username=None, name=None, first_name=None, last_name=None, telegram_info=None):
         """Create new user or update existing one with enhanced information."""
@@ -76,6 +83,16 @@ class MockDatabase:
             self.users[user_id] = user
             return user
     
+    def mark_payment_approved(self, user_id, payment_id):
+        """Record an approved payment on the user. Returns False if the user is unknown."""
+        user = self.users.get(user_id)
+        if not user:
+            return False
+        telegram_info = user.setdefault("telegram_info", {})
+        telegram_info["approved_payment_id"] = payment_id
+        telegram_info["payment_approved_at"] = datetime.datetime.utcnow()
+        return True
+    
     def get_active_subscription(self, user_id, service):
         """Get active subscription for a user for a specific service."""
         now = datetime.datetime.utcnow()
@@ -199,13 +216,33 @@ class MockDatabase:
         self.payments.append(payment)
         return payment
     
-    def get_payment(self, payment_id):
-        """Get payment by ID."""
+    def create_payment_and_subscription(self, user_id, amount, service, plan, image_url, image_file_id=None, 
+                                        image_file_path=None, notes="", payment_date=None, currency="LKR"):
+        """Create a payment and its linked pending subscription."""
+        payment = self.create_payment(user_id, amount, service, plan, image_url, image_file_id,
+                                      image_file_path, notes, payment_date, currency)
+        subscription = self.create_subscription(user_id, service, plan, payment["_id"])
+        return payment, subscription
+    
+    def get_payment(self, payment_id, fields=None):
+        """Get payment by ID, optionally limited to the given fields."""
         for payment in self.payments:
             if str(payment.get("_id")) == str(payment_id):
-                return payment
+                return _project(payment, fields)
         return None
     
+    def get_payment_with_subscription(self, payment_id):
+        """Get a payment with its linked subscription (or None) under "subscription"."""
+        payment = self.get_payment(payment_id)
+        if payment is None:
+            return None
+        
+        subscription = next(
+            (sub for sub in self.subscriptions if str(sub.get("payment_id")) == str(payment_id)),
+            None
+        )
+        return dict(payment, subscription=subscription)
+    
     def get_pending_payments(self, with_details=False):
         """Get all pending payments for admin review with optional user details."""
         pending_payments = [p for p in self.payments if p["status"] == "pending"]
@@ -545,11 +582,11 @@ class Database:
             return result
     
     # User Management
-    def get_user(self, user_id):
-        return self._call_method("get_user", user_id)
+    def get_user(self, user_id, fields=None):
+        return self._call_method("get_user", user_id, fields)
         
-    def _real_get_user(self, user_id):
-        result = self.db.users.find_one({"user_id": user_id})
+    def _real_get_user(self, user_id, fields=None):
+        result = self.db.users.find_one({"user_id": user_id}, projection=fields)
         logger.debug(f"Get user {user_id} result: {'Found' if result else 'Not found'}")
         return result
     
@@ -596,6 +633,20 @@ class Database:
             result = self.db.users.insert_one(user)
             logger.info(f"Created new user {user_id} in MongoDB with ID: {result.inserted_id}")
             return user
+    
+    def mark_payment_approved(self, user_id, payment_id):
+        return self._call_method("mark_payment_approved", user_id, payment_id)
+    
+    def _real_mark_payment_approved(self, user_id, payment_id):
+        """Record an approved payment on the user. Returns False if the user is unknown."""
+        result = self.db.users.update_one(
+            {"user_id": user_id},
+            {"$set": {
+                "telegram_info.approved_payment_id": payment_id,
+                "telegram_info.payment_approved_at": datetime.datetime.utcnow()
+            }}
+        )
+        return result.matched_count > 0
 
     def debug_subscription_status(self, user_id, service):
         """Debug why a subscription isn't being recognized."""
@@ -725,6 +776,15 @@ class Database:
         
     def _real_create_subscription(self, user_id, service, plan, payment_id=None):
         """Create a subscription with status history tracking."""
+        subscription = self._subscription_document(user_id, service, plan, payment_id)
+        
+        result = self.db.subscriptions.insert_one(subscription)
+        subscription["_id"] = result.inserted_id
+        logger.info(f"Created subscription for user {user_id}, service {service}, plan {plan} with ID: {result.inserted_id}")
+        return subscription
+    
+    def _subscription_document(self, user_id, service, plan, payment_id=None):
+        """Build a new pending subscription document."""
         now = datetime.datetime.utcnow()
         
         # Get plan details from database
@@ -761,10 +821,6 @@ class Database:
                 }
             ]
         }
-        
-        result = self.db.subscriptions.insert_one(subscription)
-        subscription["_id"] = result.inserted_id
-        logger.info(f"Created subscription for user {user_id}, service {service}, plan {plan} with ID: {result.inserted_id}")
         return subscription
     
     def activate_subscription(self, subscription_id):
@@ -804,6 +860,17 @@ class Database:
     def _real_create_payment(self, user_id, amount, service, plan, image_url, image_file_id=None, 
                            image_file_path=None, notes="", payment_date=None, currency="LKR"):
         """Create a payment record with enhanced image and status tracking."""
+        payment = self._payment_document(user_id, amount, service, plan, image_url, image_file_id,
+                                         image_file_path, notes, payment_date, currency)
+        
+        result = self.db.payments.insert_one(payment)
+        payment["_id"] = result.inserted_id
+        logger.info(f"Created payment record for user {user_id}, service {service}, plan {plan} with ID: {result.inserted_id}")
+        return payment
+    
+    def _payment_document(self, user_id, amount, service, plan, image_url, image_file_id=None, 
+                          image_file_path=None, notes="", payment_date=None, currency="LKR"):
+        """Build a new pending payment document."""
         if payment_date is None:
             payment_date = datetime.datetime.utcnow()
             
@@ -837,24 +904,80 @@ class Database:
                 "notes": "Payment proof received"
             }
         ]
-        
-        result = self.db.payments.insert_one(payment)
-        payment["_id"] = result.inserted_id
-        logger.info(f"Created payment record for user {user_id}, service {service}, plan {plan} with ID: {result.inserted_id}")
         return payment
     
-    def get_payment(self, payment_id):
-        return self._call_method("get_payment", payment_id)
+    def create_payment_and_subscription(self, user_id, amount, service, plan, image_url, image_file_id=None, 
+                                        image_file_path=None, notes="", payment_date=None, currency="LKR"):
+        return self._call_method("create_payment_and_subscription", user_id, amount, service, plan, image_url,
+                                 image_file_id, image_file_path, notes, payment_date, currency)
+    
+    def _real_create_payment_and_subscription(self, user_id, amount, service, plan, image_url, image_file_id=None, 
+                                              image_file_path=None, notes="", payment_date=None, currency="LKR"):
+        """Create a payment and its pending subscription together, in a transaction when the server supports one."""
+        payment = self._payment_document(user_id, amount, service, plan, image_url, image_file_id,
+                                         image_file_path, notes, payment_date, currency)
+        # The payment ID is assigned here so the subscription can reference it before either is written
+        payment["_id"] = ObjectId()
+        subscription = self._subscription_document(user_id, service, plan, payment["_id"])
         
-    def _real_get_payment(self, payment_id):
         try:
-            result = self.db.payments.find_one({"_id": ObjectId(payment_id)})
+            with self.client.start_session() as session:
+                with session.start_transaction():
+                    self.db.payments.insert_one(payment, session=session)
+                    self.db.subscriptions.insert_one(subscription, session=session)
+        except OperationFailure as e:
+            # Standalone servers don't support transactions
+            if e.code != 20:
+                raise
+            logger.warning(f"Transactions unavailable, creating payment and subscription separately: {e}")
+            self.db.payments.insert_one(payment)
+            self.db.subscriptions.insert_one(subscription)
+        
+        logger.info(f"Created payment {payment['_id']} and subscription {subscription['_id']} for user {user_id}, service {service}, plan {plan}")
+        return payment, subscription
+    
+    
+    def get_payment(self, payment_id, fields=None):
+        return self._call_method("get_payment", payment_id, fields)
+        
+    def _real_get_payment(self, payment_id, fields=None):
+        try:
+            result = self.db.payments.find_one({"_id": ObjectId(payment_id)}, projection=fields)
             logger.debug(f"Get payment {payment_id}: {'Found' if result else 'Not found'}")
             return result
         except Exception as e:
             logger.error(f"Error retrieving payment {payment_id}: {e}")
             return None
     
+    def get_payment_with_subscription(self, payment_id):
+        return self._call_method("get_payment_with_subscription", payment_id)
+        
+    def _real_get_payment_with_subscription(self, payment_id):
+        """Get a payment joined with its linked subscription in a single query."""
+        try:
+            results = list(self.db.payments.aggregate([
+                {"$match": {"_id": ObjectId(payment_id)}},
+                {"$lookup": {
+                    "from": "subscriptions",
+                    "localField": "_id",
+                    "foreignField": "payment_id",
+                    "as": "subscriptions"
+                }},
+                {"$limit": 1}
+            ]))
+        except Exception as e:
+            logger.error(f"Error retrieving payment {payment_id} with subscription: {e}")
+            return None
+        
+        if not results:
+            logger.debug(f"Get payment {payment_id} with subscription: Not found")
+            return None
+        
+        payment = results[0]
+        linked = payment.pop("subscriptions")
+        payment["subscription"] = linked[0] if linked else None
+        return payment
+    
     def get_pending_payments(self, with_details=False):
         return self._call_method("get_pending_payments", with_details)
         
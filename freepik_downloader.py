@@ -9,6 +9,77 @@ from freepik_login import handle_cookie_consent
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# The account's download history, newest first
+DOWNLOADS_PAGE_URL = "https://www.freepik.com/user/downloads?page=1&type=regular"
+
+# Patterns compiled once: search keywords in resource URLs, and the text of the
+# license button on the downloads page
+_SLUG_WORD_RE = re.compile(r'[a-zA-Z]+(?:-[a-zA-Z]+)*')
+_URL_WORD_RE = re.compile(r'[a-zA-Z]{4,}')
+_LICENSE_BUTTON_TEXT_RE = re.compile("Download license", re.IGNORECASE)
+
+# The _<user_id>_<YYYYmmdd>_<HHMMSS> suffix _save_download adds to saved file names
+_SAVED_NAME_SUFFIX_RE = re.compile(r'_\d+_\d{8}_\d{6}$')
+
+# Last-resort search: type the query into any search-like input, press Enter and
+# click a search button. Case-insensitive attribute selectors replace lowercasing
+# every input's attributes, and the query is passed as an argument, not spliced in.
+_SEARCH_FALLBACK_JS = """(query) => {
+    const searchInput = document.querySelector(
+        'input[type="search"], input[placeholder*="search" i], input[name*="search" i], input[id*="search" i]'
+    );
+    if (!searchInput) return false;
+    
+    searchInput.value = query;
+    searchInput.dispatchEvent(new Event('input', { bubbles: true }));
+    
+    // Create and dispatch an enter key event
+    searchInput.dispatchEvent(new KeyboardEvent('keydown', {
+        key: 'Enter',
+        code: 'Enter',
+        keyCode: 13,
+        which: 13,
+        bubbles: true
+    }));
+    
+    // Also try to find and click a search button
+    setTimeout(() => {
+        const searchButton = document.querySelector('button[aria-label*="search" i]') ||
+            Array.from(document.querySelectorAll('button')).find(
+                b => b.textContent?.toLowerCase().includes('search')
+            );
+        if (searchButton) searchButton.click();
+    }, 500);
+    return true;
+}"""
+
+# Per-user download directories already created during this process lifetime
+_prepared_user_dirs = set()
+
+def prepare_user_download_dir(download_dir, user_id):
+    """Create the per-user download directory once and return its path."""
+    user_download_dir = os.path.join(download_dir, f"user_{user_id}")
+    if user_download_dir not in _prepared_user_dirs:
+        os.makedirs(user_download_dir, exist_ok=True)
+        _prepared_user_dirs.add(user_download_dir)
+    return user_download_dir
+
+def _fsync_saved_file(file_path):
+    """Flush a saved file and its directory entry to disk."""
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    
+    # Directory fsync is POSIX-only; Windows cannot open directories this way
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(os.path.dirname(file_path) or ".", os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
 def extract_search_terms_from_url(resource_url):
     """
     Extract meaningful search terms from a Freepik URL.
@@ -28,7 +99,7 @@ def extract_search_terms_from_url(resource_url):
         filename = resource_url.split("/")[-1].split("_")[0]
         
         # Use regex to find all alphabetical words, handling hyphenated words better
-        words = re.findall(r'[a-zA-Z]+(?:-[a-zA-Z]+)*', filename)
+        words = _SLUG_WORD_RE.findall(filename)
         
         # Split any hyphenated words into individual terms
         for word in words:
@@ -44,7 +115,7 @@ def extract_search_terms_from_url(resource_url):
     # Method 3: Extract from any part of URL
     else:
         # Try to find meaningful words in the entire URL
-        words = re.findall(r'[a-zA-Z]{4,}', resource_url)  # Find words of 4+ chars
+        words = _URL_WORD_RE.findall(resource_url)  # Find words of 4+ chars
         search_terms = list(set(words))  # Remove duplicates
         logger.info(f"Extracted general keywords from URL: {search_terms}")
     
@@ -64,8 +135,7 @@ def download_resource(page, resource_url, user_id, download_dir, send_user_messa
     resource_file = ""
     
     # Create user directory for downloads
-    user_download_dir = os.path.join(download_dir, f"user_{user_id}")
-    os.makedirs(user_download_dir, exist_ok=True)
+    user_download_dir = prepare_user_download_dir(download_dir, user_id)
     
     try:
         # First navigate to the homepage
@@ -207,41 +277,7 @@ def download_resource(page, resource_url, user_id, download_dir, send_user_messa
                             # Try a JavaScript approach as last resort
                             try:
                                 logger.info("Trying direct JavaScript search as last resort...")
-                                page.evaluate(f"""() => {{
-                                    // Try to find any search input
-                                    const inputs = Array.from(document.querySelectorAll('input'));
-                                    const searchInput = inputs.find(i => 
-                                        i.type === 'search' || 
-                                        i.placeholder?.toLowerCase().includes('search') ||
-                                        i.name?.toLowerCase().includes('search') ||
-                                        i.id?.toLowerCase().includes('search')
-                                    );
-                                    
-                                    if (searchInput) {{
-                                        searchInput.value = "{' '.join(search_terms)}";
-                                        searchInput.dispatchEvent(new Event('input', {{ bubbles: true }}));
-                                        
-                                        // Create and dispatch an enter key event
-                                        const enterEvent = new KeyboardEvent('keydown', {{
-                                            key: 'Enter',
-                                            code: 'Enter',
-                                            keyCode: 13,
-                                            which: 13,
-                                            bubbles: true
-                                        }});
-                                        searchInput.dispatchEvent(enterEvent);
-                                        
-                                        // Also try to find and click a search button
-                                        setTimeout(() => {{
-                                            const buttons = Array.from(document.querySelectorAll('button'));
-                                            const searchButton = buttons.find(b => 
-                                                b.textContent?.toLowerCase().includes('search') ||
-                                                b.getAttribute('aria-label')?.toLowerCase().includes('search')
-                                            );
-                                            if (searchButton) searchButton.click();
-                                        }}, 500);
-                                    }}
-                                }}""")
+                                page.evaluate(_SEARCH_FALLBACK_JS, " ".join(search_terms))
                                 
                                 # Wait for navigation
                                 page.wait_for_load_state("networkidle", timeout=30000)
@@ -452,18 +488,9 @@ def download_resource(page, resource_url, user_id, download_dir, send_user_messa
                 return "", False  # Failed to download
             
             # Process the downloaded file
-            download = download_info.value
-            original_filename = download.suggested_filename
-            
-            # Add timestamp and user ID to filename
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename_parts = os.path.splitext(original_filename)
-            unique_filename = f"{filename_parts[0]}_{user_id}_{timestamp}{filename_parts[1]}"
+            resource_file = _save_download(download_info.value, user_id, user_download_dir)
             
-            resource_file = os.path.join(user_download_dir, unique_filename)
-            download.save_as(resource_file)
-            
-            logger.info(f"Resource downloaded: {unique_filename}")
+            logger.info(f"Resource downloaded: {os.path.basename(resource_file)}")
             return resource_file, True  # Successfully downloaded
             
         except Exception as e:
@@ -476,6 +503,63 @@ def download_resource(page, resource_url, user_id, download_dir, send_user_messa
         send_user_message(chat_id, f"❌ Error loading resource page: {str(e)[:100]}")
         return "", False  # Failed to download
 
+def _save_download(download, user_id, user_download_dir):
+    """Save a Playwright download under a unique per-user filename and return its path."""
+    original_filename = download.suggested_filename
+    
+    # Add timestamp and user ID to filename
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename_parts = os.path.splitext(original_filename)
+    unique_filename = f"{filename_parts[0]}_{user_id}_{timestamp}{filename_parts[1]}"
+    
+    file_path = os.path.join(user_download_dir, unique_filename)
+    download.save_as(file_path)
+    _fsync_saved_file(file_path)
+    return file_path
+
+def _original_file_name(resource_file_path):
+    """Return the resource's file name as the downloads page lists it, lowercased.
+    
+    Saved files carry a _<user>_<time> suffix (see _save_download) that Freepik
+    never shows, so it is stripped along with the extension.
+    """
+    stem = os.path.splitext(os.path.basename(resource_file_path))[0]
+    return _SAVED_NAME_SUFFIX_RE.sub("", stem).lower()
+
+def _license_button_ready(page, original_name):
+    """Return True if this file's row on the downloads page offers a license."""
+    try:
+        page.goto(DOWNLOADS_PAGE_URL, wait_until="domcontentloaded", timeout=30000)
+        page.locator("tr").first.wait_for(state="attached", timeout=5000)
+        # The account is shared, so the newest row may be another job's file
+        for row in page.locator("tr").all():
+            if original_name in row.evaluate("el => el.innerHTML").lower():
+                license_button = row.locator("button").filter(has_text=_LICENSE_BUTTON_TEXT_RE).first
+                license_button.wait_for(state="visible", timeout=5000)
+                return True
+        return False
+    except Exception as e:
+        logger.debug("license_probe_miss error=%s", e)
+        return False
+
+def wait_for_license_ready(page, resource_file_path, max_wait=300):
+    """
+    Poll the downloads page until the resource's row offers a license, backing
+    off from 5s to 30s between checks. Returns True once ready, False on timeout.
+    """
+    original_name = _original_file_name(resource_file_path)
+    interval = 5
+    deadline = time.time() + max_wait
+    while time.time() < deadline:
+        if original_name and _license_button_ready(page, original_name):
+            logger.info("license_ready waited=%.0fs", max_wait - (deadline - time.time()))
+            return True
+        time.sleep(min(interval, max(0, deadline - time.time())))
+        interval = min(interval * 2, 30)
+    
+    logger.warning("license_not_ready max_wait=%ds", max_wait)
+    return False
+
 def download_license(page, resource_file_path, user_id, download_dir):
     """
     Download the license file from Freepik and return the local file path.
@@ -489,26 +573,43 @@ def download_license(page, resource_file_path, user_id, download_dir):
     Returns:
         str: Path to the downloaded license file, or empty string if download failed
     """
-    logger.info("Downloading license file from Freepik...")
-    
     # Create unique subdirectory for this user
-    user_download_dir = os.path.join(download_dir, f"user_{user_id}")
-    os.makedirs(user_download_dir, exist_ok=True)
+    user_download_dir = prepare_user_download_dir(download_dir, user_id)
     
     # Extract the file name from the resource path
     resource_file_name = os.path.basename(resource_file_path)
     file_name_without_ext = os.path.splitext(resource_file_name)[0]
     
-    logger.info(f"Looking for license for file: {resource_file_name}")
+    logger.info("license_download_started file=%s user=%s", resource_file_name, user_id)
     
     try:
         # Go to downloads page
-        page.goto("https://www.freepik.com/user/downloads?page=1&type=regular", timeout=30000)
+        page.goto(DOWNLOADS_PAGE_URL, timeout=30000)
         page.wait_for_load_state("networkidle", timeout=30000)
         
+        # Fast path: the downloads list is newest-first, so the just-requested
+        # license is usually in the first row. The account is shared, so the row
+        # is only used if it is for this file
+        original_name = _original_file_name(resource_file_path)
+        try:
+            first_row = page.locator("tr").first
+            if original_name and original_name in first_row.evaluate("el => el.innerHTML").lower():
+                with page.expect_download(timeout=30000) as download_info:
+                    # This selector looks for a button with "Download license" text
+                    license_button = first_row.locator("button").filter(has_text=_LICENSE_BUTTON_TEXT_RE).first
+                    license_button.click(timeout=3000)
+                
+                license_path = _save_download(download_info.value, user_id, user_download_dir)
+                logger.info("license_downloaded method=most_recent filename=%s user=%s",
+                            os.path.basename(license_path), user_id)
+                return license_path
+            logger.debug("license_fast_path_miss reason=first_row_not_this_file")
+        except Exception as e:
+            logger.debug("license_fast_path_miss error=%s", e)
+        
         # Extract file links from the downloads page
         file_rows = page.locator("tr").all()
-        logger.info(f"Found {len(file_rows)} rows in the downloads table")
+        logger.debug("license_rows_found count=%d", len(file_rows))
         
         # Method 1: Try to find the exact file by name in the table
         license_found = False
@@ -517,38 +618,27 @@ def download_license(page, resource_file_path, user_id, download_dir):
                 row_html = row.evaluate("el => el.innerHTML")
                 
                 # Check if this row contains our file name
-                if file_name_without_ext.lower() in row_html.lower():
-                    logger.info(f"Found matching file in row {i+1}")
-                    
+                if original_name and original_name in row_html.lower():
                     # Find and click the license button in this row
                     license_button = row.locator("button:has-text('Download license')").first
                     if license_button.is_visible(timeout=5000):
                         with page.expect_download(timeout=30000) as download_info:
                             license_button.click(timeout=10000)
-                            logger.info("Clicked license button for matching file")
                         
                         # Process the download
-                        download = download_info.value
-                        original_filename = download.suggested_filename
-                        
-                        # Add timestamp and user ID to filename
-                        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                        filename_parts = os.path.splitext(original_filename)
-                        unique_filename = f"{filename_parts[0]}_{user_id}_{timestamp}{filename_parts[1]}"
-                        
-                        license_path = os.path.join(user_download_dir, unique_filename)
-                        download.save_as(license_path)
-                        logger.info(f"License file downloaded: {unique_filename}")
+                        license_path = _save_download(download_info.value, user_id, user_download_dir)
+                        logger.info("license_downloaded method=name_match row=%d filename=%s user=%s",
+                                    i + 1, os.path.basename(license_path), user_id)
                         license_found = True
                         return license_path
                     else:
-                        logger.error("License button not visible for matching file")
+                        logger.error("License button not visible for matching file in row %d", i + 1)
             except Exception as e:
-                logger.error(f"Error processing row {i+1}: {e}")
+                logger.error("Error processing row %d: %s", i + 1, e)
         
         # Method 2: Try to match based on file URL
         if not license_found:
-            logger.info("Trying to match file based on URL pattern...")
+            logger.debug("license_fallback method=url_pattern")
             
             # Get the file ID or distinctive part from the downloaded file name
             # Typically files are named based on their URL/ID
@@ -567,8 +657,6 @@ def download_license(page, resource_file_path, user_id, download_dir):
                             break
                     
                     if match_found:
-                        logger.info(f"Found possible match using URL pattern")
-                        
                         # Find and click the license button in this row
                         license_buttons = row.locator("button").all()
                         for button in license_buttons:
@@ -577,89 +665,47 @@ def download_license(page, resource_file_path, user_id, download_dir):
                                 if "license" in button_html.lower():
                                     with page.expect_download(timeout=30000) as download_info:
                                         button.click(timeout=10000)
-                                        logger.info("Clicked license button for matching URL pattern")
                                     
                                     # Process the download
-                                    download = download_info.value
-                                    original_filename = download.suggested_filename
-                                    
-                                    # Add timestamp and user ID to filename
-                                    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                                    filename_parts = os.path.splitext(original_filename)
-                                    unique_filename = f"{filename_parts[0]}_{user_id}_{timestamp}{filename_parts[1]}"
-                                    
-                                    license_path = os.path.join(user_download_dir, unique_filename)
-                                    download.save_as(license_path)
-                                    logger.info(f"License file downloaded: {unique_filename}")
+                                    license_path = _save_download(download_info.value, user_id, user_download_dir)
+                                    logger.info("license_downloaded method=url_pattern filename=%s user=%s",
+                                                os.path.basename(license_path), user_id)
                                     license_found = True
                                     return license_path
                             except Exception as e:
-                                logger.error(f"Error clicking license button: {e}")
+                                logger.error("Error clicking license button: %s", e)
                 except Exception as e:
                     continue  # Try next row
         
-        # Method 3: If still not found, try with the first row (most recent download)
+        # Method 3: Last resort, simply find any license button on the page
         if not license_found:
-            logger.info("Trying with most recent download...")
+            logger.debug("license_fallback method=any_button")
             try:
-                # Click the first license button in the first row
+                license_btn_selector = "button:has-text('Download license'), button:has-text('License')"
                 with page.expect_download(timeout=30000) as download_info:
-                    # Try to specifically target the license button based on its SVG icon and text
-                    first_row = page.locator("tr").first
-                    # This selector looks for a button with "Download license" text
-                    license_button = first_row.locator("button").filter(has_text=re.compile("Download license", re.IGNORECASE)).first
-                    license_button.click(timeout=10000)
-                    logger.info("Clicked license button for most recent download")
-                
-                download = download_info.value
-                original_filename = download.suggested_filename
+                    page.locator(license_btn_selector).first.click(timeout=10000)
                 
-                # Add timestamp and user ID to filename
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename_parts = os.path.splitext(original_filename)
-                unique_filename = f"{filename_parts[0]}_{user_id}_{timestamp}{filename_parts[1]}"
-                
-                license_path = os.path.join(user_download_dir, unique_filename)
-                download.save_as(license_path)
-                logger.info(f"License file downloaded: {unique_filename}")
+                license_path = _save_download(download_info.value, user_id, user_download_dir)
+                logger.info("license_downloaded method=any_button filename=%s user=%s",
+                            os.path.basename(license_path), user_id)
                 return license_path
             except Exception as e:
-                logger.error(f"Error downloading license from most recent download: {e}")
-                
-                # Try a final approach by simply finding any license button on the page
-                try:
-                    license_btn_selector = "button:has-text('Download license'), button:has-text('License')"
-                    with page.expect_download(timeout=30000) as download_info:
-                        page.locator(license_btn_selector).first.click(timeout=10000)
-                        logger.info("Clicked first available license button on the page")
-                    
-                    download = download_info.value
-                    original_filename = download.suggested_filename
-                    
-                    # Add timestamp and user ID to filename
-                    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename_parts = os.path.splitext(original_filename)
-                    unique_filename = f"{filename_parts[0]}_{user_id}_{timestamp}{filename_parts[1]}"
-                    
-                    license_path = os.path.join(user_download_dir, unique_filename)
-                    download.save_as(license_path)
-                    logger.info(f"License file downloaded using alternative method: {unique_filename}")
-                    return license_path
-                except Exception as e2:
-                    logger.error(f"Failed to download license using all methods: {e2}")
-                    return ""
+                logger.error("Failed to download license using all methods: %s", e)
+                return ""
     except Exception as e:
-        logger.error(f"Error navigating to downloads page: {e}")
+        logger.error("Error navigating to downloads page: %s", e)
         return ""
 
 def cleanup_files(file_paths):
     """Remove temporary files from the local system."""
     for file_path in file_paths:
-        if not file_path or not os.path.exists(file_path):
+        if not file_path:
             continue
             
         try:
             os.remove(file_path)
             logger.info(f"Deleted temporary file: {os.path.basename(file_path)}")
+        except FileNotFoundError:
+            continue
         except OSError as e:
-            logger.error(f"Could not delete {os.path.basename(file_path)}: {e}")
\ No newline at end of file
+            logger.error(f"Could not delete {os.path.basename(file_path)}: {e}")
@@ -1,303 +1,709 @@
 import os
+import gzip
+import json
+import queue
 import platform
 import time
 import re
 import logging
 import random
-from playwright.sync_api import sync_playwright
+import threading
+import weakref
+import concurrent.futures
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 from twocaptcha import TwoCaptcha, NetworkException, ApiException, TimeoutException, ValidationException
+from twocaptcha.api import ApiClient
 
 logger = logging.getLogger(__name__)
 
 # Constants
-AUTH_STATE_PATH = "auth_state.json"
+# Storage state is mostly repetitive cookie/localStorage JSON, so it is kept gzipped
+AUTH_STATE_PATH = "auth_state.json.gz"
+
+# Parsed auth state, reloaded only when the file's mtime changes
+_AUTH_CACHE = {"mtime": 0, "state": None}
+_auth_lock = threading.RLock()
+
+# Freepik's reCAPTCHA site key is a stable public value. When configured (or
+# once learned from a page) it is sent to 2Captcha directly without parsing the DOM.
+FREEPIK_RECAPTCHA_SITEKEY = os.getenv("FREEPIK_RECAPTCHA_SITEKEY")
+
+# 2Captcha error codes meaning the site key we sent was not accepted
+SITEKEY_REJECTED_ERRORS = ("ERROR_WRONG_GOOGLEKEY", "ERROR_BAD_PARAMETERS")
+
+# Site key and captcha type from the last successful page scan
+_learned_site_key = (None, None)
+
+# Seconds to wait for a background 2Captcha solve before giving up on it
+CAPTCHA_SOLVE_TIMEOUT = 180
+
+# Type credentials key by key instead of filling them in one step
+# (FREEPIK_SLOW_TYPE=1 is accepted as an alias)
+HUMANIZE_TYPING = (
+    os.getenv("HUMANIZE_TYPING", "false").lower() == "true"
+    or os.getenv("FREEPIK_SLOW_TYPE") == "1"
+)
+
+# Seconds between 2Captcha result polls
+CAPTCHA_POLL_INTERVAL = 5
+
+# (solver, send params, future) jobs for the single 2Captcha worker thread
+_captcha_jobs = queue.Queue()
+_captcha_worker_lock = threading.Lock()
+_captcha_worker_thread = None
+
+# Keep-alive connections to 2Captcha shared by every solver
+_HTTP_SESSION = requests.Session()
+_HTTP_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5)
+))
+
+# One TwoCaptcha solver per API key
+_SOLVER_CACHE = {}
 
 # List of common user agents to rotate
-USER_AGENTS = [
+USER_AGENTS = (
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36 Edg/114.0.1823.58",
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/115.0",
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.5.1 Safari/605.1.15"
-]
+)
+
+# "Continue with email" button on the login page
+_EMAIL_BUTTON_SELECTORS = (
+    "button:has-text('Continue with email')",
+    "button:has-text('Sign in with email')",
+    "button:has-text('Email')",
+    "[data-testid='email-login']",
+    ".email-login-button"
+)
+
+# Email input field
+_EMAIL_INPUT_SELECTORS = (
+    "input[name='email']",
+    "input[type='email']",
+    "input[placeholder*='email' i]",
+    "input#email",
+    "[data-testid='email-input']"
+)
+
+# Password input field
+_PASSWORD_SELECTORS = (
+    "input[name='password']",
+    "input[type='password']",
+    "input[placeholder*='password' i]",
+    "input#password",
+    "[data-testid='password-input']"
+)
+
+# "Stay logged in" checkbox fallbacks
+_REMEMBER_ME_SELECTORS = (
+    "input[type='checkbox']",
+    "input.remember-me",
+    "[data-testid='remember-me']"
+)
+
+# "Log in" submit button
+_LOGIN_BUTTON_SELECTORS = (
+    "button:has-text('Log in')",
+    "button:has-text('Login')",
+    "button:has-text('Sign in')",
+    "button[type='submit']",
+    "[data-testid='login-button']",
+    "button.login-button",
+    "button.signin-button"
+)
+
+# Error messages shown after a failed login
+_LOGIN_ERROR_SELECTORS = (
+    ":text('Invalid email or password')",
+    ":text('Incorrect credentials')",
+    ":text('The credentials are incorrect')",
+    ".error-message",
+    "[data-testid='login-error']"
+)
+
+# Submit buttons for a form that didn't auto-submit after a CAPTCHA
+_SUBMIT_SELECTORS = (
+    "button[type='submit']",
+    "input[type='submit']",
+    "button.submit-button",
+    "button:has-text('Submit')",
+    "button:has-text('Continue')",
+    "button.form-submit",
+    "button.g-recaptcha-submit"
+)
+
+# Login buttons to retry after a CAPTCHA
+_LOGIN_SELECTORS = (
+    "button:has-text('Log in')",
+    "button:has-text('Login')",
+    "button:has-text('Sign in')",
+    "button[data-testid*='login']",
+    "button.login-button"
+)
+
+# Finds and clicks a cookie consent control in one browser-side pass. Polls
+# (and watches DOM mutations) for up to `timeoutMs` for late-rendered banners.
+_COOKIE_CONSENT_JS = """async (timeoutMs) => {
+    const cssSelectors = [
+        '#onetrust-accept-btn-handler',
+        'button.cookie-accept-button',
+        '.cookie-banner .accept',
+        '[data-testid="cookie-accept"]',
+        '[aria-label="Accept cookies"]',
+        '.cookie-consent-accept',
+        '.cc-accept',
+        '.cookie-accept',
+        '.consent-accept',
+        '#accept-cookies',
+        '.cookie-agree',
+        '[data-cookiebanner="accept_button"]'
+    ];
+    const buttonTexts = [
+        'accept all cookies', 'accept all', 'accept cookies',
+        'i accept', 'accept', 'allow all', 'allow cookies',
+        'i agree', 'agree', 'got it', 'i understand', 'i consent'
+    ];
+    
+    const isVisible = (el) => el.offsetParent !== null;
+    
+    const findTarget = () => {
+        for (const selector of cssSelectors) {
+            const el = document.querySelector(selector);
+            if (el && isVisible(el)) return {el, selector};
+        }
+        
+        for (const el of document.querySelectorAll('button, a, [role="button"]')) {
+            if (!isVisible(el)) continue;
+            const text = (el.innerText || '').trim().toLowerCase();
+            // Skip large containers whose text merely mentions a phrase
+            if (!text || text.length > 40) continue;
+            const match = buttonTexts.find(btnText => text.includes(btnText));
+            if (match) return {el, selector: `text=${match}`};
+        }
+        
+        return null;
+    };
+    
+    const clickTarget = (found) => {
+        found.el.click();
+        return {clicked: true, selector: found.selector};
+    };
+    
+    const found = findTarget();
+    if (found) return clickTarget(found);
+    if (!timeoutMs) return {clicked: false, selector: null};
+    
+    return await new Promise((resolve) => {
+        let done = false;
+        const finish = (result) => {
+            if (done) return;
+            done = true;
+            observer.disconnect();
+            clearInterval(poll);
+            clearTimeout(timer);
+            resolve(result);
+        };
+        const check = () => {
+            const target = findTarget();
+            if (target) finish(clickTarget(target));
+        };
+        const observer = new MutationObserver(check);
+        observer.observe(document.documentElement, {childList: true, subtree: true});
+        const poll = setInterval(check, 50);
+        const timer = setTimeout(() => finish({clicked: false, selector: null}), timeoutMs);
+    });
+}"""
+
+# Writes a solved token into every g-recaptcha-response field and fires any
+# registered reCAPTCHA callbacks.
+_INJECT_RECAPTCHA_TOKEN_JS = """(token) => {
+    // Handle standard reCAPTCHA response
+    let textarea = document.getElementById('g-recaptcha-response');
+    if (!textarea) {
+        // Create it if it doesn't exist
+        textarea = document.createElement('textarea');
+        textarea.id = 'g-recaptcha-response';
+        textarea.name = 'g-recaptcha-response';
+        textarea.style.display = 'none';
+        document.body.appendChild(textarea);
+    }
+    textarea.value = token;
+    
+    // Handle invisible reCAPTCHA responses (there might be multiple)
+    document.querySelectorAll('textarea[id^="g-recaptcha-response-"]').forEach(el => {
+        el.value = token;
+    });
+    
+    // Trigger reCAPTCHA callback if it exists
+    if (typeof ___grecaptcha_cfg !== 'undefined') {
+        // Attempt to trigger the callback
+        document.dispatchEvent(new Event('recaptcha-verified'));
+        
+        // Try to trigger the reCAPTCHA callback functions
+        try {
+            // Find any callback names from the reCAPTCHA config
+            const callbackNames = [];
+            Object.entries(___grecaptcha_cfg.clients).forEach(([_, client]) => {
+                if (client && typeof client === 'object') {
+                    // Search for callback names in the client properties
+                    Object.values(client).forEach(value => {
+                        if (typeof value === 'object' && value !== null && 'callback' in value) {
+                            // Found a callback function name, save it
+                            if (typeof value.callback === 'string') {
+                                callbackNames.push(value.callback);
+                            }
+                        }
+                    });
+                }
+            });
+            
+            // Execute each callback function found
+            callbackNames.forEach(callbackName => {
+                if (typeof window[callbackName] === 'function') {
+                    console.log('Executing callback function: ' + callbackName);
+                    window[callbackName](token);
+                }
+            });
+        } catch (e) {
+            console.error('Error finding or executing reCAPTCHA callbacks:', e);
+        }
+    }
+}"""
+
+# Fallback click on any button mentioning "email". Native XPath stops at the first
+# match instead of lowercasing the innerText of every button on the page.
+_EMAIL_BUTTON_CLICK_JS = """() => {
+    const emailButton = document.evaluate(
+        "//button[contains(translate(., 'EMAIL', 'email'), 'email')]",
+        document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue;
+    
+    if (!emailButton) return false;
+    emailButton.click();
+    return true;
+}"""
 
-def handle_cookie_consent(page):
+# Fallback click on any login/submit button: attribute selectors first, then a
+# first-match XPath on the button text
+_LOGIN_BUTTON_CLICK_JS = """() => {
+    const loginButton = document.querySelector(
+        'button[type="submit"], button[aria-label*="log in" i], button[aria-label*="login" i], [data-testid="login-button"]'
+    ) || document.evaluate(
+        "//button[contains(translate(., 'LOGINS', 'logins'), 'log in') or " +
+        "contains(translate(., 'LOGIN', 'login'), 'login') or " +
+        "contains(translate(., 'SIGN', 'sign'), 'sign in')]",
+        document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue;
+    
+    if (!loginButton) return false;
+    loginButton.click();
+    return true;
+}"""
+
+def fill_input(locator, value):
+    """Replace an input's value, typing it slowly if HUMANIZE_TYPING is set."""
+    if HUMANIZE_TYPING:
+        locator.fill("")
+        locator.type(value, delay=100)
+    else:
+        # fill() clears the field itself, so this is a single call
+        locator.fill(value)
+
+# Trimmed text of each element passed to evaluate_all, skipping empty ones
+_ERROR_TEXTS_JS = "els => els.map(el => el.textContent.trim()).filter(Boolean)"
+
+# Returns the first selector the element satisfies; Playwright-only pseudo-classes
+# like :has-text() aren't valid in el.matches() and are skipped
+_MATCHED_SELECTOR_JS = """(el, selectors) => selectors.find(sel => {
+    try { return el.matches(sel); } catch (e) { return false; }
+}) || null"""
+
+def find_first_visible(page, selectors, timeout=10000):
+    """
+    Return a locator for the first visible element matching any of the selectors,
+    or None if nothing becomes visible within the timeout.
+    """
+    locator = page.locator(f"{', '.join(selectors)} >> visible=true").first
+    try:
+        locator.wait_for(state="visible", timeout=timeout)
+    except PlaywrightTimeoutError:
+        return None
+    
+    # Report which selector matched, only when someone is reading debug logs
+    if logger.isEnabledFor(logging.DEBUG):
+        try:
+            matched = locator.evaluate(_MATCHED_SELECTOR_JS, list(selectors))
+            logger.debug(f"Found element using selector: {matched}")
+        except Exception as e:
+            logger.debug(f"Could not tell which selector matched: {e}")
+    return locator
+
+# True once the cookie banner is gone or hidden
+_COOKIE_BANNER_GONE_JS = """() => {
+    const el = document.querySelector('.cookie-banner, #onetrust-banner-sdk');
+    return !el || el.getClientRects().length === 0 || getComputedStyle(el).visibility === 'hidden';
+}"""
+
+# URL/name fragments that identify a cookie consent iframe
+_COOKIE_FRAME_TOKENS = ("cookie", "consent", "onetrust", "cookiebot")
+
+def handle_cookie_consent(page, timeout_ms=2000):
     """
     Dismiss the cookie consent banner if it appears.
-    Updated to handle multiple common cookie consent patterns.
+    Runs all selector and button-text checks in a single page.evaluate call.
     """
     try:
-        # Method 1: Common cookie accept button patterns
-        selectors = [
-            "button:has-text('Accept all cookies')",
-            "button:has-text('Accept All')",
-            "button:has-text('Accept all')",
-            "button:has-text('I Accept')",
-            "button:has-text('Accept')",
-            "button:has-text('Allow all')",
-            "button:has-text('Allow cookies')",
-            "button:has-text('Agree')",
-            "button:has-text('I agree')",
-            "button:has-text('Got it')",
-            "button:has-text('I understand')",
-            "button:has-text('I consent')",
-            "button.cookie-accept-button",
-            ".cookie-banner .accept",
-            "[data-testid='cookie-accept']",
-            "#onetrust-accept-btn-handler",
-            "[aria-label='Accept cookies']",
-            ".cookie-consent-accept"
-        ]
-        
-        for selector in selectors:
+        # Method 1: Find and click the consent control in the main document
+        result = call_helper(page, "findCookieBtn", timeout_ms)
+        if result and result.get("clicked"):
+            logger.info(f"Cookie consent dismissed using selector: {result.get('selector')}")
             try:
-                consent_button = page.locator(selector).first
-                if consent_button.is_visible(timeout=2000):
-                    consent_button.click(timeout=5000)
-                    logger.info(f"Cookie consent dismissed using selector: {selector}")
-                    return True
+                page.wait_for_function(_COOKIE_BANNER_GONE_JS, timeout=3000)
             except Exception as e:
-                logger.debug(f"Failed to click cookie selector {selector}: {e}")
-                continue
+                logger.debug(f"Cookie banner still present after click: {e}")
+            return True
         
         # Method 2: Look for cookies in iframes
         try:
-            cookie_frames = page.frame_locator("iframe[title*='Cookie'], iframe[src*='cookie'], iframe[id*='cookie']").all()
+            cookie_frames = [
+                frame for frame in page.frames
+                if frame != page.main_frame
+                and any(token in f"{frame.url} {frame.name}".lower() for token in _COOKIE_FRAME_TOKENS)
+            ]
             for frame_idx, frame in enumerate(cookie_frames):
-                for selector in selectors:
-                    try:
-                        btn = frame.locator(selector).first
-                        if btn.is_visible(timeout=2000):
-                            btn.click(timeout=5000)
-                            logger.info(f"Cookie consent dismissed in iframe {frame_idx} using selector: {selector}")
-                            return True
-                    except:
-                        continue
+                result = call_helper(frame, "findCookieBtn", 0)
+                if result and result.get("clicked"):
+                    logger.info(f"Cookie consent dismissed in iframe {frame_idx} using selector: {result.get('selector')}")
+                    return True
         except Exception as e:
             logger.debug(f"Error in cookie iframe handling: {e}")
         
-        # Method 3: Try JavaScript approach to find and click cookie buttons
-        try:
-            # Use JavaScript to find and click cookie consent buttons
-            page.evaluate("""() => {
-                const buttonTexts = [
-                    'accept all cookies', 'accept all', 'accept cookies', 
-                    'i accept', 'accept', 'allow all', 'allow cookies',
-                    'agree', 'i agree', 'got it', 'i understand'
-                ];
-                
-                // Helper function to check if element's text contains any of the target phrases
-                const hasMatchingText = (element) => {
-                    const text = element.innerText.toLowerCase();
-                    return buttonTexts.some(btnText => text.includes(btnText));
-                };
-                
-                // First try to find buttons with the specific text
-                const allButtons = Array.from(document.querySelectorAll('button'));
-                const cookieButton = allButtons.find(hasMatchingText);
-                
-                if (cookieButton) {
-                    cookieButton.click();
-                    return true;
-                }
-                
-                // Try to find links or other elements that might be cookie consent buttons
-                const allLinks = Array.from(document.querySelectorAll('a'));
-                const cookieLink = allLinks.find(hasMatchingText);
-                
-                if (cookieLink) {
-                    cookieLink.click();
-                    return true;
-                }
-                
-                // Try common cookie consent IDs and classes
-                const commonSelectors = [
-                    '#onetrust-accept-btn-handler',
-                    '.cc-accept',
-                    '.cookie-accept',
-                    '.consent-accept',
-                    '#accept-cookies',
-                    '.cookie-agree',
-                    '[data-cookiebanner="accept_button"]'
-                ];
-                
-                for (const selector of commonSelectors) {
-                    const element = document.querySelector(selector);
-                    if (element) {
-                        element.click();
-                        return true;
-                    }
-                }
-                
-                return false;
-            }""")
-            
-            # Wait a moment for any animations to complete
-            time.sleep(1)
-            logger.info("Attempted cookie consent dismissal using JavaScript")
-        except Exception as js_error:
-            logger.debug(f"JavaScript cookie handling error: {js_error}")
-        
         return False
         
     except Exception as e:
         logger.debug(f"Error in cookie consent handling: {e}")
         return False
 
+# Detects reCAPTCHA and extracts its site key in a single browser-side pass.
+# One combined regex covers the JSON config, data-sitekey, render= (v3) and
+# generic key patterns, so the page HTML is materialized and scanned once.
+_RECAPTCHA_DETECT_JS = r"""() => {
+    const SITEKEY_RE = /(?:sitekey|render|\bkey)['"]?\s*[:=]\s*['"]([0-9A-Za-z_-]{40})['"]/;
+    const ERROR_KEY_RE = /['"](6L[a-zA-Z0-9_-]{38})['"]/;
+    
+    const isVisible = (el) => !!el && el.getClientRects().length > 0 &&
+        getComputedStyle(el).visibility !== 'hidden';
+    
+    // Nothing reCAPTCHA-related on the page: skip the scans (and the HTML regex) below
+    if (!document.querySelector(
+        '.g-recaptcha, .grecaptcha-badge, iframe[src*="recaptcha"], [data-sitekey], [data-recaptcha-key], ' +
+        '#g-recaptcha-response, script[src*="recaptcha"]'
+    )) {
+        return {site_key: null, type: null, has_elements: false};
+    }
+    
+    // Method 1: Standard g-recaptcha div
+    const widget = document.querySelector('div.g-recaptcha');
+    if (isVisible(widget) && widget.getAttribute('data-sitekey')) {
+        return {site_key: widget.getAttribute('data-sitekey'), type: 'checkbox'};
+    }
+    
+    // Method 2: Invisible reCAPTCHA badge, key lives in an inline script
+    if (isVisible(document.querySelector('.grecaptcha-badge'))) {
+        for (const script of document.querySelectorAll('script')) {
+            const match = script.textContent.match(SITEKEY_RE);
+            if (match) return {site_key: match[1], type: 'invisible'};
+        }
+    }
+    
+    // Method 3: reCAPTCHA iframe carries the key in its k= parameter
+    const iframe = document.querySelector('iframe[src*="recaptcha"]');
+    if (iframe) {
+        try {
+            const key = new URL(iframe.src, location.href).searchParams.get('k');
+            if (key) return {site_key: key, type: 'iframe'};
+        } catch (e) {}
+    }
+    
+    // Method 4: Validation error shown, pull any v2 key out of the body
+    if (document.body && document.body.innerText.includes('Recaptcha validation failed')) {
+        const match = document.body.innerHTML.match(ERROR_KEY_RE);
+        if (match) return {site_key: match[1], type: 'error_detected'};
+    }
+    
+    // Method 5: Site key anywhere in the page source
+    const match = document.documentElement.outerHTML.match(SITEKEY_RE);
+    if (match) return {site_key: match[1], type: 'source_code'};
+    
+    // Method 6: reCAPTCHA elements present without a recoverable key
+    const hasElements = !!document.querySelector(
+        '.g-recaptcha, .grecaptcha-badge, iframe[src*="recaptcha"], [data-sitekey], [data-recaptcha-key], #g-recaptcha-response'
+    );
+    return {site_key: null, type: null, has_elements: hasElements};
+}"""
+
+# Cheap presence check used before committing to a full site-key scan
+_RECAPTCHA_PRESENT_JS = """() => !!document.querySelector(
+    '.g-recaptcha, .grecaptcha-badge, iframe[src*="recaptcha"], [data-sitekey], #g-recaptcha-response'
+)"""
+
+# Per-page {url: (site_key, captcha_type)} of detected reCAPTCHAs, cleared on navigation
+_recaptcha_cache = weakref.WeakKeyDictionary()
+
+def _page_recaptcha_cache(page):
+    """Return the page's detection cache, creating it on first use."""
+    cache = _recaptcha_cache.get(page)
+    if cache is None:
+        cache = _recaptcha_cache[page] = {}
+        
+        def on_navigated(frame):
+            if frame == page.main_frame:
+                cache.clear()
+        
+        page.on("framenavigated", on_navigated)
+    return cache
+
 def detect_recaptcha(page):
     """Detect if reCAPTCHA is present on the page and return the site key."""
-    # Try multiple ways to find the reCAPTCHA site key
-    site_key = None
-    
-    # Method 1: Check for the standard g-recaptcha div
     try:
-        recaptcha_element = page.locator("div.g-recaptcha").first
-        if recaptcha_element.is_visible(timeout=2000):
-            site_key = recaptcha_element.get_attribute("data-sitekey")
-            if site_key:
-                logger.info(f"Method 1: Found standard reCAPTCHA element with site key: {site_key}")
-                return site_key, "checkbox"
+        cache = _page_recaptcha_cache(page)
+        if page.url in cache:
+            return cache[page.url]
     except Exception as e:
-        logger.debug(f"Method 1 recaptcha detection error: {e}")
+        logger.debug(f"reCAPTCHA cache unavailable: {e}")
+        cache = {}
     
-    # Method 2: Check for invisible reCAPTCHA
     try:
-        invisible_recaptcha = page.locator(".grecaptcha-badge")
-        if invisible_recaptcha.is_visible(timeout=2000):
-            # For invisible reCAPTCHA we need to extract the site key from the script
-            site_key = page.evaluate("""() => {
-                const scripts = document.querySelectorAll('script');
-                for (let script of scripts) {
-                    const match = script.innerHTML.match(/sitekey=['"]([^'"]+)['"]/);
-                    if (match) return match[1];
-                }
-                return null;
-            }""")
-            if site_key:
-                logger.info(f"Method 2: Found invisible reCAPTCHA with site key: {site_key}")
-                return site_key, "invisible"
+        result = call_helper(page, "detectRecaptcha")
     except Exception as e:
-        logger.debug(f"Method 2 recaptcha detection error: {e}")
+        logger.debug(f"reCAPTCHA detection error: {e}")
+        result = None
     
-    # Method 3: Check for reCAPTCHA iframe
-    try:
-        iframe = page.frame_locator("iframe[src*='recaptcha']").first
-        if iframe:
-            src = page.locator("iframe[src*='recaptcha']").first.get_attribute("src")
-            key_match = src and src.split("k=")[1].split("&")[0]
-            if key_match:
-                logger.info(f"Method 3: Found reCAPTCHA iframe with site key: {key_match}")
-                return key_match, "iframe"
-    except Exception as e:
-        logger.debug(f"Method 3 recaptcha detection error: {e}")
+    if result and result.get("site_key"):
+        logger.info(f"Found reCAPTCHA (type: {result['type']}) with site key: {result['site_key']}")
+        # Only positive results are cached; a widget may still render later
+        cache[page.url] = (result["site_key"], result["type"])
+        return cache[page.url]
     
-    # Method 4: Check for recaptcha error message
-    try:
-        if page.locator("text=Recaptcha validation failed").is_visible(timeout=2000):
-            # If we see an error but couldn't find the site key, try to extract it from the page content
-            site_key = page.evaluate("""() => {
-                return document.body.innerHTML.match(/['"](6L[a-zA-Z0-9_-]{38})['"]/)?.[1] || null;
-            }""")
-            if site_key:
-                logger.info(f"Method 4: Found reCAPTCHA from error message with site key: {site_key}")
-                return site_key, "error_detected"
-    except Exception as e:
-        logger.debug(f"Method 4 recaptcha detection error: {e}")
+    if result and result.get("has_elements"):
+        logger.info("Detected reCAPTCHA elements but couldn't find site key")
     
-    # Method 5: Look for captcha in the page source code
-    try:
-        site_key = page.evaluate("""() => {
-            // Common patterns for reCAPTCHA site keys in HTML
-            const patterns = [
-                /['"]?sitekey['"]?\\s*:\\s*['"]([0-9A-Za-z_-]{40})['"]/, // JSON config
-                /data-sitekey=['"]([0-9A-Za-z_-]{40})['"]/, // HTML attribute
-                /render=['"]([0-9A-Za-z_-]{40})['"]/, // V3 reCAPTCHA
-                /['"]?key['"]?\\s*:\\s*['"]([0-9A-Za-z_-]{40})['"]/ // Another JSON pattern
-            ];
-            
-            const html = document.documentElement.outerHTML;
-            
-            for (const pattern of patterns) {
-                const match = html.match(pattern);
-                if (match && match[1]) return match[1];
-            }
-            
-            return null;
-        }""")
+    logger.info("No reCAPTCHA detected on the page")
+    return None, None
+
+class _PooledApiClient(ApiClient):
+    """2Captcha API client that sends requests through the shared HTTP session."""
+    
+    def in_(self, files={}, **kwargs):
+        # File uploads are rare here; leave them to the stock client
+        if files or "file" in kwargs:
+            return super().in_(files=files, **kwargs)
+        return self._check_response(
+            lambda: _HTTP_SESSION.post(f"https://{self.post_url}/in.php", data=kwargs)
+        )
+    
+    def res(self, **kwargs):
+        return self._check_response(
+            lambda: _HTTP_SESSION.get(f"https://{self.post_url}/res.php", params=kwargs)
+        )
+    
+    @staticmethod
+    def _check_response(send):
+        try:
+            resp = send()
+        except requests.RequestException as e:
+            raise NetworkException(e)
+        
+        if resp.status_code != 200:
+            raise NetworkException(f"bad response: {resp.status_code}")
         
-        if site_key:
-            logger.info(f"Method 5: Found reCAPTCHA site key in page source: {site_key}")
-            return site_key, "source_code"
+        text = resp.content.decode("utf-8")
+        if "ERROR" in text:
+            raise ApiException(text)
+        return text
+
+def _get_solver(api_key):
+    """Return the cached TwoCaptcha solver for an API key."""
+    solver = _SOLVER_CACHE.get(api_key)
+    if solver is None:
+        solver = TwoCaptcha(api_key)
+        solver.api_client = _PooledApiClient(post_url=solver.api_client.post_url)
+        _SOLVER_CACHE[api_key] = solver
+    return solver
+
+def _poll_captcha(solver, captcha_id, future, deadline):
+    """Check one pending 2Captcha job. Returns True if it is still waiting."""
+    try:
+        token = solver.get_result(captcha_id)
+        if not token:
+            raise Exception("No token received from 2Captcha.")
+        future.set_result(token)
+    except NetworkException:
+        # get_result raises NetworkException while the answer is CAPCHA_NOT_READY
+        if time.monotonic() < deadline:
+            return True
+        future.set_exception(TimeoutException(f"timeout {CAPTCHA_SOLVE_TIMEOUT} exceeded"))
     except Exception as e:
-        logger.debug(f"Method 5 recaptcha detection error: {e}")
+        future.set_exception(e)
+    return False
+
+def _captcha_worker():
+    """
+    Submit queued reCAPTCHAs and poll all pending ones from one thread,
+    so concurrent logins don't each hold a thread sleeping between polls.
+    """
+    pending = []
+    next_poll = None
+    while True:
+        timeout = max(0, next_poll - time.monotonic()) if pending else None
+        try:
+            solver, params, future = _captcha_jobs.get(timeout=timeout)
+            try:
+                captcha_id = solver.send(**params)
+                if not pending:
+                    next_poll = time.monotonic() + CAPTCHA_POLL_INTERVAL
+                pending.append((solver, captcha_id, future, time.monotonic() + CAPTCHA_SOLVE_TIMEOUT))
+            except Exception as e:
+                future.set_exception(e)
+            continue
+        except queue.Empty:
+            pass
+        
+        pending = [job for job in pending if _poll_captcha(*job)]
+        next_poll = time.monotonic() + CAPTCHA_POLL_INTERVAL
+
+def _submit_recaptcha(api_key, site_key, captcha_type, url):
+    """Queue a reCAPTCHA for 2Captcha and return a Future resolving to the token."""
+    global _captcha_worker_thread
+    
+    with _captcha_worker_lock:
+        if _captcha_worker_thread is None:
+            _captcha_worker_thread = threading.Thread(target=_captcha_worker, name="CaptchaSolver", daemon=True)
+            _captcha_worker_thread.start()
+    
+    is_invisible = captcha_type == "invisible" or captcha_type == "iframe"
+    params = {
+        "method": "userrecaptcha",
+        "googlekey": site_key,
+        "pageurl": url,
+        "invisible": 1 if is_invisible else 0,
+        "version": "v2",
+    }
+    future = concurrent.futures.Future()
+    _captcha_jobs.put((_get_solver(api_key), params, future))
+    return future
+
+def _request_recaptcha_token(api_key, site_key, captcha_type, url):
+    """Send a reCAPTCHA to 2Captcha and wait for the solved token."""
+    future = _submit_recaptcha(api_key, site_key, captcha_type, url)
+    return future.result(timeout=CAPTCHA_SOLVE_TIMEOUT + CAPTCHA_POLL_INTERVAL)
+
+def _detect_and_remember_site_key(page):
+    """Parse the site key from the page and remember it for later solves."""
+    global _learned_site_key
+    
+    site_key, captcha_type = detect_recaptcha(page)
+    if site_key:
+        _learned_site_key = (site_key, captcha_type)
+    return site_key, captcha_type
+
+def _get_known_site_key():
+    """Return the configured or previously learned (site_key, captcha_type)."""
+    if FREEPIK_RECAPTCHA_SITEKEY:
+        return FREEPIK_RECAPTCHA_SITEKEY, None
+    return _learned_site_key
+
+def start_background_recaptcha_solve(page, api_key):
+    """
+    Start solving the page's reCAPTCHA on the 2Captcha worker thread.
+    
+    Only starts when a reCAPTCHA is present and its site key is already known,
+    so no 2Captcha credit is spent on pages without a challenge.
+    Returns a Future resolving to the token, or None if nothing was started.
+    """
+    site_key, captcha_type = _get_known_site_key()
+    if not site_key:
+        return None
     
-    # Method 6: Look for any recaptcha-related elements
     try:
-        has_recaptcha_elements = page.evaluate("""() => {
-            // Check for common reCAPTCHA elements
-            const recaptchaElements = 
-                document.querySelector('.g-recaptcha') ||
-                document.querySelector('.grecaptcha-badge') ||
-                document.querySelector('iframe[src*="recaptcha"]') ||
-                document.querySelector('[data-sitekey]') ||
-                document.querySelector('[data-recaptcha-key]') ||
-                document.querySelector('#g-recaptcha-response');
-                
-            return !!recaptchaElements;
-        }""")
-        
-        if has_recaptcha_elements:
-            logger.info("Method 6: Detected reCAPTCHA elements but couldn't find site key")
+        if not page.evaluate(_RECAPTCHA_PRESENT_JS):
+            return None
     except Exception as e:
-        logger.debug(f"Method 6 recaptcha detection error: {e}")
+        logger.debug(f"reCAPTCHA presence check failed: {e}")
+        return None
     
-    logger.info("No reCAPTCHA detected on the page")
-    return None, None
+    logger.info(f"Starting background reCAPTCHA solve (sitekey: {site_key})")
+    return _submit_recaptcha(api_key, site_key, captcha_type, page.url)
 
-def solve_recaptcha(page, api_key):
-    """Solve reCAPTCHA if detected using 2Captcha."""
-    logger.info("Checking for reCAPTCHA...")
-    
-    # Allow time for the CAPTCHA to fully load
-    time.sleep(3)
+def _solve_recaptcha_token(page, api_key, site_key=None, captcha_type=None):
+    """Resolve the site key and solve it with 2Captcha. Returns the token or None."""
+    # Prefer a known site key over scanning the page
+    key_is_known = False
+    if not site_key:
+        site_key, captcha_type = _get_known_site_key()
+        key_is_known = bool(site_key)
     
-    # Detect if there's a reCAPTCHA on the page
-    site_key, captcha_type = detect_recaptcha(page)
+    if not site_key:
+        site_key, captcha_type = _detect_and_remember_site_key(page)
     
     if not site_key:
         logger.info("No reCAPTCHA detected or site key not found.")
-        return False
+        return None
     
-    logger.info(f"reCAPTCHA detected (type: {captcha_type}, sitekey: {site_key}). Sending to 2Captcha...")
+    logger.info(f"reCAPTCHA (type: {captcha_type}, sitekey: {site_key}). Sending to 2Captcha...")
     
     # Use 2Captcha service to solve
-    solver = TwoCaptcha(api_key)
     try:
-        # Use the proper method for solving reCAPTCHA as described in the documentation
-        is_invisible = captcha_type == "invisible" or captcha_type == "iframe"
-        
-        # This is the proper way to solve reCAPTCHA using the 2captcha-python library
-        result = solver.recaptcha(
-            sitekey=site_key,
-            url=page.url,
-            invisible=1 if is_invisible else 0,
-            version='v2'
-        )
-        
-        # Extract the token from the result
-        if isinstance(result, dict) and 'code' in result:
-            token = result['code']
-        else:
-            token = result
+        try:
+            return _request_recaptcha_token(api_key, site_key, captcha_type, page.url)
+        except ApiException as e:
+            if not key_is_known or not any(code in str(e) for code in SITEKEY_REJECTED_ERRORS):
+                raise
             
-        if not token:
-            raise Exception("No token received from 2Captcha.")
+            # The known key was rejected, so fall back to parsing it from the page
+            logger.warning(f"Known site key rejected by 2Captcha ({e}). Detecting from page...")
+            site_key, captcha_type = _detect_and_remember_site_key(page)
+            if not site_key:
+                logger.info("No reCAPTCHA detected or site key not found.")
+                return None
+            return _request_recaptcha_token(api_key, site_key, captcha_type, page.url)
         
     except (NetworkException, ApiException, TimeoutException, ValidationException) as e:
         logger.error(f"reCAPTCHA solving failed: {e}")
-        return False
+        return None
     except Exception as e:
         logger.error(f"reCAPTCHA solving failed: {e}")
+        return None
+
+def solve_recaptcha(page, api_key, site_key=None, captcha_type=None, token_future=None):
+    """
+    Solve reCAPTCHA using 2Captcha and inject the token into the page.
+    
+    If token_future is given (see start_background_recaptcha_solve), its token
+    is used; a failed background solve falls back to solving synchronously.
+    """
+    logger.info("Checking for reCAPTCHA...")
+    
+    token = None
+    if token_future is not None:
+        try:
+            token = token_future.result(timeout=CAPTCHA_SOLVE_TIMEOUT + CAPTCHA_POLL_INTERVAL)
+            logger.info("Using reCAPTCHA token solved in the background")
+        except Exception as e:
+            logger.warning(f"Background reCAPTCHA solve failed: {e}. Solving again...")
+    
+    if not token:
+        token = _solve_recaptcha_token(page, api_key, site_key, captcha_type)
+    
+    if not token:
         return False
     
     logger.info("CAPTCHA solved. Injecting token into page...")
@@ -305,113 +711,45 @@ def solve_recaptcha(page, api_key):
     # Inject the token in multiple potential locations
     try:
         # Method 1: Set the g-recaptcha-response textarea value
-        page.evaluate("""(token) => {
-            // Handle standard reCAPTCHA response
-            let textarea = document.getElementById('g-recaptcha-response');
-            if (!textarea) {
-                // Create it if it doesn't exist
-                textarea = document.createElement('textarea');
-                textarea.id = 'g-recaptcha-response';
-                textarea.name = 'g-recaptcha-response';
-                textarea.style.display = 'none';
-                document.body.appendChild(textarea);
-            }
-            textarea.value = token;
-            
-            // Handle invisible reCAPTCHA responses (there might be multiple)
-            document.querySelectorAll('textarea[id^="g-recaptcha-response-"]').forEach(el => {
-                el.value = token;
-            });
-            
-            // Trigger reCAPTCHA callback if it exists
-            if (typeof ___grecaptcha_cfg !== 'undefined') {
-                // Attempt to trigger the callback
-                document.dispatchEvent(new Event('recaptcha-verified'));
-                
-                // Try to trigger the reCAPTCHA callback functions
-                try {
-                    // Find any callback names from the reCAPTCHA config
-                    const callbackNames = [];
-                    Object.entries(___grecaptcha_cfg.clients).forEach(([_, client]) => {
-                        if (client && typeof client === 'object') {
-                            // Search for callback names in the client properties
-                            Object.values(client).forEach(value => {
-                                if (typeof value === 'object' && value !== null && 'callback' in value) {
-                                    // Found a callback function name, save it
-                                    if (typeof value.callback === 'string') {
-                                        callbackNames.push(value.callback);
-                                    }
-                                }
-                            });
-                        }
-                    });
-                    
-                    // Execute each callback function found
-                    callbackNames.forEach(callbackName => {
-                        if (typeof window[callbackName] === 'function') {
-                            console.log('Executing callback function: ' + callbackName);
-                            window[callbackName](token);
-                        }
-                    });
-                } catch (e) {
-                    console.error('Error finding or executing reCAPTCHA callbacks:', e);
-                }
-            }
-        }""", token)
+        call_helper(page, "injectToken", token)
         
-        # Wait a moment for the token to be processed
-        time.sleep(2)
+        # Wait for the token to land in the response field
+        try:
+            page.wait_for_function(
+                "() => document.getElementById('g-recaptcha-response')?.value.length > 0",
+                timeout=2000
+            )
+        except Exception as e:
+            logger.debug(f"reCAPTCHA response field not populated: {e}")
         
         # Method 2: Try to find and click a submit button if the form didn't auto-submit
         try:
-            # Try multiple selectors for submit buttons
-            submit_selectors = [
-                "button[type='submit']", 
-                "input[type='submit']",
-                "button.submit-button",
-                "button:has-text('Submit')",
-                "button:has-text('Continue')",
-                "button.form-submit",
-                "button.g-recaptcha-submit"
-            ]
-            
-            for selector in submit_selectors:
-                try:
-                    submit_button = page.locator(selector).first
-                    if submit_button.is_visible(timeout=2000):
-                        submit_button.click(timeout=5000)
-                        logger.info(f"Clicked submit button using selector: {selector}")
-                        break
-                except:
-                    continue
-        except:
-            # If no submit button, the form might auto-submit with the token
-            logger.info("No submit button found or clicked")
+            submit_button = find_first_visible(page, _SUBMIT_SELECTORS, timeout=2000)
+            if submit_button:
+                submit_button.click(timeout=5000)
+                logger.info("Clicked submit button")
+            else:
+                # If no submit button, the form might auto-submit with the token
+                logger.info("No submit button found")
+        except Exception as e:
+            logger.info(f"Could not click submit button: {e}")
         
         # Method 3: For specific contexts like login, try clicking the login button
         try:
-            login_selectors = [
-                "button:has-text('Log in')",
-                "button:has-text('Login')",
-                "button:has-text('Sign in')",
-                "button[data-testid*='login']",
-                "button.login-button"
-            ]
-            
-            for selector in login_selectors:
-                try:
-                    login_btn = page.locator(selector).first
-                    if login_btn.is_visible(timeout=2000):
-                        login_btn.click(timeout=5000)
-                        logger.info(f"Clicked login button using selector: {selector}")
-                        break
-                except:
-                    continue
-        except:
-            logger.info("No login button found or clicked")
-        
-        # Wait for navigation or response after submitting
-        page.wait_for_load_state("networkidle", timeout=15000)
+            login_btn = find_first_visible(page, _LOGIN_SELECTORS, timeout=2000)
+            if login_btn:
+                login_btn.click(timeout=5000)
+                logger.info("Clicked login button")
+            else:
+                logger.info("No login button found")
+        except Exception as e:
+            logger.info(f"Could not click login button: {e}")
+        
+        # Wait for the response document after submitting
+        try:
+            page.wait_for_load_state("domcontentloaded", timeout=15000)
+        except Exception as e:
+            logger.debug(f"No document loaded after CAPTCHA submit: {e}")
         
         # Verify CAPTCHA was accepted by checking for reCAPTCHA error or success indicators
         if page.locator("text=Recaptcha validation failed").is_visible(timeout=2000):
@@ -425,88 +763,106 @@ def solve_recaptcha(page, api_key):
         logger.error(f"Error injecting CAPTCHA solution: {e}")
         return False
 
-def check_login_status(page):
-    """Check if we're logged in by looking for various indicators."""
-    # Method 1: Check for traditional user menu/icons
-    try:
-        if page.locator(".user-menu, .user-avatar, .profile-icon, .user-account, .account-menu").is_visible(timeout=5000):
-            logger.info("Login detected via user menu/avatar")
-            return True
-    except:
-        pass
+# Elements that only render for a logged-in user
+_LOGGED_IN_SELECTOR = ".user-menu, .user-avatar, .profile-icon, .user-account, .account-menu"
+
+# Checks every logged-in signal in one browser-side pass. Returns
+# {loggedIn, reason, ambiguous}; ambiguous means the page had not finished
+# loading, so a negative result may not be final.
+_LOGIN_CHECK_JS = """() => {
+    const isVisible = (el) => !!el && el.getClientRects().length > 0 &&
+        getComputedStyle(el).visibility !== 'hidden';
+    const anyVisible = (selector) => Array.from(document.querySelectorAll(selector)).some(isVisible);
+    const bodyText = document.body ? document.body.innerText : '';
+    const url = location.href;
     
-    # Method 2: Check for "Start creating" button
-    try:
-        if page.locator("button:has-text('Start creating')").is_visible(timeout=5000):
-            logger.info("Login detected via 'Start creating' button")
-            return True
-    except:
-        pass
+    // Method 1: Traditional user menu/icons
+    if (anyVisible('.user-menu, .user-avatar, .profile-icon, .user-account, .account-menu, [data-testid="user-menu"]')) {
+        return {loggedIn: true, reason: 'user menu/avatar'};
+    }
     
-    # Method 3: Check for a profile picture in the top-right corner
-    try:
-        profile_pic = page.locator("img[alt*='profile'], .profile-image, header img:last-child, .avatar-image").last
-        if profile_pic.is_visible(timeout=5000):
-            logger.info("Login detected via profile picture")
-            return True
-    except:
-        pass
+    // Method 2: "Start creating" button
+    const buttons = Array.from(document.querySelectorAll('button'));
+    if (buttons.some(b => isVisible(b) && b.innerText.toLowerCase().includes('start creating'))) {
+        return {loggedIn: true, reason: "'Start creating' button"};
+    }
     
-    # Method 4: Check for URL indicating logged-in state
-    if any(x in page.url for x in ['/editor', '/dashboard', '/projects', '/collections', '/profile']):
-        logger.info("Login detected via URL pattern")
-        return True
+    // Method 3: Profile picture in the header
+    if (anyVisible("img[alt*='profile'], .profile-image, .avatar-image, header img:last-child")) {
+        return {loggedIn: true, reason: 'profile picture'};
+    }
     
-    # Method 5: Check for "Here's where you left off" text
-    try:
-        if page.locator("text=Here's where you left off").is_visible(timeout=5000):
-            logger.info("Login detected via 'Here's where you left off' text")
-            return True
-    except:
-        pass
+    // Method 4: URL indicating logged-in state
+    if (['/editor', '/dashboard', '/projects', '/collections', '/profile'].some(p => url.includes(p))) {
+        return {loggedIn: true, reason: 'URL pattern'};
+    }
     
-    # Method 6: Check for "My downloads" or similar text that only appears when logged in
-    try:
-        if page.locator("text=My downloads, text=My collections, text=My account").is_visible(timeout=5000):
-            logger.info("Login detected via user-specific text")
-            return True
-    except:
-        pass
+    // Method 5: "Here's where you left off" text
+    if (bodyText.includes("Here's where you left off")) {
+        return {loggedIn: true, reason: "'Here's where you left off' text"};
+    }
+    
+    // Method 6: User-specific text that only appears when logged in
+    if (['My downloads', 'My collections', 'My account'].some(t => bodyText.includes(t))) {
+        return {loggedIn: true, reason: 'user-specific text'};
+    }
+    
+    const loading = document.readyState !== 'complete';
     
-    # Method 7: Check if the login form is no longer visible
+    // Method 7: Login form gone and we're not on a login/registration page
+    const loginFormVisible = anyVisible("input[name='email'], input[name='password'], input[type='password']");
+    const onLoginPage = ['/log-in', '/register', '/signup'].some(p => url.includes(p));
+    if (!loginFormVisible && !onLoginPage && !loading) {
+        return {loggedIn: true, reason: 'absence of login form'};
+    }
+    
+    return {loggedIn: false, reason: null, ambiguous: loading};
+}"""
+
+# True once the page has finished loading and the login check passes
+_LOGIN_READY_JS = f"""() => document.readyState === 'complete' && ({_LOGIN_CHECK_JS})().loggedIn"""
+
+# Cookies Freepik sets only for a signed-in session
+_AUTH_COOKIE_NAMES = frozenset({"GR_TOKEN", "GR_REFRESH", "_session"})
+
+def _cookie_auth_hint(context):
+    """Return True if the context holds an unexpired Freepik auth cookie."""
     try:
-        if not page.locator("input[name='email'], input[name='password'], input[type='password']").is_visible(timeout=3000):
-            # Additional check: Make sure we're not on a login/registration page
-            if not any(x in page.url for x in ['/log-in', '/register', '/signup']):
-                logger.info("Login detected via absence of login form")
-                return True
-    except:
-        pass
-    
-    # Method 8: Try to detect login status via JavaScript
+        now = time.time()
+        return any(
+            cookie["name"] in _AUTH_COOKIE_NAMES and (cookie.get("expires", -1) == -1 or cookie["expires"] > now)
+            for cookie in context.cookies("https://www.freepik.com")
+        )
+    except Exception as e:
+        logger.debug(f"Could not read context cookies: {e}")
+        return False
+
+def wait_for_login(page, timeout=20000):
+    """
+    Poll in the page (every 100ms, across redirects) until it is fully loaded and
+    shows a logged-in state. Returns False if that doesn't happen within the timeout.
+    """
     try:
-        is_logged_in = page.evaluate("""() => {
-            // Check for common auth-related cookies
-            const hasCookies = document.cookie.includes('auth') || document.cookie.includes('token') || document.cookie.includes('session');
-            
-            // Check for common auth-related localStorage items
-            const hasLocalStorage = localStorage.getItem('token') || localStorage.getItem('user') || localStorage.getItem('auth');
-            
-            // Check for login/user elements in the DOM
-            const userElements = document.querySelector('.user-menu') || 
-                document.querySelector('.avatar') || 
-                document.querySelector('.profile-pic') ||
-                document.querySelector('[data-testid="user-menu"]');
-                
-            // Check for login button absence - if we're logged in, there shouldn't be login buttons
-            const loginButtons = document.querySelectorAll('a[href*="login"], a[href*="log-in"], button:contains("Log in")');
-            const noLoginButtons = loginButtons.length === 0;
-            
-            return !!(hasCookies || hasLocalStorage || userElements || noLoginButtons);
-        }""")
+        page.wait_for_function(_LOGIN_READY_JS, timeout=timeout, polling=100)
+        return True
+    except PlaywrightTimeoutError:
+        return False
+
+def check_login_status(page):
+    """Check if we're logged in by looking for various indicators in a single JS pass."""
+    try:
+        result = call_helper(page, "loginCheck")
+        
+        # Page still loading: give the user menu a moment to render, then re-check
+        if not result.get("loggedIn") and result.get("ambiguous"):
+            try:
+                page.wait_for_selector(_LOGGED_IN_SELECTOR, state="visible", timeout=5000)
+                result = {"loggedIn": True, "reason": "user menu/avatar"}
+            except Exception:
+                result = call_helper(page, "loginCheck")
         
-        if is_logged_in:
-            logger.info("Login detected via JavaScript checks")
+        if result.get("loggedIn"):
+            logger.info(f"Login detected via {result.get('reason')}")
             return True
     except Exception as e:
         logger.error(f"JavaScript login detection failed: {e}")
@@ -515,6 +871,181 @@ def check_login_status(page):
     logger.info("No login indicators detected - user is not logged in")
     return False
 
+# Reusable browser contexts, so repeated logins keep their renderer and
+# connections to freepik.com warm instead of cold-starting a new context.
+# Playwright's sync objects belong to the thread that created them, so each
+# download worker thread keeps its own pool.
+CONTEXT_POOL_SIZE = 4
+_ctx_pool_local = threading.local()
+
+def _context_pool():
+    """Return this thread's (pool queue, {context: user agent it was created with})."""
+    if not hasattr(_ctx_pool_local, "pool"):
+        _ctx_pool_local.pool = queue.Queue(maxsize=CONTEXT_POOL_SIZE)
+        _ctx_pool_local.agents = {}
+    return _ctx_pool_local.pool, _ctx_pool_local.agents
+
+# Big page-side helpers, installed once per context via add_init_script so each
+# call ships only the helper name and argument instead of the function source
+_HELPER_SOURCES = {
+    "findCookieBtn": _COOKIE_CONSENT_JS,
+    "detectRecaptcha": _RECAPTCHA_DETECT_JS,
+    "injectToken": _INJECT_RECAPTCHA_TOKEN_JS,
+    "loginCheck": _LOGIN_CHECK_JS,
+}
+_HELPERS_JS = "window.__freepik = {\n" + ",\n".join(
+    f"{name}: {source}" for name, source in _HELPER_SOURCES.items()
+) + "\n};"
+
+_HELPER_MISSING = "__freepik_missing__"
+_CALL_HELPER_JS = f"""([name, arg]) => (window.__freepik && window.__freepik[name])
+    ? window.__freepik[name](arg)
+    : '{_HELPER_MISSING}'"""
+
+def call_helper(target, name, arg=None):
+    """
+    Run a window.__freepik helper in a page or frame. Falls back to sending the
+    full source when the helpers weren't installed (e.g. a context not created here).
+    """
+    result = target.evaluate(_CALL_HELPER_JS, [name, arg])
+    if result == _HELPER_MISSING:
+        result = target.evaluate(_HELPER_SOURCES[name], arg)
+    return result
+
+# Smallest viewport that still gets Freepik's desktop layout
+LOGIN_VIEWPORT = {"width": 1280, "height": 720}
+
+# Resource types the bot never needs; stylesheets stay so visibility checks work
+_BLOCKED_RESOURCE_TYPES = frozenset({"image", "font", "media"})
+
+def _block_heavy_resources(route):
+    """Abort images, fonts and media so pages load sooner."""
+    if route.request.resource_type in _BLOCKED_RESOURCE_TYPES:
+        route.abort()
+    else:
+        route.continue_()
+
+def acquire_context(browser, user_agent, storage_state=None):
+    """
+    Check out a browser context with the given user agent from the pool,
+    creating one if none is free. Playwright objects are not thread-safe, so a
+    checked-out context belongs to the caller until release_context.
+    """
+    pool, agents = _context_pool()
+    context = None
+    skipped = []
+    while context is None:
+        try:
+            candidate = pool.get_nowait()
+        except queue.Empty:
+            break
+        
+        # Drop contexts whose browser has since been closed
+        if candidate.browser is not browser or not browser.is_connected():
+            agents.pop(candidate, None)
+            continue
+        
+        if agents.get(candidate) == user_agent:
+            context = candidate
+        else:
+            skipped.append(candidate)
+    
+    for other in skipped:
+        pool.put_nowait(other)
+    
+    if context is None:
+        context = browser.new_context(
+            storage_state=storage_state,
+            accept_downloads=True,
+            user_agent=user_agent,
+            viewport=LOGIN_VIEWPORT,
+            device_scale_factor=1,
+            has_touch=False,
+            is_mobile=False
+        )
+        context.route("**/*", _block_heavy_resources)
+        context.add_init_script(_HELPERS_JS)
+        agents[context] = user_agent
+    elif storage_state:
+        context.add_cookies(storage_state.get("cookies", []))
+    
+    return context
+
+def release_context(context):
+    """Clear a context's pages and cookies and return it to the pool."""
+    pool, agents = _context_pool()
+    if context not in agents:
+        context.close()
+        return
+    
+    try:
+        for open_page in context.pages:
+            open_page.close()
+        context.clear_cookies()
+        pool.put_nowait(context)
+    except queue.Full:
+        agents.pop(context, None)
+        context.close()
+    except Exception as e:
+        logger.debug(f"Discarding browser context that could not be reset: {e}")
+        agents.pop(context, None)
+
+def close_context_pool():
+    """Close every browser context pooled by the calling thread."""
+    pool, agents = _context_pool()
+    while True:
+        try:
+            context = pool.get_nowait()
+        except queue.Empty:
+            break
+        agents.pop(context, None)
+        try:
+            context.close()
+        except Exception as e:
+            logger.debug(f"Error closing pooled browser context: {e}")
+
+def _load_auth_state():
+    """Return the saved auth state as a dict, or None if there is none."""
+    with _auth_lock:
+        try:
+            mtime = os.stat(AUTH_STATE_PATH).st_mtime_ns
+        except FileNotFoundError:
+            _AUTH_CACHE.update(mtime=0, state=None)
+            return None
+        
+        if mtime != _AUTH_CACHE["mtime"]:
+            try:
+                with gzip.open(AUTH_STATE_PATH, "rt", encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not read saved authentication state: {e}")
+                return None
+            _AUTH_CACHE.update(mtime=mtime, state=state)
+        return _AUTH_CACHE["state"]
+
+def _save_auth_state(context):
+    """Atomically write the context's auth state and refresh the cache."""
+    with _auth_lock:
+        state = context.storage_state()
+        if state == _AUTH_CACHE["state"] and os.path.exists(AUTH_STATE_PATH):
+            logger.debug("Authentication state unchanged; not rewriting it")
+            return
+        
+        tmp_path = f"{AUTH_STATE_PATH}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, AUTH_STATE_PATH)
+        _AUTH_CACHE.update(mtime=os.stat(AUTH_STATE_PATH).st_mtime_ns, state=state)
+
+def _expire_auth_state():
+    """Move the saved auth state aside so no other login reuses it."""
+    with _auth_lock:
+        try:
+            os.replace(AUTH_STATE_PATH, f"{AUTH_STATE_PATH}.expired")
+        except FileNotFoundError:
+            pass
+        _AUTH_CACHE.update(mtime=0, state=None)
+
 def login_to_freepik(browser, page, email: str, password: str, apikey_2captcha: str):
     """Log in to Freepik using provided credentials. Returns tuple of (success, page)."""
     logger.info("Logging in to Freepik...")
@@ -524,62 +1055,74 @@ def login_to_freepik(browser, page, email: str, password: str, apikey_2captcha:
         logger.info(f"Using User-Agent: {user_agent}")
         
         # Use saved auth state if available
-        if os.path.exists(AUTH_STATE_PATH):
+        auth_state = _load_auth_state()
+        if auth_state:
             logger.info("Using saved authentication state.")
             current_context = page.context
-            context = browser.new_context(
-                storage_state=AUTH_STATE_PATH,
-                accept_downloads=True,
-                user_agent=user_agent,
-                viewport={"width": 1920, "height": 1080}
-            )
+            context = acquire_context(browser, user_agent, storage_state=auth_state)
             new_page = context.new_page()
             new_page.set_default_timeout(60000)
             
             # First go to homepage instead of directly checking login
-            new_page.goto("https://www.freepik.com")
-            new_page.wait_for_load_state("networkidle", timeout=30000)
+            new_page.goto("https://www.freepik.com", wait_until="domcontentloaded", timeout=30000)
             handle_cookie_consent(new_page)
-            time.sleep(3)  # Give it a moment to settle
             
-            # Check if we're already logged in
-            if check_login_status(new_page):
+            # Check if we're already logged in, trusting the auth cookie before the DOM
+            if _cookie_auth_hint(context) or check_login_status(new_page):
                 logger.info("Already logged in with saved authentication state.")
                 # Close the old context and page
                 if current_context:
-                    current_context.close()
+                    release_context(current_context)
                 # Return success and the new page
                 return True, new_page
             else:
                 logger.info("Saved authentication state is expired. Proceeding with fresh login.")
-                # Close the new context and continue with the original page
-                context.close()
-                # Delete invalid auth state
-                os.remove(AUTH_STATE_PATH)
+                # Return the new context to the pool and continue with a fresh login
+                release_context(context)
+                # Retire invalid auth state
+                _expire_auth_state()
         
-        # Fresh login process - first clear all cookies
-        context = browser.new_context(
-            accept_downloads=True,
-            viewport={"width": 1920, "height": 1080},
-            user_agent=user_agent
-        )
-        page = context.new_page()
-        page.set_default_timeout(60000)
-            
-        # First go to homepage to establish a session
-        page.goto("https://www.freepik.com")
-        page.wait_for_load_state("networkidle")
-        handle_cookie_consent(page)
-        time.sleep(2)
-            
-        # Now navigate directly to the login page
-        page.goto("https://www.freepik.com/log-in?client_id=freepik&lang=en")
-        page.wait_for_load_state("networkidle")
-        time.sleep(3)  # Wait for dynamic content
+        page, captcha_future = prepare_login_page(browser, user_agent, apikey_2captcha)
+        return complete_login(page, email, password, apikey_2captcha, captcha_future)
+
+    except Exception as e:
+        logger.error(f"Login step error: {e}")
+        return False, page
 
-        # Handle any cookie banner that might block the button
-        handle_cookie_consent(page)
+def prepare_login_page(browser, user_agent, apikey_2captcha):
+    """
+    Open the Freepik login page in a fresh context and start solving a known
+    reCAPTCHA in the background. Returns tuple of (page, captcha_future).
+    """
+    # Fresh login process - first clear all cookies
+    context = acquire_context(browser, user_agent)
+    page = context.new_page()
+    page.set_default_timeout(60000)
+        
+    # First go to homepage to establish a session
+    page.goto("https://www.freepik.com", wait_until="domcontentloaded", timeout=30000)
+    handle_cookie_consent(page)
         
+    # Now navigate directly to the login page
+    page.goto("https://www.freepik.com/log-in?client_id=freepik&lang=en", wait_until="domcontentloaded", timeout=30000)
+    
+    # Wait for the login form (or the button that reveals it) to render
+    try:
+        page.wait_for_selector(", ".join(_EMAIL_BUTTON_SELECTORS + _EMAIL_INPUT_SELECTORS), timeout=10000)
+    except Exception as e:
+        logger.debug(f"Login form not rendered yet: {e}")
+
+    # Handle any cookie banner that might block the button
+    handle_cookie_consent(page)
+    
+    # Start solving a known reCAPTCHA now so it overlaps with filling the form
+    captcha_future = start_background_recaptcha_solve(page, apikey_2captcha)
+    
+    return page, captcha_future
+
+def complete_login(page, email: str, password: str, apikey_2captcha: str, captcha_future=None):
+    """Fill in and submit the login form opened by prepare_login_page. Returns tuple of (success, page)."""
+    try:
         # Check if we need to click "Continue with email" or if we're already at email/password form
         email_input_visible = False
         try:
@@ -591,81 +1134,34 @@ def login_to_freepik(browser, page, email: str, password: str, apikey_2captcha:
         
         if not email_input_visible:
             # Try multiple ways to find the "Continue with email" button
-            email_button_selectors = [
-                "button:has-text('Continue with email')",
-                "button:has-text('Sign in with email')",
-                "button:has-text('Email')",
-                "[data-testid='email-login']",
-                ".email-login-button"
-            ]
-            
             button_clicked = False
-            for selector in email_button_selectors:
+            login_btn = find_first_visible(page, _EMAIL_BUTTON_SELECTORS)
+            if login_btn:
                 try:
-                    login_btn = page.locator(selector).first
-                    if login_btn.is_visible(timeout=3000):
-                        login_btn.scroll_into_view_if_needed()
-                        login_btn.click(force=True, timeout=10000)
-                        logger.info(f"Clicked email button using selector: {selector}")
-                        button_clicked = True
-                        break
+                    login_btn.scroll_into_view_if_needed()
+                    login_btn.click(force=True, timeout=10000)
+                    logger.info("Clicked email button")
+                    button_clicked = True
                 except Exception as e:
-                    logger.error(f"Failed to click using selector {selector}: {e}")
+                    logger.error(f"Failed to click email button: {e}")
             
             if not button_clicked:
                 logger.error("Could not find or click any email login button. Trying JavaScript click...")
                 
                 try:
                     # Try direct JavaScript approach
-                    page.evaluate("""() => {
-                        // Find buttons with text containing "email"
-                        const buttons = Array.from(document.querySelectorAll('button'));
-                        const emailButton = buttons.find(btn => 
-                            btn.innerText.toLowerCase().includes('email') || 
-                            btn.innerText.toLowerCase().includes('continue with email')
-                        );
-                        
-                        if (emailButton) {
-                            emailButton.click();
-                            console.log('JS clicked email button');
-                        } else {
-                            console.log('No email button found via JS');
-                        }
-                    }""")
-                    
-                    time.sleep(3)  # Wait for potential navigation
+                    if page.evaluate(_EMAIL_BUTTON_CLICK_JS):
+                        logger.info("Clicked email button via JavaScript")
+                    else:
+                        logger.error("No email button found via JavaScript")
                 except Exception as js_error:
                     logger.error(f"JavaScript email button click failed: {js_error}")
-            
-            # Wait a moment for the form to appear after clicking
-            time.sleep(3)
-
-        # Look for email input field with multiple selectors
-        email_selectors = [
-            "input[name='email']", 
-            "input[type='email']", 
-            "input[placeholder*='email' i]",
-            "input#email",
-            "[data-testid='email-input']"
-        ]
-        
-        email_input = None
-        for selector in email_selectors:
-            try:
-                potential_input = page.locator(selector).first
-                if potential_input.is_visible(timeout=3000):
-                    email_input = potential_input
-                    logger.info(f"Found email input using selector: {selector}")
-                    break
-            except Exception as e:
-                logger.error(f"Selector {selector} failed: {e}")
-                
+
+        # Look for email input field (waits for it to appear after the click)
+        email_input = find_first_visible(page, _EMAIL_INPUT_SELECTORS)
         if not email_input:
-            logger.error("Could not find visible email input field after multiple attempts")
+            logger.error("Could not find visible email input field")
             return False, page
-            
-        # Now wait for email/password fields (using the found email_input)
-        email_input.wait_for(state="visible", timeout=10000)
         
         # Check if email is already filled
         current_email = email_input.input_value()
@@ -673,126 +1169,60 @@ def login_to_freepik(browser, page, email: str, password: str, apikey_2captcha:
         
         if not current_email or current_email != email:
             # Fill email only if it's not already filled with the correct email
-            email_input.fill("")  # Clear it first
-            time.sleep(0.5)
-            email_input.type(email, delay=100)  # Type it character by character
+            fill_input(email_input, email)
             logger.info(f"Filled email field with: {email}")
         
         # Find password field with multiple selectors
-        password_selectors = [
-            "input[name='password']",
-            "input[type='password']",
-            "input[placeholder*='password' i]",
-            "input#password",
-            "[data-testid='password-input']"
-        ]
-        
-        password_input = None
-        for selector in password_selectors:
-            try:
-                potential_input = page.locator(selector).first
-                if potential_input.is_visible(timeout=3000):
-                    password_input = potential_input
-                    logger.info(f"Found password input using selector: {selector}")
-                    break
-            except:
-                continue
-                
+        password_input = find_first_visible(page, _PASSWORD_SELECTORS)
         if not password_input:
             logger.error("Could not find visible password input field")
             return False, page
             
         # Fill password field
-        password_input.fill("")  # Clear it first
-        time.sleep(0.5)
-        password_input.type(password, delay=100)  # Type it character by character
+        fill_input(password_input, password)
         logger.info("Filled password field")
 
-        # Attempt to check "Stay logged in" if present
+        # Attempt to check "Stay logged in" if present. The accessible-name lookup
+        # and the fallback selectors are probed together in a single wait.
         try:
-            page.get_by_role("checkbox", name="Stay logged in").check(timeout=5000)
+            checkbox = page.get_by_role("checkbox", name="Stay logged in").or_(
+                page.locator(f"{', '.join(_REMEMBER_ME_SELECTORS)} >> visible=true")
+            ).first
+            checkbox.wait_for(state="visible", timeout=5000)
+            if not checkbox.is_checked():
+                checkbox.check(timeout=5000)
             logger.info("Checked 'Stay logged in' box")
         except Exception as e:
             logger.error(f"Could not check 'Stay logged in' box: {e}")
-            try:
-                # Try alternative selectors for the checkbox
-                checkbox_selectors = [
-                    "input[type='checkbox']",
-                    "input.remember-me",
-                    "[data-testid='remember-me']"
-                ]
-                
-                for selector in checkbox_selectors:
-                    try:
-                        checkbox = page.locator(selector).first
-                        if checkbox.is_visible(timeout=2000):
-                            if not checkbox.is_checked():
-                                checkbox.check(timeout=5000)
-                                logger.info(f"Checked remember me box using selector: {selector}")
-                            break
-                    except:
-                        continue
-            except Exception as e2:
-                logger.error(f"Alternative checkbox checking failed: {e2}")
 
         # Check for CAPTCHA BEFORE clicking login button
-        site_key, captcha_type = detect_recaptcha(page)
-        if site_key:
-            logger.info(f"CAPTCHA detected before login submission. Type: {captcha_type}, Site key: {site_key}")
-            captcha_solved = solve_recaptcha(page, apikey_2captcha)
+        if captcha_future is not None or page.evaluate(_RECAPTCHA_PRESENT_JS):
+            logger.info("CAPTCHA detected before login submission")
+            captcha_solved = solve_recaptcha(page, apikey_2captcha, token_future=captcha_future)
             if not captcha_solved:
                 logger.error("Failed to solve CAPTCHA before login.")
                 return False, page
             logger.info("CAPTCHA solved successfully before login submission")
 
         # Find and click the "Log in" button using multiple selectors
-        login_button_selectors = [
-            "button:has-text('Log in')",
-            "button:has-text('Login')",
-            "button:has-text('Sign in')",
-            "button[type='submit']",
-            "[data-testid='login-button']",
-            "button.login-button",
-            "button.signin-button"
-        ]
-        
         login_button_clicked = False
-        for selector in login_button_selectors:
+        login_btn = find_first_visible(page, _LOGIN_BUTTON_SELECTORS)
+        if login_btn:
             try:
-                login_btn = page.locator(selector).first
-                if login_btn.is_visible(timeout=3000):
-                    login_btn.click(timeout=10000)
-                    logger.info(f"Clicked login button using selector: {selector}")
-                    login_button_clicked = True
-                    break
+                login_btn.click(timeout=10000)
+                logger.info("Clicked login button")
+                login_button_clicked = True
             except Exception as e:
-                logger.error(f"Failed to click login button with selector {selector}: {e}")
+                logger.error(f"Failed to click login button: {e}")
         
         if not login_button_clicked:
             logger.error("Could not find or click any login button. Trying JavaScript click...")
             
             try:
                 # Try direct JavaScript approach
-                page.evaluate("""() => {
-                    // Find buttons with text related to login
-                    const buttons = Array.from(document.querySelectorAll('button'));
-                    const loginButton = buttons.find(btn => 
-                        btn.innerText.toLowerCase().includes('log in') || 
-                        btn.innerText.toLowerCase().includes('login') ||
-                        btn.innerText.toLowerCase().includes('sign in') ||
-                        btn.type === 'submit'
-                    );
-                    
-                    if (loginButton) {
-                        loginButton.click();
-                        console.log('JS clicked login button');
-                    } else {
-                        console.log('No login button found via JS');
-                    }
-                }""")
-                
-                login_button_clicked = True
-                logger.info("Attempted login via JavaScript")
+                login_button_clicked = page.evaluate(_LOGIN_BUTTON_CLICK_JS)
+                if login_button_clicked:
+                    logger.info("Clicked login button via JavaScript")
             except Exception as js_error:
                 logger.error(f"JavaScript login button click failed: {js_error}")
                 
@@ -802,7 +1232,7 @@ def login_to_freepik(browser, page, email: str, password: str, apikey_2captcha:
             
         # Wait for navigation to complete
         try:
-            page.wait_for_load_state("networkidle", timeout=30000)
+            page.wait_for_load_state("domcontentloaded", timeout=30000)
         except Exception as nav_error:
             logger.error(f"Error waiting for navigation after login: {nav_error}")
             
@@ -816,56 +1246,38 @@ def login_to_freepik(browser, page, email: str, password: str, apikey_2captcha:
             
             # After solving, try clicking login again
             try:
-                # Try again with each selector
-                for selector in login_button_selectors:
-                    try:
-                        login_btn = page.locator(selector).first
-                        if login_btn.is_visible(timeout=3000):
-                            login_btn.click(timeout=10000)
-                            logger.info(f"Clicked login button after CAPTCHA using selector: {selector}")
-                            break
-                    except:
-                        continue
-                        
+                login_btn = find_first_visible(page, _LOGIN_BUTTON_SELECTORS, timeout=3000)
+                if login_btn:
+                    login_btn.click(timeout=10000)
+                    logger.info("Clicked login button after CAPTCHA")
+                
                 # Wait for navigation after re-click
-                page.wait_for_load_state("networkidle", timeout=30000)
+                page.wait_for_load_state("domcontentloaded", timeout=30000)
             except Exception as e:
                 logger.error(f"Error clicking login button after CAPTCHA: {e}")
                 # It might have auto-submitted, so continue
 
-        # Give the page time to fully load and potentially redirect
-        page.wait_for_load_state("networkidle", timeout=30000)
-        time.sleep(5)  # Additional wait to ensure all redirects complete
-        
-        # Verify login success with our improved check
-        if check_login_status(page):
+        # Give post-login redirects time to land on a logged-in page, then verify
+        if wait_for_login(page) or check_login_status(page):
             logger.info("Login verified successfully!")
             
             # Save authentication state for future runs ONLY if login was successful
-            page.context.storage_state(path=AUTH_STATE_PATH)
+            _save_auth_state(page.context)
             logger.info("Authentication state saved.")
             return True, page
         else:
             logger.error("Login failed: Could not verify logged-in state.")
             
-            # Check for common error messages
-            error_selectors = [
-                "text=Invalid email or password",
-                "text=Incorrect credentials",
-                "text=The credentials are incorrect",
-                ".error-message",
-                "[data-testid='login-error']"
-            ]
-            
-            for selector in error_selectors:
-                try:
-                    error_element = page.locator(selector).first
-                    if error_element.is_visible(timeout=2000):
-                        error_message = error_element.text_content()
-                        logger.error(f"Login error message: {error_message}")
-                        break
-                except:
-                    continue
+            # Collect any visible error messages in one round-trip; wait_for_login
+            # has already given the page time to render them
+            try:
+                errors = page.locator(
+                    ", ".join(_LOGIN_ERROR_SELECTORS) + " >> visible=true"
+                ).evaluate_all(_ERROR_TEXTS_JS)
+                if errors:
+                    logger.error(f"Login error message: {errors[0]}")
+            except Exception as e:
+                logger.debug(f"Could not read login error message: {e}")
             
             return False, page
 
@@ -873,42 +1285,91 @@ def login_to_freepik(browser, page, email: str, password: str, apikey_2captcha:
         logger.error(f"Login step error: {e}")
         return False, page
 
-def create_browser_context(headless=True):
-    """Create and return a browser instance with configured context."""
+def login_accounts(browser, accounts, apikey_2captcha: str):
+    """
+    Log in several (email, password) accounts. Every login page is opened first so
+    the accounts' 2Captcha solves run concurrently while each form is completed in turn.
+    Returns a list of (success, page) tuples in the same order.
+    """
+    prepared = []
+    for email, _ in accounts:
+        try:
+            prepared.append(prepare_login_page(browser, random.choice(USER_AGENTS), apikey_2captcha))
+        except Exception as e:
+            logger.error(f"Could not open login page for {email}: {e}")
+            prepared.append((None, None))
+    
+    results = []
+    for (email, password), (page, captcha_future) in zip(accounts, prepared):
+        if page is None:
+            results.append((False, None))
+        else:
+            results.append(complete_login(page, email, password, apikey_2captcha, captcha_future))
+    return results
+
+# Chromium flags for the server (headless) case: no window, GPU or extras
+_HEADLESS_ARGS = (
+    "--no-sandbox",
+    "--disable-setuid-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+    "--disable-software-rasterizer",
+    "--no-zygote",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-extensions"
+)
+
+# Chromium flags for watching the bot in a visible window
+_HEADFUL_ARGS = (
+    "--start-maximized",
+    "--disable-infobars",
+    "--no-sandbox",
+    "--disable-setuid-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-accelerated-2d-canvas",
+    "--disable-gpu",
+    f"--window-size={LOGIN_VIEWPORT['width']},{LOGIN_VIEWPORT['height']}"
+)
+
+def launch_browser(headless=True):
+    """Start Playwright and launch Chromium. Returns tuple of (playwright, browser)."""
     try:
         browser_launch_options = {
             "headless": headless,
-            "args": [
-                "--start-maximized",
-                "--disable-infobars",
-                "--no-sandbox",
-                "--disable-setuid-sandbox",
-                "--disable-dev-shm-usage",
-                "--disable-accelerated-2d-canvas",
-                "--disable-gpu",
-                "--window-size=1920,1080"
-            ]
+            "args": list(_HEADLESS_ARGS if headless else _HEADFUL_ARGS)
         }
         
         p = sync_playwright().start()
         browser = p.chromium.launch(**browser_launch_options)
-        
+        return p, browser
+    except Exception as e:
+        logger.error(f"Error launching browser: {e}")
+        raise
+
+def new_browser_context(browser):
+    """Create a configured context and page on an already launched browser. Returns tuple of (context, page)."""
+    try:
         # Select a random user agent
         user_agent = random.choice(USER_AGENTS)
         
         # Enhanced browser context options
         context_options = {
             "accept_downloads": True,
-            "viewport": {"width": 1920, "height": 1080},
+            "viewport": LOGIN_VIEWPORT,
             "user_agent": user_agent,
             "permissions": ["clipboard-read", "clipboard-write"],
             "device_scale_factor": 1.0,
+            "has_touch": False,
+            "is_mobile": False,
             "locale": "en-US",
             "timezone_id": "America/New_York",
             "color_scheme": "light"
         }
         
         context = browser.new_context(**context_options)
+        context.route("**/*", _block_heavy_resources)
+        context.add_init_script(_HELPERS_JS)
         page = context.new_page()
         page.set_default_timeout(60000)
         
@@ -920,7 +1381,13 @@ def create_browser_context(headless=True):
             "Upgrade-Insecure-Requests": "1"
         })
         
-        return p, browser, context, page
+        return context, page
     except Exception as e:
         logger.error(f"Error creating browser context: {e}")
-        raise
\ No newline at end of file
+        raise
+
+def create_browser_context(headless=True):
+    """Create and return a browser instance with configured context."""
+    p, browser = launch_browser(headless)
+    context, page = new_browser_context(browser)
+    return p, browser, context, page
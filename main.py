@@ -1,21 +1,38 @@
 import os
 import time
 import threading
+import queue
 import logging
 import signal
 import sys
 import datetime
+import functools
+import concurrent.futures
 from utils import setup_logging, load_config, create_shared_resources
-from freepik_login import create_browser_context, login_to_freepik
-from freepik_downloader import download_resource, download_license, cleanup_files
+from freepik_login import launch_browser, new_browser_context, release_context, close_context_pool, login_to_freepik
+from freepik_downloader import download_resource, download_license, cleanup_files, prepare_user_download_dir, wait_for_license_ready
 from telegram_bot import init_bot, run_bot, send_user_message, upload_to_telegram
 
+# uvloop is faster than the default event loop but isn't available on Windows
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # Configure logging
 logger = setup_logging()
 
-# Global flag for graceful shutdown
+# Global flag for graceful shutdown. main() makes a new one for each run, so workers
+# left over from a crashed run still see their own run's flag set and exit
 shutdown_flag = threading.Event()
 
+# How often old downloads are cleaned up and resources are logged
+_CLEANUP_INTERVAL_SEC = 24 * 60 * 60
+_MONITOR_INTERVAL_SEC = 300
+
+# Downloads unfinished at shutdown are saved here and requeued on the next start
+PENDING_DOWNLOADS_PATH = "pending_downloads.json"
+
 def signal_handler(sig, frame):
     """Handle termination signals for graceful shutdown."""
     logger.info(f"Received signal {sig}. Initiating graceful shutdown...")
@@ -26,9 +43,9 @@ def signal_handler(sig, frame):
     logger.info("Exiting application.")
     sys.exit(0)
 
-def monitor_resources():
-    """Monitor system resources and log statistics."""
-    while not shutdown_flag.is_set():
+def monitor_resources(stop_event):
+    """Monitor system resources and log statistics until stop_event is set."""
+    while not stop_event.is_set():
         try:
             # Log basic statistics
             current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -37,12 +54,8 @@ def monitor_resources():
             
             # Add payment receipts directory stats if it exists
             payment_receipts_dir = os.path.join("downloads", "payment_receipts")
-            payment_receipts_size = 0
-            payment_receipts_count = 0
-            
-            if os.path.exists(payment_receipts_dir):
-                payment_receipts_size = get_directory_size(payment_receipts_dir)
-                payment_receipts_count = count_files(payment_receipts_dir)
+            receipts_bytes, payment_receipts_count = scan_directory(payment_receipts_dir)
+            payment_receipts_size = round(receipts_bytes / (1024 * 1024), 2)
             
             logger.info(f"[MONITOR] Time: {current_time}, Active threads: {thread_count}, "
                         f"Downloads dir size: {download_dir_size} MB, "
@@ -50,50 +63,89 @@ def monitor_resources():
         except Exception as e:
             logger.error(f"Error in monitoring thread: {e}")
         
-        # Sleep for monitoring interval
-        time.sleep(300)  # Check every 5 minutes
+        # Sleep for monitoring interval, waking at once on shutdown
+        if stop_event.wait(_MONITOR_INTERVAL_SEC):
+            break
+
+def scan_directory(path='.'):
+    """Return (total bytes, file count) of regular, non-hidden files under a directory tree."""
+    total_size = 0
+    count = 0
+    try:
+        entries = os.scandir(path)
+    except OSError:
+        return 0, 0
+    
+    with entries:
+        for entry in entries:
+            # Skip hidden files and directories (e.g. .git, .cache)
+            if entry.name.startswith('.'):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    size, files = scan_directory(entry.path)
+                    total_size += size
+                    count += files
+                elif entry.is_file(follow_symlinks=False):
+                    total_size += entry.stat(follow_symlinks=False).st_size
+                    count += 1
+            except OSError:
+                # File was removed while we were scanning
+                continue
+    return total_size, count
 
 def get_directory_size(path='.'):
     """Get the size of a directory in megabytes."""
-    total_size = 0
-    for dirpath, dirnames, filenames in os.walk(path):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            if os.path.exists(fp):
-                total_size += os.path.getsize(fp)
+    total_size, _ = scan_directory(path)
     
     # Convert bytes to megabytes
     return round(total_size / (1024 * 1024), 2)
 
-def count_files(path='.'):
-    """Count the number of files in a directory."""
-    count = 0
-    for dirpath, dirnames, filenames in os.walk(path):
-        count += len(filenames)
-    return count
+def _delete_old_file(file_path, size):
+    """Delete one expired file. Returns (files deleted, bytes freed)."""
+    try:
+        os.remove(file_path)
+        logger.debug(f"Deleted old file: {file_path}")
+        return 1, size
+    except FileNotFoundError:
+        return 0, 0
+    except Exception as e:
+        logger.error(f"Failed to delete old file {file_path}: {e}")
+        return 0, 0
 
 def cleanup_old_files(download_dir, max_age_days=7):
     """Clean up files older than max_age_days."""
     try:
-        now = time.time()
-        count = 0
-        size_freed = 0
+        cutoff = time.time() - max_age_days * 86400  # Convert days to seconds
         
-        for root, dirs, files in os.walk(download_dir):
-            for f in files:
-                file_path = os.path.join(root, f)
-                if os.path.exists(file_path):
-                    file_age = now - os.path.getmtime(file_path)
-                    # If file is older than max age
-                    if file_age > (max_age_days * 86400):  # Convert days to seconds
-                        size = os.path.getsize(file_path)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="FileCleanup") as executor:
+            futures = []
+            
+            def walk(path):
+                try:
+                    entries = os.scandir(path)
+                except OSError as e:
+                    logger.error(f"Failed to scan {path}: {e}")
+                    return
+                
+                with entries:
+                    for entry in entries:
                         try:
-                            os.remove(file_path)
-                            count += 1
-                            size_freed += size
-                            logger.debug(f"Deleted old file: {file_path}")
-                        except Exception as e:
-                            logger.error(f"Failed to delete old file {file_path}: {e}")
+                            if entry.is_dir(follow_symlinks=False):
+                                walk(entry.path)
+                                continue
+                            # One stat gives both the age and the size
+                            stat = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        if stat.st_mtime < cutoff:
+                            futures.append(executor.submit(_delete_old_file, entry.path, stat.st_size))
+            
+            walk(download_dir)
+            results = [future.result() for future in futures]
+        
+        count = sum(deleted for deleted, _ in results)
+        size_freed = sum(freed for _, freed in results)
         
         if count > 0:
             size_freed_mb = round(size_freed / (1024 * 1024), 2)
@@ -101,6 +153,58 @@ def cleanup_old_files(download_dir, max_age_days=7):
     except Exception as e:
         logger.error(f"Error during file cleanup: {e}")
 
+def upload_download_results(chat_id, user_id, resource_file, license_file, license_only, active_downloads, queue_lock):
+    """Send a finished download's files to Telegram, then delete them and clear the user's status."""
+    try:
+        if license_only:
+            # Only upload license file
+            if license_file:
+                license_upload_success = upload_to_telegram(chat_id, [license_file], None, False)
+                
+                if license_upload_success:
+                    send_user_message(chat_id, "✅ License download complete!")
+                else:
+                    send_user_message(chat_id, "⚠️ There was an issue sending the license file.")
+            else:
+                send_user_message(chat_id, "❌ Failed to download the license file.")
+        else:
+            # For regular downloads, upload BOTH resource file and license file if available
+            files_to_upload = [f for f in [resource_file, license_file] if f]
+            
+            if files_to_upload:
+                upload_success = upload_to_telegram(chat_id, files_to_upload)
+                
+                if not upload_success:
+                    send_user_message(chat_id, "⚠️ There was an issue sending the files.")
+            else:
+                send_user_message(chat_id, "❌ No files were downloaded.")
+    except Exception as e:
+        logger.error(f"Error uploading files for user {user_id}: {e}")
+        send_user_message(chat_id, "⚠️ There was an issue sending the files.")
+    finally:
+        files_to_cleanup = [f for f in [resource_file, license_file] if f]
+        if files_to_cleanup:
+            cleanup_files(files_to_cleanup)
+        
+        with queue_lock:
+            if user_id in active_downloads:
+                del active_downloads[user_id]
+
+def close_browser(playwright, browser):
+    """Close this thread's pooled contexts, its browser and its Playwright instance."""
+    try:
+        close_context_pool()
+        if browser and browser.is_connected():
+            browser.close()
+    except Exception as e:
+        logger.error(f"Error closing browser resources: {e}")
+    
+    try:
+        if playwright:
+            playwright.stop()
+    except Exception as e:
+        logger.error(f"Error stopping Playwright instance: {e}")
+
 def process_download_queue(
     download_queue, 
     active_downloads, 
@@ -110,15 +214,29 @@ def process_download_queue(
     apikey_2captcha, 
     download_dir,
     database,
-    headless=True
+    headless=True,
+    upload_pool=None,
+    browser_recycle_after=50,
+    stop_event=None
 ):
-    """Process the download queue in a separate thread."""
+    """
+    Process the download queue in a separate thread until stop_event (by default
+    shutdown_flag) is set. If upload_pool is given, Telegram uploads run there
+    instead of blocking this worker.
+    """
+    if stop_event is None:
+        stop_event = shutdown_flag
     logger.info("Download queue processor started.")
     
     last_cleanup_time = time.time()
-    cleanup_interval = 24 * 60 * 60  # Run cleanup once a day
+    cleanup_interval = _CLEANUP_INTERVAL_SEC
     
-    while not shutdown_flag.is_set():
+    # One browser serves every download; each download gets its own context
+    playwright = None
+    browser = None
+    jobs_since_launch = 0
+    
+    while not stop_event.is_set():
         try:
             # Run cleanup if necessary
             current_time = time.time()
@@ -126,14 +244,15 @@ def process_download_queue(
                 cleanup_old_files(download_dir)
                 last_cleanup_time = current_time
             
-            # Check if queue is empty
-            if download_queue.empty():
-                time.sleep(10)  # Sleep for a bit if the queue is empty
+            # Block until an item arrives (put() wakes us immediately), but no longer
+            # than 10s or the time left until the next cleanup, so that check still runs
+            wait_time = min(10, max(0.1, cleanup_interval - (time.time() - last_cleanup_time)))
+            try:
+                queue_item = download_queue.get(timeout=wait_time)
+            except queue.Empty:
                 continue
             
-            # Get the next item from the queue
             # Check if it's a license-only download (will have 5 elements instead of 4)
-            queue_item = download_queue.get()
             license_only = False
             
             if len(queue_item) >= 5:
@@ -141,6 +260,8 @@ def process_download_queue(
             else:
                 user_id, chat_id, resource_url, message_id = queue_item
             
+            job_started = time.monotonic()
+            
             # Update status
             with queue_lock:
                 if license_only:
@@ -155,10 +276,20 @@ def process_download_queue(
             # Start the download process
             resource_file = ""
             license_file = ""
+            upload_handed_off = False
             
             try:
-                # Create browser context
-                playwright, browser, context, page = create_browser_context(headless=headless)
+                # Launch the browser on first use, again if it has crashed, and
+                # every browser_recycle_after downloads to cap Chromium's memory growth
+                if browser is None or not browser.is_connected() or jobs_since_launch >= browser_recycle_after:
+                    if browser is not None:
+                        logger.info(f"Relaunching browser after {jobs_since_launch} downloads")
+                    close_browser(playwright, browser)
+                    playwright, browser = launch_browser(headless=headless)
+                    jobs_since_launch = 0
+                
+                context, page = new_browser_context(browser)
+                current_page = page
                 
                 try:
                     # Update status and log in first
@@ -166,12 +297,10 @@ def process_download_queue(
                         active_downloads[user_id] = "Logging in..."
                     
                     # Create user directory for downloads
-                    user_download_dir = os.path.join(download_dir, f"user_{user_id}")
-                    os.makedirs(user_download_dir, exist_ok=True)
+                    prepare_user_download_dir(download_dir, user_id)
                     
                     # Login to Freepik first
                     logged_in = False
-                    current_page = page
                     for attempt in range(1, 3):
                         with queue_lock:
                             active_downloads[user_id] = f"Login attempt {attempt}..."
@@ -182,8 +311,8 @@ def process_download_queue(
                         if login_result:
                             logged_in = True
                             break
-                        else:
-                            time.sleep(2)
+                        elif stop_event.wait(2):
+                            break
                     
                     if not logged_in:
                         send_user_message(chat_id, "❌ Login failed. Unable to download your resource.")
@@ -225,10 +354,10 @@ def process_download_queue(
                             active_downloads[user_id] = "Waiting for license to be available..."
     
                         # Send notification to user
-                        send_user_message(chat_id, "✅ Resource downloaded successfully! Waiting 3-5 minutes for the license to become available...")
+                        send_user_message(chat_id, "✅ Resource downloaded successfully! Waiting for the license to become available...")
     
-                        # Wait 3-5 minutes for the license to be available
-                        time.sleep(180)  # 3 minutes in seconds
+                        # Poll until the license shows up (up to 5 minutes)
+                        wait_for_license_ready(current_page, resource_file)
                     
                     # Download license
                     with queue_lock:
@@ -241,78 +370,70 @@ def process_download_queue(
                     with queue_lock:
                         active_downloads[user_id] = "Uploading files to Telegram..."
                     
-                    if license_only:
-                        # Only upload license file
-                        if license_file:
-                            license_upload_success = upload_to_telegram(chat_id, [license_file], None, False)
-                            
-                            if license_upload_success:
-                                send_user_message(chat_id, "✅ License download complete!")
-                            else:
-                                send_user_message(chat_id, "⚠️ There was an issue sending the license file.")
-                        else:
-                            send_user_message(chat_id, "❌ Failed to download the license file.")
+                    # Hand the upload (and the file cleanup after it) to the upload pool
+                    # so this worker can move on to the next download
+                    upload_args = (
+                        chat_id, user_id, resource_file, license_file, license_only,
+                        active_downloads, queue_lock
+                    )
+                    if upload_pool:
+                        try:
+                            upload_pool.submit(upload_download_results, *upload_args)
+                        except RuntimeError:
+                            # The pool is shut down when its run ends; upload from here instead
+                            upload_download_results(*upload_args)
                     else:
-                        # For regular downloads, upload BOTH resource file and license file if available
-                        files_to_upload = []
-                        if resource_file:
-                            files_to_upload.append(resource_file)
-                        
-                        # Also upload the license file right away if we have it
-                        if license_file:
-                            files_to_upload.append(license_file)
-                            
-                        if files_to_upload:
-                            upload_success = upload_to_telegram(chat_id, files_to_upload, context)
-                            
-                            if not upload_success:
-                                send_user_message(chat_id, "⚠️ There was an issue sending the files.")
-                        else:
-                            send_user_message(chat_id, "❌ No files were downloaded.")
+                        upload_download_results(*upload_args)
+                    upload_handed_off = True
                 finally:
-                    # Close browser resources
-                    try:
-                        if context:
-                            context.close()
-                        if browser:
-                            browser.close()
-                        if playwright:
-                            playwright.stop()
-                    except Exception as e:
-                        logger.error(f"Error closing browser resources: {e}")
+                    # Release this download's contexts; the browser stays up for the next one
+                    for used_context in {context, current_page.context}:
+                        try:
+                            release_context(used_context)
+                        except Exception as e:
+                            logger.error(f"Error closing browser context: {e}")
             
             except Exception as e:
                 logger.error(f"Error processing download for user {user_id}: {e}")
                 send_user_message(chat_id, f"❌ An error occurred during your download: {str(e)[:100]}...\n\nPlease try again later.")
             
             finally:
-                # Clean up files and status
-                files_to_cleanup = [f for f in [resource_file, license_file] if f]
-                if files_to_cleanup:
-                    cleanup_files(files_to_cleanup)
-                
-                with queue_lock:
-                    if user_id in active_downloads:
-                        del active_downloads[user_id]
+                # Clean up files and status, unless the upload step now owns them
+                if not upload_handed_off:
+                    files_to_cleanup = [f for f in [resource_file, license_file] if f]
+                    if files_to_cleanup:
+                        cleanup_files(files_to_cleanup)
+                    
+                    with queue_lock:
+                        if user_id in active_downloads:
+                            del active_downloads[user_id]
                 
-                # Mark task as done
-                download_queue.task_done()
+                # Mark task as done; only full downloads that reached the upload step
+                # count towards the wait estimate, so failures don't skew it
+                download_queue.finish(queue_item)
+                if upload_handed_off and not license_only:
+                    download_queue.record_duration(time.monotonic() - job_started)
+                jobs_since_launch += 1
                 
                 logger.info(f"Finished processing download for user {user_id}.")
         
         except Exception as e:
             logger.error(f"Error in queue processor: {e}")
-            time.sleep(10)  # Sleep to avoid rapid error looping
+            stop_event.wait(10)  # Avoid rapid error looping, but wake on shutdown
     
     logger.info("Download queue processor shutting down...")
+    
+    # Close the shared browser
+    close_browser(playwright, browser)
 
+@functools.lru_cache(maxsize=1)
 def load_env_config():
-    """Enhanced load_config function with admin chat IDs."""
+    """Enhanced load_config function with admin chat IDs. Loaded once per process."""
     # Load configuration from environment variables
     config = load_config()
     
     # Add admin chat IDs for payment notifications
-    admin_chat_ids = os.getenv("ADMIN_CHAT_IDS", "").split(",")
+    admin_chat_ids = [chat_id.strip() for chat_id in os.getenv("ADMIN_CHAT_IDS", "").split(",") if chat_id.strip()]
     config['admin_chat_ids'] = admin_chat_ids
     
     logger.info(f"Loaded admin chat IDs: {len(admin_chat_ids)} admin(s) configured")
@@ -321,6 +442,11 @@ def load_env_config():
 
 def main():
     """Main entry point of the application."""
+    global shutdown_flag
+    # A fresh flag for this run; a crashed earlier run's workers keep the old, set one
+    shutdown_flag = threading.Event()
+    download_queue = None
+    upload_pool = None
     try:
         # Register signal handlers for graceful shutdown
         signal.signal(signal.SIGINT, signal_handler)
@@ -333,9 +459,18 @@ def main():
         # Initialize shared resources
         download_queue, active_downloads, queue_lock, db = create_shared_resources(
             config['max_queue_size'], 
-            config['mongodb_uri']
+            config['mongodb_uri'],
+            config['max_concurrent_downloads']
         )
         
+        # Requeue downloads that were still waiting when the bot last stopped
+        try:
+            restored = download_queue.restore_pending(PENDING_DOWNLOADS_PATH)
+            if restored:
+                logger.info(f"Restored {restored} pending download(s) from the last run")
+        except Exception as e:
+            logger.error(f"Error restoring pending downloads: {e}")
+        
         # Create bank details dictionary
         bank_details = {
             "bank_name": config.get('bank_name', "Bank of Ceylon"),
@@ -369,29 +504,39 @@ def main():
             config['admin_chat_ids']  # Pass admin chat IDs to the bot
         )
         
-        # Start the queue processor thread
-        queue_thread = threading.Thread(
-            target=process_download_queue,
-            args=(
-                download_queue,
-                active_downloads,
-                queue_lock,
-                config['freepik_email'],
-                config['freepik_password'],
-                config['apikey_2captcha'],
-                config['download_dir'],
-                db,
-                config['headless']
-            ),
-            daemon=True,
-            name="DownloadQueueProcessor"
+        # Telegram uploads run here so download workers don't wait on them
+        upload_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=config['max_concurrent_uploads'], thread_name_prefix="TelegramUpload"
         )
-        queue_thread.start()
-        logger.info("Download queue processor thread started")
+        
+        # Start the queue processor threads; each one runs its own browser
+        for worker_index in range(config['max_concurrent_downloads']):
+            queue_thread = threading.Thread(
+                target=process_download_queue,
+                args=(
+                    download_queue,
+                    active_downloads,
+                    queue_lock,
+                    config['freepik_email'],
+                    config['freepik_password'],
+                    config['apikey_2captcha'],
+                    config['download_dir'],
+                    db,
+                    config['headless'],
+                    upload_pool,
+                    config['browser_recycle_after'],
+                    shutdown_flag
+                ),
+                daemon=True,
+                name=f"DownloadQueueProcessor-{worker_index + 1}"
+            )
+            queue_thread.start()
+        logger.info(f"Started {config['max_concurrent_downloads']} download queue processor thread(s)")
         
         # Start resource monitoring thread
         monitor_thread = threading.Thread(
             target=monitor_resources,
+            args=(shutdown_flag,),
             daemon=True,
             name="ResourceMonitor"
         )
@@ -403,7 +548,7 @@ def main():
         logger.info(f"Queue size: {config['max_queue_size']}, Headless mode: {config['headless']}")
         
         # Run the bot (this will block until the bot is stopped)
-        run_bot(config['telegram_bot_token'])
+        run_bot(config['telegram_bot_token'], shutdown_flag)
         
     except KeyboardInterrupt:
         logger.info("Received keyboard interrupt. Shutting down...")
@@ -412,6 +557,20 @@ def main():
         logger.critical(f"Critical error in main function: {e}")
         shutdown_flag.set()
         raise
+    finally:
+        # Stop this run's workers; uploads already handed off still finish
+        shutdown_flag.set()
+        if upload_pool is not None:
+            upload_pool.shutdown(wait=False)
+        
+        # Keep unfinished downloads, started or not, so they survive the restart
+        if download_queue is not None:
+            try:
+                saved = download_queue.save_pending(PENDING_DOWNLOADS_PATH)
+                if saved:
+                    logger.info(f"Saved {saved} pending download(s) for the next run")
+            except Exception as e:
+                logger.error(f"Error saving pending downloads: {e}")
 
 def run_with_restart():
     """Run the bot with automatic restart on failure."""
@@ -435,4 +594,6 @@ def run_with_restart():
         logger.critical("Maximum retry attempts reached. Bot is shutting down.")
 
 if __name__ == "__main__":
-    run_with_restart()
\ No newline at end of file
+    if uvloop is not None:
+        uvloop.install()
+    run_with_restart()
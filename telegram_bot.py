@@ -1,12 +1,28 @@
+import io
 import os
 import re
+import html
+import hashlib
+import asyncio
+import time
 import queue
 import logging
 import threading
 import datetime
+import contextlib
+import collections
+import orjson
 import requests
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, constants, BotCommand
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.fields import RequestField
+from urllib3.filepost import choose_boundary
+from utils import DownloadQueue, DownloadStatusBoard
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, constants, BotCommand, BotCommandScopeAllPrivateChats
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters, ConversationHandler
+from telegram.ext import AIORateLimiter, TypeHandler, ApplicationHandlerStop, BaseUpdateProcessor
+from telegram.request import HTTPXRequest
+from telegram.error import NetworkError, TimedOut
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -18,12 +34,79 @@ queue_lock = None
 db = None
 TELEGRAM_BOT_TOKEN = None
 FREEPIK_URL_PATTERN = None
+FREEPIK_URL_RE = None
 MAX_QUEUE_SIZE = None
 BANK_DETAILS = {}
 ADMIN_CHAT_IDS = []
 
+# Numeric admin chat IDs from ADMIN_CHAT_IDS, parsed once in init_bot
+ADMIN_IDS = frozenset()
+
+# Static part of the payment instructions, built from BANK_DETAILS in init_bot
+_PAYMENT_INSTRUCTIONS = ""
+
+# Bot API method URLs for thread-side calls, built from the token in init_bot
+_API_METHOD_URLS = {}
+
+# Long-poll timeout for getUpdates; Telegram holds the request open this long
+# when there are no updates, so an idle bot makes one request per this many seconds
+POLL_TIMEOUT_SEC = 20
+
+# Connections for handler API calls (send_message, edit_message_text, answer);
+# getUpdates gets its own single connection so polling never competes with them
+BOT_CONNECTION_POOL_SIZE = 32
+
+# Updates handled at once across all chats; updates from one chat still run in order
+MAX_CONCURRENT_UPDATES = 32
+
+# Keep-alive connections for Bot API calls made from download and upload threads.
+# Failed connections are retried; a POST that reached Telegram is not, so a
+# message is never sent twice (429s are retried by _bot_api_post)
+_API_SESSION = requests.Session()
+_API_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5)
+))
+
+# Spacing for those thread-side calls, within Telegram's limits of about 30
+# messages a second overall and one a second per chat (the bot's own async calls
+# are paced by AIORateLimiter); a 429 is retried this many times after its retry_after
+API_GLOBAL_INTERVAL_SEC = 1 / 30
+API_CHAT_INTERVAL_SEC = 1.0
+API_MAX_RETRIES = 2
+
+# Telegram accepts at most this many files in one sendMediaGroup album
+MEDIA_GROUP_MAX_FILES = 10
+
+# Hash of the last command menu sent to Telegram, so restarts skip an unchanged menu
+COMMANDS_HASH_PATH = ".bot_commands_hash"
+
+# Seconds the rendered subscription plans message is reused; plan edits made
+# with the admin tool show up once it expires
+PLANS_CACHE_TTL_SEC = 300
+
+# (expires_at, text, reply_markup) for the plans message, or None
+_plans_cache = None
+
+# Where payment receipt images are stored, and whether it has been created yet
+RECEIPTS_DIR = os.path.join("downloads", "payment_receipts")
+_receipts_dir_ready = False
+
+# How long a /status reply keeps updating itself as the download progresses
+STATUS_FOLLOW_SEC = 15 * 60
+
+# A repeat press of the same button within this many seconds is dropped
+CALLBACK_DEBOUNCE_SEC = 0.3
+
+# Seconds a user's cached subscription/limit state stays fresh
+SUB_STATE_TTL_SEC = 30
+
+# user_id -> (expires_at, subscription, limit_info, can_download)
+_sub_state_cache = {}
+
 # Conversation states
-MAIN_MENU, SERVICE_MENU, FREEPIK_MENU, SUBSCRIPTION_MENU, AWAITING_PAYMENT, AWAITING_LICENSE_CONFIRM = range(6)
+MAIN_MENU, SERVICE_MENU, FREEPIK_MENU, SUBSCRIPTION_MENU, AWAITING_PAYMENT, AWAITING_LICENSE_CONFIRM, AWAITING_URL = range(7)
 
 # Callback data identifiers
 FREEPIK_SERVICE = "service_freepik"
@@ -42,27 +125,166 @@ BACK_FREEPIK = "back_freepik"
 LICENSE_YES = "license_yes"
 LICENSE_NO = "license_no"
 
+# Fixed details of the legacy hardcoded plans, keyed by their callback data
+_LEGACY_PLANS = {
+    FREEPIK_MONTHLY: {
+        "subscription_service": "freepik",
+        "subscription_plan": "monthly",
+        "subscription_amount": 1500,
+        "subscription_name": "Monthly",
+        "subscription_currency": "LKR"
+    },
+    FREEPIK_YEARLY: {
+        "subscription_service": "freepik",
+        "subscription_plan": "yearly",
+        "subscription_amount": 5800,
+        "subscription_name": "Yearly",
+        "subscription_currency": "LKR"
+    }
+}
+
+# Body of the /help message
+_HELP_TEXT = (
+    "🔍 *How to use this bot:*\n\n"
+    "1. Choose a service from the main menu (e.g., Freepik)\n"
+    "2. Send a URL from that service\n"
+    "3. Wait for your download to complete\n"
+    "4. I'll send you the file!\n\n"
+    "📊 *Subscription Plans:*\n"
+    "• Freepik Monthly: LKR 1,500 (10 files/day)\n"
+    "• Freepik Yearly: LKR 5,800 (10 files/day)\n\n"
+    "Available commands:\n"
+    "/start - Open main menu\n"
+    "/help - Show this help message\n"
+    "/status - Check your download status\n"
+    "/queue - View the current download queue\n"
+    "/subscriptions - Manage your subscriptions"
+)
+
+# Static keyboards, built once and shared by every handler that shows them
+_KB_MAIN_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("ℹ️ My Info", callback_data="my_info")],
+    [InlineKeyboardButton("🌐 Freepik", callback_data=FREEPIK_SERVICE)],
+    [InlineKeyboardButton("🔄 Envato Elements", callback_data=ENVATO_SERVICE)],
+    [InlineKeyboardButton("🎬 Storyblocks", callback_data=STORYBLOCKS_SERVICE)],
+    [InlineKeyboardButton("💳 Subscriptions", callback_data=SUBSCRIPTION_INFO)],
+    [InlineKeyboardButton("❓ Help", callback_data="help")]
+])
+_KB_FREEPIK_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📥 Send Freepik URL", callback_data=FREEPIK_SEND_URL)],
+    [InlineKeyboardButton("📋 My Downloads", callback_data=FREEPIK_DOWNLOADS)],
+    [InlineKeyboardButton("💳 Get Subscription", callback_data=SUBSCRIPTION_PLANS)],
+    [InlineKeyboardButton("ℹ️ About Freepik", callback_data=FREEPIK_INFO)],
+    [InlineKeyboardButton("⬅️ Back to Main Menu", callback_data=BACK_MAIN_MENU)]
+])
+_KB_BACK_MAIN = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
+])
+_KB_BACK_FREEPIK = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⬅️ Back to Freepik Menu", callback_data=BACK_FREEPIK)]
+])
+_KB_BACK_PLANS = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⬅️ Back to Plans", callback_data=SUBSCRIPTION_PLANS)]
+])
+_KB_GET_SUBSCRIPTION = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💳 Get Subscription", callback_data=SUBSCRIPTION_PLANS)],
+    [InlineKeyboardButton("⬅️ Back to Freepik Menu", callback_data=BACK_FREEPIK)]
+])
+_KB_CHECK_STATUS = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Check Status", callback_data="check_status")],
+    [InlineKeyboardButton("⬅️ Back to Freepik Menu", callback_data=BACK_FREEPIK)]
+])
+_KB_CONTINUE = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Continue →", callback_data="continue_to_menu")]
+])
+_KB_VIEW_PLANS_OR_MAIN = InlineKeyboardMarkup([
+    [InlineKeyboardButton("View Available Plans", callback_data=SUBSCRIPTION_PLANS)],
+    [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
+])
+_KB_MANAGE_SUBSCRIPTIONS = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Manage Subscriptions", callback_data=SUBSCRIPTION_INFO)],
+    [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
+])
+_KB_CANCEL_URL = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⬅️ Cancel", callback_data=BACK_FREEPIK)]
+])
+_KB_RETRY_URL = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Try Again", callback_data=FREEPIK_SEND_URL)],
+    [InlineKeyboardButton("Back to Freepik Menu", callback_data=BACK_FREEPIK)]
+])
+_KB_GO_MAIN = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Go to Main Menu", callback_data=BACK_MAIN_MENU)]
+])
+_KB_SUBSCRIPTION_INFO = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📋 Available Plans", callback_data=SUBSCRIPTION_PLANS)],
+    [InlineKeyboardButton("⬅️ Back to Main Menu", callback_data=BACK_MAIN_MENU)]
+])
+_KB_CANCEL_PAYMENT = InlineKeyboardMarkup([
+    [InlineKeyboardButton("❌ Cancel", callback_data=SUBSCRIPTION_INFO)]
+])
+_KB_VIEW_PLANS = InlineKeyboardMarkup([
+    [InlineKeyboardButton("View Plans", callback_data=SUBSCRIPTION_PLANS)]
+])
+_KB_CANCEL_SUB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Cancel", callback_data=SUBSCRIPTION_INFO)]
+])
+_KB_CANCEL_LICENSE = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Cancel", callback_data=LICENSE_NO)]
+])
+_KB_LICENSE_CONFIRM = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Yes", callback_data=LICENSE_YES),
+        InlineKeyboardButton("No", callback_data=LICENSE_NO)
+    ]
+])
+
+# The license prompt's keyboard as sent by upload threads through the raw Bot API
+_KB_LICENSE_CONFIRM_JSON = _KB_LICENSE_CONFIRM.to_json()
+
 def init_bot(token, url_pattern, max_queue_size=10, queue=None, active_downloads_dict=None, lock=None, database=None, bank_details=None, admin_chat_ids=None):
     """Initialize the bot's global variables."""
-    global TELEGRAM_BOT_TOKEN, FREEPIK_URL_PATTERN, MAX_QUEUE_SIZE
-    global download_queue, active_downloads, queue_lock, db, BANK_DETAILS, ADMIN_CHAT_IDS
+    global TELEGRAM_BOT_TOKEN, FREEPIK_URL_PATTERN, FREEPIK_URL_RE, MAX_QUEUE_SIZE
+    global download_queue, active_downloads, queue_lock, db, BANK_DETAILS, ADMIN_CHAT_IDS, ADMIN_IDS, _PAYMENT_INSTRUCTIONS
+    global _API_METHOD_URLS
     
     TELEGRAM_BOT_TOKEN = token
+    _API_METHOD_URLS = {
+        method: f"https://api.telegram.org/bot{token}/{method}"
+        for method in ("sendMessage", "sendDocument")
+    }
     FREEPIK_URL_PATTERN = url_pattern
+    # Trailing \S* extends the match to the end of the URL, so query parameters
+    # and fragments the configured pattern stops short of are kept
+    FREEPIK_URL_RE = re.compile(f"(?:{url_pattern})\\S*")
     MAX_QUEUE_SIZE = max_queue_size
     BANK_DETAILS = bank_details or {}
     ADMIN_CHAT_IDS = admin_chat_ids or []
+    ADMIN_IDS = frozenset(int(str(a).strip()) for a in ADMIN_CHAT_IDS if str(a).strip().isdigit())
+    
+    # The bank details don't change while running, so the instructions are built once
+    _PAYMENT_INSTRUCTIONS = (
+        "*Payment Instructions:*\n"
+        "1. Make a payment to the bank account below\n"
+        "2. Add your Telegram User ID as the reference\n"
+        "3. Take a screenshot/photo of the payment receipt\n"
+        "4. Send the screenshot/photo to this chat\n\n"
+        "*Bank Details:*\n"
+        f"Bank: {BANK_DETAILS.get('bank_name', 'Bank of Ceylon')}\n"
+        f"Branch: {BANK_DETAILS.get('branch_name', 'Main Branch')}\n"
+        f"Name: {BANK_DETAILS.get('account_name', 'Your Name')}\n"
+        f"Account Number: {BANK_DETAILS.get('account_number', '1234567890')}\n\n"
+    )
     
     # Use provided resources if available
     if queue is not None:
         download_queue = queue
     else:
-        download_queue = queue.Queue(maxsize=MAX_QUEUE_SIZE)
+        download_queue = DownloadQueue(maxsize=MAX_QUEUE_SIZE)
         
     if active_downloads_dict is not None:
         active_downloads = active_downloads_dict
     else:
-        active_downloads = {}
+        active_downloads = DownloadStatusBoard()
         
     if lock is not None:
         queue_lock = lock
@@ -74,9 +296,120 @@ def init_bot(token, url_pattern, max_queue_size=10, queue=None, active_downloads
     
     return download_queue, active_downloads, queue_lock
 
+async def run_db(fn, *args, **kwargs):
+    """Run a blocking database call in a worker thread so the event loop stays free."""
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+async def _db_healthcheck(database):
+    """Test a real write and list the collections, off the startup path."""
+    if database is None or not database.is_connected:
+        return
+    try:
+        await run_db(
+            database.create_or_update_user,
+            user_id=999999,  # Test user ID
+            username="test_user",
+            name="Test User",
+            first_name="Test",
+            last_name="User"
+        )
+        logger.info("MongoDB test write successful! Test user registered/updated")
+        
+        # Get collections for debugging
+        collections = await run_db(database.db.list_collection_names)
+        logger.info(f"MongoDB collections: {collections}")
+    except Exception as e:
+        logger.error(f"MongoDB test write failed: {e}", exc_info=True)
+
+class OrjsonRequest(HTTPXRequest):
+    """HTTPXRequest that decodes Bot API responses with orjson."""
+    
+    @staticmethod
+    def parse_json_payload(payload: bytes) -> dict:
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            # Let the stock parser handle (or reject) anything orjson won't,
+            # such as responses that aren't valid UTF-8
+            return HTTPXRequest.parse_json_payload(payload)
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Handles updates from different chats concurrently and each chat's updates in order.
+    
+    A slow handler (like a receipt download) then only holds up its own chat, while
+    conversation state for a chat is never updated by two handlers at once.
+    """
+    
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._chat_locks = {}  # chat_id -> [asyncio.Lock, number of updates using it]
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+    
+    async def process_update(self, update, coroutine):
+        # The base class takes a concurrency slot before do_process_update, so an
+        # update waiting on its chat would hold one. Here the chat lock comes
+        # first, and only the update that is running holds a slot
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self._slots:
+                await self.do_process_update(update, coroutine)
+            return
+        
+        entry = self._chat_locks.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self._slots:
+                await self.do_process_update(update, coroutine)
+        finally:
+            # Drop the lock once no update from this chat is waiting on it
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat.id]
+    
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+
+async def get_user_freepik_state(user_id):
+    """Return (subscription, limit_info, can_download) for a user, cached for SUB_STATE_TTL_SEC."""
+    cached = _sub_state_cache.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1:]
+    
+    # All the lookups share one trip to a worker thread
+    state = await asyncio.to_thread(_fetch_user_freepik_state, user_id)
+    _sub_state_cache[user_id] = (time.monotonic() + SUB_STATE_TTL_SEC,) + state
+    return state
+
+def _fetch_user_freepik_state(user_id):
+    """Query the database for a user's Freepik subscription and daily limit."""
+    subscription = db.get_active_subscription(user_id, "freepik")
+    if subscription is not None:
+        # Format the expiry once per cache fill rather than on every menu render;
+        # copy first so the database's own record isn't modified
+        subscription = dict(subscription, end_date_str=subscription["end_date"].strftime("%Y-%m-%d"))
+    
+    # The diagnostic query is only worth its round trip when the check failed
+    if subscription is None and logger.isEnabledFor(logging.DEBUG):
+        is_valid, reason = db.debug_subscription_status(user_id, "freepik")
+        logger.debug(f"Subscription check for user {user_id}: valid={is_valid}, reason={reason}")
+    
+    limit_info = db.get_download_limit(user_id, "freepik")
+    # Same rule as db.can_download, without fetching the limit record again
+    can_download = limit_info["count"] < limit_info["limit"]
+    return subscription, limit_info, can_download
+
+def invalidate_user_freepik_state(user_id):
+    """Drop a user's cached subscription/limit state after it changes."""
+    _sub_state_cache.pop(user_id, None)
+
 async def setup_commands(bot):
     """Set up command menu buttons for the bot."""
-    logger.info("Setting up command menu buttons...")
     commands = [
         BotCommand("start", "Start or restart the bot"),
         BotCommand("info", "View your account information"),
@@ -85,31 +418,27 @@ async def setup_commands(bot):
         BotCommand("status", "Check download status"),
         BotCommand("help", "Get help with using the bot")
     ]
-    await bot.set_my_commands(commands)
-    logger.info("Command menu buttons set up successfully")
-
-# Then call this in your run_bot function:
-async def run_bot(token):
-    """Start the bot with improved error handling."""
+    
+    # Include the bot ID so switching tokens always re-sends the menu
+    commands_hash = hashlib.sha1(
+        repr((bot.id, [(c.command, c.description) for c in commands])).encode()
+    ).hexdigest()
     try:
-        # Create the Application and pass it your bot's token
-        application = Application.builder().token(token).build()
-
-        # Set up handlers
-        setup_bot_handlers(application)
-        
-        # Set up command menu buttons
-        await setup_commands(application.bot)
-        
-        # Start the Bot
-        logger.info("Starting bot...")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
-        
-        return application
-    except Exception as e:
-        logger.critical(f"Failed to start bot: {e}")
-        # Re-raise to ensure the error is visible
-        raise
+        with open(COMMANDS_HASH_PATH, "r") as f:
+            if f.read().strip() == commands_hash:
+                logger.info("Command menu buttons unchanged; skipping update")
+                return
+    except OSError:
+        pass
+    
+    logger.info("Setting up command menu buttons...")
+    await bot.set_my_commands(commands, scope=BotCommandScopeAllPrivateChats())
+    try:
+        with open(COMMANDS_HASH_PATH, "w") as f:
+            f.write(commands_hash)
+    except OSError as e:
+        logger.warning(f"Could not save command menu hash: {e}")
+    logger.info("Command menu buttons set up successfully")
 
 # --------------------------------
 # Telegram Bot Command Handlers
@@ -123,7 +452,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     # Register or update user in the database with enhanced information
     if db:
         try:
-            user_info = db.create_or_update_user(
+            user_info = await run_db(
+                db.create_or_update_user,
                 user_id=user_id, 
                 username=user.username, 
                 name=user.full_name,
@@ -143,9 +473,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         f"👋 Welcome to the Premium Asset Downloader, {user.first_name}!\n\n"
         f"Your User ID: {user_id}\n\n"
         f"This bot helps you download premium resources from various platforms.",
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("Continue →", callback_data="continue_to_menu")]
-        ])
+        reply_markup=_KB_CONTINUE
     )
     
     return MAIN_MENU
@@ -160,14 +488,7 @@ async def continue_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         "🌟 *Main Menu* 🌟\n\n"
         "Choose an option below:",
         parse_mode=constants.ParseMode.MARKDOWN,
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("ℹ️ My Info", callback_data="my_info")],
-            [InlineKeyboardButton("🌐 Freepik", callback_data=FREEPIK_SERVICE)],
-            [InlineKeyboardButton("🔄 Envato Elements", callback_data=ENVATO_SERVICE)],
-            [InlineKeyboardButton("🎬 Storyblocks", callback_data=STORYBLOCKS_SERVICE)],
-            [InlineKeyboardButton("💳 Subscriptions", callback_data=SUBSCRIPTION_INFO)],
-            [InlineKeyboardButton("❓ Help", callback_data="help")]
-        ])
+        reply_markup=_KB_MAIN_MENU
     )
     
     return MAIN_MENU
@@ -175,24 +496,9 @@ async def continue_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /help is issued."""
     await update.message.reply_text(
-        "🔍 *How to use this bot:*\n\n"
-        "1. Choose a service from the main menu (e.g., Freepik)\n"
-        "2. Send a URL from that service\n"
-        "3. Wait for your download to complete\n"
-        "4. I'll send you the file!\n\n"
-        "📊 *Subscription Plans:*\n"
-        "• Freepik Monthly: LKR 1,500 (10 files/day)\n"
-        "• Freepik Yearly: LKR 5,800 (10 files/day)\n\n"
-        "Available commands:\n"
-        "/start - Open main menu\n"
-        "/help - Show this help message\n"
-        "/status - Check your download status\n"
-        "/queue - View the current download queue\n"
-        "/subscriptions - Manage your subscriptions",
+        _HELP_TEXT,
         parse_mode=constants.ParseMode.MARKDOWN,
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-        ])
+        reply_markup=_KB_BACK_MAIN
     )
 
 async def subscriptions_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -202,7 +508,7 @@ async def subscriptions_command(update: Update, context: ContextTypes.DEFAULT_TY
     # Get user subscriptions from database
     subscriptions = []
     if db:
-        subscriptions = db.get_all_user_subscriptions(user_id)
+        subscriptions = await run_db(db.get_all_user_subscriptions, user_id)
     
     # Show subscription info
     text = "💳 *Your Subscriptions*\n\n"
@@ -225,10 +531,7 @@ async def subscriptions_command(update: Update, context: ContextTypes.DEFAULT_TY
     await update.message.reply_text(
         text,
         parse_mode=constants.ParseMode.MARKDOWN,
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("View Available Plans", callback_data=SUBSCRIPTION_PLANS)],
-            [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-        ])
+        reply_markup=_KB_VIEW_PLANS_OR_MAIN
     )
     
     return SUBSCRIPTION_MENU
@@ -237,71 +540,90 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Check status of user's download."""
     user_id = update.effective_user.id
     
-    with queue_lock:
-        # Check if user has an active download
-        if user_id in active_downloads:
-            status = active_downloads[user_id]
-            await update.message.reply_text(
-                f"🔄 Your download is in progress!\n\n"
-                f"Current status: {status}\n\n"
-                f"I'll send you the file as soon as it's ready.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-                ])
-            )
-        else:
-            # Check if user is in queue
-            position = 0
-            for i in range(download_queue.qsize()):
-                try:
-                    item = download_queue.queue[i]
-                    if item[0] == user_id:
-                        position = i + 1
-                        break
-                except:
-                    pass
-            
-            if position > 0:
-                est_time = position * 2  # Rough estimate: 2 minutes per download
-                await update.message.reply_text(
-                    f"⏳ You're in the queue!\n\n"
-                    f"Position: {position} of {download_queue.qsize()}\n"
-                    f"Estimated wait time: ~{est_time} minutes\n\n"
-                    f"I'll notify you when your download starts.",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-                    ])
-                )
-            else:
-                await update.message.reply_text(
-                    "📭 You don't have any active downloads.\n\n"
-                    "Go to the main menu to start downloading!",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-                    ])
+    # A single dict read is atomic, so the status is read without queue_lock and
+    # the event loop never waits on a download worker's mutex
+    status = active_downloads.get(user_id)
+    
+    # Check if user has an active download
+    if status is not None:
+        message = await update.message.reply_text(
+            _in_progress_text(status),
+            reply_markup=_KB_BACK_MAIN
+        )
+        # Follow in a separate task: while this handler runs, the conversation
+        # would hold back the user's other messages and button presses
+        context.application.create_task(
+            follow_download_status(message, user_id, status), update=update
+        )
+        return
+    
+    # Check if user is in queue
+    position = download_queue.position(user_id)
+    if position > 0:
+        est_time = download_queue.estimated_wait_minutes(position)
+        await update.message.reply_text(
+            f"⏳ You're in the queue!\n\n"
+            f"Position: {position} of {download_queue.qsize()}\n"
+            f"Estimated wait time: ~{est_time} minutes\n\n"
+            f"I'll notify you when your download starts.",
+            reply_markup=_KB_BACK_MAIN
+        )
+    else:
+        await update.message.reply_text(
+            "📭 You don't have any active downloads.\n\n"
+            "Go to the main menu to start downloading!",
+            reply_markup=_KB_BACK_MAIN
+        )
+
+def _in_progress_text(status):
+    """Body of the /status reply for a download that is running."""
+    return (
+        f"🔄 Your download is in progress!\n\n"
+        f"Current status: {status}\n\n"
+        f"I'll send you the file as soon as it's ready."
+    )
+
+async def follow_download_status(message, user_id, status):
+    """Edit a /status reply in place whenever the download's status changes."""
+    deadline = time.monotonic() + STATUS_FOLLOW_SEC
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not await active_downloads.wait_for_change(user_id, remaining):
+            return
+        
+        new_status = active_downloads.get(user_id)
+        
+        try:
+            if new_status is None:
+                await message.edit_text(
+                    "✅ Your download has finished processing. "
+                    "Your files, or an error message, are in this chat.",
+                    reply_markup=_KB_BACK_MAIN
                 )
+                return
+            if new_status != status:
+                status = new_status
+                await message.edit_text(_in_progress_text(status), reply_markup=_KB_BACK_MAIN)
+        except Exception as e:
+            logger.debug(f"Stopped following download status for user {user_id}: {e}")
+            return
 
 async def queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show the current download queue."""
-    with queue_lock:
-        queue_size = download_queue.qsize()
-        
-        if queue_size == 0:
-            await update.message.reply_text(
-                "✅ The download queue is currently empty!",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-                ])
-            )
-        else:
-            await update.message.reply_text(
-                f"👥 Current download queue: {queue_size} items\n\n"
-                f"Estimated processing time: ~{queue_size * 2} minutes\n\n"
-                f"Use /status to check your position in the queue.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-                ])
-            )
+    queue_size = download_queue.qsize()
+    
+    if queue_size == 0:
+        await update.message.reply_text(
+            "✅ The download queue is currently empty!",
+            reply_markup=_KB_BACK_MAIN
+        )
+    else:
+        await update.message.reply_text(
+            f"👥 Current download queue: {queue_size} items\n\n"
+            f"Estimated processing time: ~{download_queue.estimated_wait_minutes(queue_size)} minutes\n\n"
+            f"Use /status to check your position in the queue.",
+            reply_markup=_KB_BACK_MAIN
+        )
 
 async def my_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Show user information and subscription details."""
@@ -317,22 +639,28 @@ async def my_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     payment_history = []  # Add payment history
     
     if db:
-        user_info = db.get_user(user_id)
-        subscriptions = db.get_all_user_subscriptions(user_id)
+        async def recent_payments():
+            # Payment history is optional; don't fail the whole page over it
+            try:
+                return await run_db(db.get_user_payments, user_id, limit=3)
+            except Exception as e:
+                logger.error(f"Error getting payment history: {e}")
+                return []
+        
+        # The lookups are independent, so run them concurrently
+        user_info, subscriptions, freepik_limit, payment_history = await asyncio.gather(
+            run_db(db.get_user, user_id, fields=["registration_date"]),
+            run_db(db.get_all_user_subscriptions, user_id),
+            run_db(db.get_download_limit, user_id, "freepik"),
+            recent_payments()
+        )
         
         # Get download stats for Freepik
-        freepik_limit = db.get_download_limit(user_id, "freepik")
         if freepik_limit:
             download_stats["freepik"] = {
                 "today": freepik_limit["count"],
                 "limit": freepik_limit["limit"]
             }
-            
-        # Get recent payment history
-        try:
-            payment_history = db.get_user_payments(user_id, limit=3)
-        except Exception as e:
-            logger.error(f"Error getting payment history: {e}")
     
     # Format subscriptions info
     subscription_text = ""
@@ -340,19 +668,19 @@ async def my_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         active_subscriptions = [s for s in subscriptions if s["status"] == "active"]
         
         if active_subscriptions:
-            subscription_text = "\n\n*Active Subscriptions:*\n"
+            subscription_text = "\n\n<b>Active Subscriptions:</b>\n"
             for sub in active_subscriptions:
                 service = sub["service"].capitalize()
                 plan = sub["plan"].capitalize()
                 end_date = sub["end_date"].strftime("%Y-%m-%d")
                 subscription_text += f"• {service} {plan} (Expires: {end_date})\n"
         else:
-            subscription_text = "\n\n*No active subscriptions*"
+            subscription_text = "\n\n<b>No active subscriptions</b>"
     else:
-        subscription_text = "\n\n*No subscriptions found*"
+        subscription_text = "\n\n<b>No subscriptions found</b>"
     
     # Format download stats
-    stats_text = "\n\n*Download Stats (Today):*\n"
+    stats_text = "\n\n<b>Download Stats (Today):</b>\n"
     if "freepik" in download_stats:
         stats_text += f"• Freepik: {download_stats['freepik']['today']}/{download_stats['freepik']['limit']} downloads\n"
     else:
@@ -361,7 +689,7 @@ async def my_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     # Format payment history
     payment_text = ""
     if payment_history:
-        payment_text = "\n\n*Recent Payments:*\n"
+        payment_text = "\n\n<b>Recent Payments:</b>\n"
         for payment in payment_history:
             service = payment.get("service", "Unknown").capitalize()
             plan = payment.get("plan", "Unknown").capitalize()
@@ -377,21 +705,19 @@ async def my_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if user_info and "registration_date" in user_info:
         reg_date = user_info["registration_date"].strftime("%Y-%m-%d")
     
+    # HTML only needs <, > and & escaped, so names with _ or * can't break the message
     await query.edit_message_text(
-        f"📋 *User Information*\n\n"
-        f"*User ID:* {user_id}\n"
-        f"*Username:* {query.from_user.username or 'Not set'}\n"
-        f"*Name:* {query.from_user.full_name}\n"
-        f"*Registered:* {reg_date}"
+        f"📋 <b>User Information</b>\n\n"
+        f"<b>User ID:</b> {user_id}\n"
+        f"<b>Username:</b> {html.escape(query.from_user.username or 'Not set')}\n"
+        f"<b>Name:</b> {html.escape(query.from_user.full_name)}\n"
+        f"<b>Registered:</b> {reg_date}"
         f"{subscription_text}"
         f"{stats_text}"
         f"{payment_text}"
         f"\n\nDownload limits are reset daily at 00:00 UTC.",
-        parse_mode=constants.ParseMode.MARKDOWN,
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("Manage Subscriptions", callback_data=SUBSCRIPTION_INFO)],
-            [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-        ])
+        parse_mode=constants.ParseMode.HTML,
+        reply_markup=_KB_MANAGE_SUBSCRIPTIONS
     )
     
     return MAIN_MENU
@@ -415,16 +741,14 @@ async def handle_service_selection(update: Update, context: ContextTypes.DEFAULT
             f"We're working hard to integrate {service_name} downloads.\n"
             f"Please check back later!",
             parse_mode=constants.ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-            ])
+            reply_markup=_KB_BACK_MAIN
         )
         return MAIN_MENU
     
     return MAIN_MENU
 
 async def show_freepik_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Show Freepik service menu with absolutely no formatting to avoid entity issues."""
+    """Show the Freepik service menu with the user's subscription status."""
     query = update.callback_query
     user_id = query.from_user.id
     
@@ -433,23 +757,18 @@ async def show_freepik_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
     limit_info = {"count": 0, "limit": 0}
     
     if db:
-        subscription = db.get_active_subscription(user_id, "freepik")
-        
-        # Add debugging code for subscription check
-        is_valid, reason = db.debug_subscription_status(user_id, "freepik")
-        logger.info(f"Subscription check: valid={is_valid}, reason={reason}")
-        
-        limit_info = db.get_download_limit(user_id, "freepik")
+        subscription, limit_info, _ = await get_user_freepik_state(user_id)
     
-    # Determine subscription status text - with NO FORMATTING at all
+    # Determine subscription status text; plan names come from the database,
+    # so they are escaped for HTML
     if subscription:
-        plan_name = subscription["plan"].capitalize()
-        end_date = subscription["end_date"].strftime("%Y-%m-%d")
-        sub_text = f"✅ Active Subscription: {plan_name}\n"
+        plan_name = html.escape(subscription["plan"].capitalize())
+        end_date = subscription["end_date_str"]
+        sub_text = f"✅ <b>Active Subscription:</b> {plan_name}\n"
         sub_text += f"Expires: {end_date}\n"
         sub_text += f"Daily Limit: {limit_info['count']}/{limit_info['limit']} downloads used today\n\n"
     else:
-        sub_text = "❌ No Active Subscription\n"
+        sub_text = "❌ <b>No Active Subscription</b>\n"
         sub_text += "You need a subscription to download resources.\n\n"
     
     try:
@@ -459,29 +778,12 @@ async def show_freepik_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # Send a completely new message instead of editing
         await context.bot.send_message(
             chat_id=user_id,
-            text=f"🌐 Freepik Downloads\n\n{sub_text}What would you like to do?",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("📥 Send Freepik URL", callback_data=FREEPIK_SEND_URL)],
-                [InlineKeyboardButton("📋 My Downloads", callback_data=FREEPIK_DOWNLOADS)],
-                [InlineKeyboardButton("💳 Get Subscription", callback_data=SUBSCRIPTION_PLANS)],
-                [InlineKeyboardButton("ℹ️ About Freepik", callback_data=FREEPIK_INFO)],
-                [InlineKeyboardButton("⬅️ Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-            ])
+            text=f"🌐 <b>Freepik Downloads</b>\n\n{sub_text}What would you like to do?",
+            parse_mode=constants.ParseMode.HTML,
+            reply_markup=_KB_FREEPIK_MENU
         )
     except Exception as e:
         logger.error(f"Error in show_freepik_menu: {e}")
-        try:
-            # Fallback approach - just send a minimal message
-            await context.bot.send_message(
-                chat_id=user_id,
-                text="Freepik Downloads - Select an option:",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("📥 Send Freepik URL", callback_data=FREEPIK_SEND_URL)],
-                    [InlineKeyboardButton("⬅️ Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-                ])
-            )
-        except Exception as e2:
-            logger.error(f"Second approach also failed: {e2}")
     
     return FREEPIK_MENU
 
@@ -507,9 +809,7 @@ async def show_freepik_info(update: Update, context: ContextTypes.DEFAULT_TYPE)
         "• Yearly: LKR 5,800 (10 downloads/day)\n\n"
         "Limits reset daily at 00:00 UTC.",
         parse_mode=constants.ParseMode.MARKDOWN,
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("⬅️ Back to Freepik Menu", callback_data=BACK_FREEPIK)]
-        ])
+        reply_markup=_KB_BACK_FREEPIK
     )
     
     return FREEPIK_MENU
@@ -526,7 +826,7 @@ async def show_user_downloads(update: Update, context: ContextTypes.DEFAULT_TYPE
     downloads = []
     if db:
         # Get today's downloads
-        downloads = db.get_user_downloads_for_date(user_id, "freepik", today)
+        downloads = await run_db(db.get_user_downloads_for_date, user_id, "freepik", today)
     
     # Format downloads info
     text = "📥 *Your Freepik Downloads Today*\n\n"
@@ -546,7 +846,7 @@ async def show_user_downloads(update: Update, context: ContextTypes.DEFAULT_TYPE
     # Add limit information
     limit_info = {"count": 0, "limit": 0}
     if db:
-        limit_info = db.get_download_limit(user_id, "freepik")
+        limit_info = await run_db(db.get_download_limit, user_id, "freepik")
     
     text += f"*Usage:* {limit_info['count']}/{limit_info['limit']} downloads\n"
     text += f"*Resets:* Daily at 00:00 UTC"
@@ -554,9 +854,7 @@ async def show_user_downloads(update: Update, context: ContextTypes.DEFAULT_TYPE
     await query.edit_message_text(
         text,
         parse_mode=constants.ParseMode.MARKDOWN,
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("⬅️ Back to Freepik Menu", callback_data=BACK_FREEPIK)]
-        ])
+        reply_markup=_KB_BACK_FREEPIK
     )
     
     return FREEPIK_MENU
@@ -577,25 +875,15 @@ async def prompt_for_url(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     limit_info = {"count": 0, "limit": 0}
     
     if db:
-        subscription = db.get_active_subscription(user_id, "freepik")
-        
-        # Add debugging code for subscription check
-        is_valid, reason = db.debug_subscription_status(user_id, "freepik")
-        logger.info(f"Subscription check in prompt_for_url: valid={is_valid}, reason={reason}")
-        
+        subscription, limit_info, can_download = await get_user_freepik_state(user_id)
         has_subscription = subscription is not None
-        can_download = db.can_download(user_id, "freepik")
-        limit_info = db.get_download_limit(user_id, "freepik")
     
     # Send a new message without editing original message
     if not has_subscription:
         await context.bot.send_message(
             chat_id=chat_id,
             text="❌ No Active Subscription\n\nYou need a subscription to download Freepik resources.\nPlease purchase a subscription to continue.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("💳 Get Subscription", callback_data=SUBSCRIPTION_PLANS)],
-                [InlineKeyboardButton("⬅️ Back to Freepik Menu", callback_data=BACK_FREEPIK)]
-            ])
+            reply_markup=_KB_GET_SUBSCRIPTION
         )
         return FREEPIK_MENU
     
@@ -603,9 +891,7 @@ async def prompt_for_url(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await context.bot.send_message(
             chat_id=chat_id,
             text=f"⚠️ Daily Limit Reached\n\nYou've used {limit_info['count']}/{limit_info['limit']} downloads today.\nYour limit will reset at 00:00 UTC.\n\nPlease try again tomorrow.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back to Freepik Menu", callback_data=BACK_FREEPIK)]
-            ])
+            reply_markup=_KB_BACK_FREEPIK
         )
         return FREEPIK_MENU
     
@@ -613,61 +899,38 @@ async def prompt_for_url(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await context.bot.send_message(
         chat_id=chat_id,
         text=f"📤 Please paste your Freepik URL below\n\nExample: https://www.freepik.com/premium-photo/example_12345.htm\n\nYou have used {limit_info['count']}/{limit_info['limit']} downloads today.",
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("⬅️ Cancel", callback_data=BACK_FREEPIK)]
-        ])
+        reply_markup=_KB_CANCEL_URL
     )
     
-    # Set state to expect URL
-    context.user_data["awaiting_url"] = True
-    
+    # Text sent from here on is routed to handle_url or reject_non_url
+    return AWAITING_URL
+
+async def reject_non_url(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Reply to text without a Freepik URL sent after the URL prompt."""
+    await update.message.reply_text(
+        "❌ That doesn't look like a valid Freepik URL.\n\n"
+        "Please send a link like this:\n"
+        "https://www.freepik.com/premium-photo/example_12345.htm",
+        reply_markup=_KB_RETRY_URL
+    )
     return FREEPIK_MENU
 
+async def use_menu_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Point users who type in the Freepik menu back to its buttons."""
+    await update.message.reply_text(
+        "Please use the menu buttons to navigate the bot. If you want to download a Freepik resource, select that option from the menu.",
+        reply_markup=_KB_GO_MAIN
+    )
+    return MAIN_MENU
+
 async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Handle Freepik URLs sent by users."""
+    """Handle Freepik URLs sent by users while in the AWAITING_URL state."""
     user_id = update.effective_user.id
-    message_text = update.message.text
-    
-    # Check if we're expecting a URL from this user
-    if not context.user_data.get("awaiting_url", False):
-        await update.message.reply_text(
-            "Please use the menu buttons to navigate the bot. If you want to download a Freepik resource, select that option from the menu.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Go to Main Menu", callback_data=BACK_MAIN_MENU)]
-            ])
-        )
-        return MAIN_MENU
     
-    # Reset the awaiting URL flag
-    context.user_data["awaiting_url"] = False
+    # The handler's filters.Regex(FREEPIK_URL_RE) already ran the search and
+    # left its match in context.matches, so the text isn't scanned again
+    freepik_url = context.matches[0].group(0)
     
-    # Check if the message contains a valid Freepik URL
-    if not re.search(FREEPIK_URL_PATTERN, message_text):
-        await update.message.reply_text(
-            "❌ That doesn't look like a valid Freepik URL.\n\n"
-            "Please send a link like this:\n"
-            "https://www.freepik.com/premium-photo/example_12345.htm",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Try Again", callback_data=FREEPIK_SEND_URL)],
-                [InlineKeyboardButton("Back to Freepik Menu", callback_data=BACK_FREEPIK)]
-            ])
-        )
-        return FREEPIK_MENU
-    
-    # Extract the complete URL including query parameters and fragments
-    url_match = re.search(FREEPIK_URL_PATTERN, message_text)
-    freepik_url = url_match.group(0)
-    
-    # If we're missing query parameters or hash fragments that exist in the original text, append them
-    # This ensures we catch any parameters after the pattern match
-    if '#' in message_text and '#' not in freepik_url:
-        fragment = message_text.split('#', 1)[1]
-        freepik_url = f"{freepik_url}#{fragment}"
-    
-    if '?' in message_text and '?' not in freepik_url:
-        query = message_text.split('?', 1)[1]
-        freepik_url = f"{freepik_url}?{query}"
-        
     logger.info(f"Extracted complete URL: {freepik_url}")
     
     # Store the URL in the context for later use
@@ -676,110 +939,80 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     # Check subscription and limit again before adding to queue
     has_subscription = False
     can_download = False
+    limit_info = {"count": 0, "limit": 0}
     
     if db:
-        subscription = db.get_active_subscription(user_id, "freepik")
-        
-        # Add debugging for subscription check
-        is_valid, reason = db.debug_subscription_status(user_id, "freepik")
-        logger.info(f"Subscription check in handle_url: valid={is_valid}, reason={reason}")
-        
+        subscription, limit_info, can_download = await get_user_freepik_state(user_id)
         has_subscription = subscription is not None
-        can_download = db.can_download(user_id, "freepik")
     
     if not has_subscription:
         await update.message.reply_text(
             "❌ No Active Subscription\n\n"
             "You need a subscription to download Freepik resources.\n"
             "Please purchase a subscription to continue.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("💳 Get Subscription", callback_data=SUBSCRIPTION_PLANS)],
-                [InlineKeyboardButton("⬅️ Back to Freepik Menu", callback_data=BACK_FREEPIK)]
-            ])
+            reply_markup=_KB_GET_SUBSCRIPTION
         )
         return FREEPIK_MENU
     
     if not can_download:
-        limit_info = db.get_download_limit(user_id, "freepik")
         await update.message.reply_text(
             "⚠️ Daily Limit Reached\n\n"
             f"You've used {limit_info['count']}/{limit_info['limit']} downloads today.\n"
             "Your limit will reset at 00:00 UTC.\n\n"
             "Please try again tomorrow.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back to Freepik Menu", callback_data=BACK_FREEPIK)]
-            ])
+            reply_markup=_KB_BACK_FREEPIK
         )
         return FREEPIK_MENU
     
-    # Check if user already has a download in progress
+    # Check for an existing download and enqueue under the lock, but send the
+    # replies after releasing it so download workers never wait on Telegram
+    queue_position = 0
     with queue_lock:
-        if user_id in active_downloads:
-            await update.message.reply_text(
-                "⚠️ You already have a download in progress!\n\n"
-                "Please wait for it to complete before requesting another download.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("Check Status", callback_data="check_status")],
-                    [InlineKeyboardButton("⬅️ Back to Freepik Menu", callback_data=BACK_FREEPIK)]
-                ])
-            )
-            return FREEPIK_MENU
-        
-        # Check if user is already in queue
-        for i in range(download_queue.qsize()):
+        in_progress = user_id in active_downloads
+        already_queued = not in_progress and user_id in download_queue
+        if not (in_progress or already_queued):
             try:
-                if download_queue.queue[i][0] == user_id:
-                    await update.message.reply_text(
-                        "⚠️ You already have a download in the queue!\n\n"
-                        f"Use /status to check your position.",
-                        reply_markup=InlineKeyboardMarkup([
-                            [InlineKeyboardButton("Check Status", callback_data="check_status")],
-                            [InlineKeyboardButton("⬅️ Back to Freepik Menu", callback_data=BACK_FREEPIK)]
-                        ])
-                    )
-                    return FREEPIK_MENU
-            except:
+                download_queue.put_nowait((user_id, update.effective_chat.id, freepik_url, update.message.message_id))
+                queue_position = download_queue.position(user_id)
+            except queue.Full:
                 pass
     
-        # Try to add to queue
-        try:
-            download_queue.put_nowait((user_id, update.effective_chat.id, freepik_url, update.message.message_id))
-            queue_position = download_queue.qsize()
-            est_time = queue_position * 2  # Rough estimate: 2 minutes per download
-            
-            # Send processing message without markdown formatting
-            processing_message = await update.message.reply_text(
-                "⏳ Processing Your Download\n\n"
-                f"URL: {freepik_url}\n\n"
-                "Please wait while I download this resource for you..."
-            )
-            
-            # Store the processing message ID in context
-            context.user_data["processing_message_id"] = processing_message.message_id
-            
-            # Increment download count in database
-            if db:
-                db.increment_download_count(user_id, "freepik")
-            
-            # Update queue position message - no markdown
-            await update.message.reply_text(
-                f"✅ Your download request has been added to the queue!\n\n"
-                f"URL: {freepik_url}\n"
-                f"Queue position: {queue_position}\n"
-                f"Estimated wait time: ~{est_time} minutes\n\n"
-                f"I'll notify you when your download is complete.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("⬅️ Back to Freepik Menu", callback_data=BACK_FREEPIK)]
-                ])
-            )
-        except queue.Full:
-            await update.message.reply_text(
-                "😔 I'm sorry, but the download queue is currently full.\n\n"
-                "Please try again in a few minutes!",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("⬅️ Back to Freepik Menu", callback_data=BACK_FREEPIK)]
-                ])
-            )
+    if in_progress:
+        await update.message.reply_text(
+            "⚠️ You already have a download in progress!\n\n"
+            "Please wait for it to complete before requesting another download.",
+            reply_markup=_KB_CHECK_STATUS
+        )
+    elif already_queued:
+        await update.message.reply_text(
+            "⚠️ You already have a download in the queue!\n\n"
+            f"Use /status to check your position.",
+            reply_markup=_KB_CHECK_STATUS
+        )
+    elif queue_position:
+        est_time = download_queue.estimated_wait_minutes(queue_position)
+        
+        # Count the download before replying, so a failed reply can't leave a
+        # queued job uncounted
+        if db:
+            await run_db(db.increment_download_count, user_id, "freepik")
+            invalidate_user_freepik_state(user_id)
+        
+        # The job is already queued, so confirm it with a single message - no markdown
+        await update.message.reply_text(
+            f"✅ Your download request has been added to the queue!\n\n"
+            f"URL: {freepik_url}\n"
+            f"Queue position: {queue_position}\n"
+            f"Estimated wait time: ~{est_time} minutes\n\n"
+            f"I'll notify you when your download is complete.",
+            reply_markup=_KB_BACK_FREEPIK
+        )
+    else:
+        await update.message.reply_text(
+            "😔 I'm sorry, but the download queue is currently full.\n\n"
+            "Please try again in a few minutes!",
+            reply_markup=_KB_BACK_FREEPIK
+        )
     
     return FREEPIK_MENU
 
@@ -793,70 +1026,62 @@ async def show_subscription_info(update: Update, context: ContextTypes.DEFAULT_T
     # Get user subscriptions from database
     subscriptions = []
     if db:
-        subscriptions = db.get_all_user_subscriptions(user_id)
+        subscriptions = await run_db(db.get_all_user_subscriptions, user_id)
     
-    # Show subscription info
-    text = "💳 *Your Subscriptions*\n\n"
+    # Show subscription info, sorting subscriptions by status in one pass
+    parts = ["💳 *Your Subscriptions*\n\n"]
     
     if subscriptions:
-        active_subs = [s for s in subscriptions if s["status"] == "active"]
-        if active_subs:
-            for sub in active_subs:
-                service = sub['service'].capitalize()
-                plan = sub['plan'].capitalize()
-                end_date = sub['end_date'].strftime("%Y-%m-%d")
-                
-                text += f"*{service} - {plan}*\n"
-                text += f"Status: Active\n"
-                text += f"Expires: {end_date}\n\n"
+        active_parts = []
+        pending_parts = []
+        for sub in subscriptions:
+            status = sub["status"]
+            if status == "active":
+                active_parts.append(
+                    f"*{sub['service'].capitalize()} - {sub['plan'].capitalize()}*\n"
+                    f"Status: Active\n"
+                    f"Expires: {sub['end_date'].strftime('%Y-%m-%d')}\n\n"
+                )
+            elif status == "pending":
+                pending_parts.append(
+                    f"• {sub['service'].capitalize()} - {sub['plan'].capitalize()} (Awaiting payment verification)\n"
+                )
+        
+        if active_parts:
+            parts.extend(active_parts)
         else:
-            text += "You don't have any active subscriptions.\n\n"
-            
-        pending_subs = [s for s in subscriptions if s["status"] == "pending"]
-        if pending_subs:
-            text += "*Pending Subscriptions:*\n"
-            for sub in pending_subs:
-                service = sub['service'].capitalize()
-                plan = sub['plan'].capitalize()
-                
-                text += f"• {service} - {plan} (Awaiting payment verification)\n"
-            text += "\n"
+            parts.append("You don't have any active subscriptions.\n\n")
+        
+        if pending_parts:
+            parts.append("*Pending Subscriptions:*\n")
+            parts.extend(pending_parts)
+            parts.append("\n")
     else:
-        text += "You don't have any subscriptions yet.\n\n"
+        parts.append("You don't have any subscriptions yet.\n\n")
     
-    text += "Check out our subscription plans below!"
+    parts.append("Check out our subscription plans below!")
+    text = "".join(parts)
     
     await query.edit_message_text(
         text,
         parse_mode=constants.ParseMode.MARKDOWN,
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("📋 Available Plans", callback_data=SUBSCRIPTION_PLANS)],
-            [InlineKeyboardButton("⬅️ Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-        ])
+        reply_markup=_KB_SUBSCRIPTION_INFO
     )
     
     return SUBSCRIPTION_MENU
 
-async def show_subscription_plans(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Show available subscription plans from the database."""
-    query = update.callback_query
-    await query.answer()
-    
-    # Get available plans from database
+def _render_subscription_plans(all_plans):
+    """Build the plans message text and keyboard from the active plans."""
     plans_text = ""
     all_buttons = []
     service_plans = {}
     
-    if db:
-        # Get all active plans
-        all_plans = db.get_subscription_plans()
-        
-        # Group plans by service
-        for plan in all_plans:
-            service = plan["service"]
-            if service not in service_plans:
-                service_plans[service] = []
-            service_plans[service].append(plan)
+    # Group plans by service
+    for plan in all_plans:
+        service = plan["service"]
+        if service not in service_plans:
+            service_plans[service] = []
+        service_plans[service].append(plan)
     
     # Format the text and buttons
     if service_plans:
@@ -905,11 +1130,27 @@ async def show_subscription_plans(update: Update, context: ContextTypes.DEFAULT_
     # Add back button
     all_buttons.append([InlineKeyboardButton("⬅️ Back", callback_data=SUBSCRIPTION_INFO)])
     
+    return f"📋 *Available Subscription Plans*\n\n{plans_text}", InlineKeyboardMarkup(all_buttons)
+
+async def show_subscription_plans(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Show available subscription plans from the database."""
+    global _plans_cache
+    query = update.callback_query
+    await query.answer()
+    
+    # Plans change rarely, so reuse the rendered message for PLANS_CACHE_TTL_SEC
+    if _plans_cache and _plans_cache[0] > time.monotonic():
+        text, reply_markup = _plans_cache[1:]
+    else:
+        all_plans = await run_db(db.get_subscription_plans) if db else []
+        text, reply_markup = _render_subscription_plans(all_plans)
+        _plans_cache = (time.monotonic() + PLANS_CACHE_TTL_SEC, text, reply_markup)
+    
     # Send the message
     await query.edit_message_text(
-        f"📋 *Available Subscription Plans*\n\n{plans_text}",
+        text,
         parse_mode=constants.ParseMode.MARKDOWN,
-        reply_markup=InlineKeyboardMarkup(all_buttons)
+        reply_markup=reply_markup
     )
     
     return SUBSCRIPTION_MENU
@@ -923,34 +1164,32 @@ async def process_subscription_selection(update: Update, context: ContextTypes.D
     plan_data = query.data
     logger.info(f"Processing subscription selection: {plan_data}")
     
+    # Handle legacy hardcoded plans
+    legacy_plan = _LEGACY_PLANS.get(plan_data)
+    if legacy_plan:
+        context.user_data.update(legacy_plan)
+    
     # Check if this is a dynamic plan from database
-    if plan_data.startswith("plan_"):
+    elif plan_data.startswith("plan_"):
         # Parse service and plan_id from the callback data
         # Format: plan_service_planid
-        parts = plan_data.split("_", 2)
-        if len(parts) != 3:
+        service, _, plan_id = plan_data[len("plan_"):].partition("_")
+        if not service or not plan_id:
             await query.edit_message_text(
                 "❌ Invalid plan selection. Please try again.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("⬅️ Back to Plans", callback_data=SUBSCRIPTION_PLANS)]
-                ])
+                reply_markup=_KB_BACK_PLANS
             )
             return SUBSCRIPTION_MENU
-            
-        service = parts[1]
-        plan_id = parts[2]
         
         # Get plan details from database
         plan = None
         if db:
-            plan = db.get_subscription_plan(service, plan_id)
+            plan = await run_db(db.get_subscription_plan, service, plan_id)
         
         if not plan:
             await query.edit_message_text(
                 "❌ Selected plan not found. Please try again.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("⬅️ Back to Plans", callback_data=SUBSCRIPTION_PLANS)]
-                ])
+                reply_markup=_KB_BACK_PLANS
             )
             return SUBSCRIPTION_MENU
             
@@ -961,26 +1200,11 @@ async def process_subscription_selection(update: Update, context: ContextTypes.D
         context.user_data["subscription_name"] = plan["name"]
         context.user_data["subscription_currency"] = plan["currency"]
         
-    # Handle legacy hardcoded plans
-    elif plan_data == FREEPIK_MONTHLY:
-        context.user_data["subscription_service"] = "freepik"
-        context.user_data["subscription_plan"] = "monthly"
-        context.user_data["subscription_amount"] = 1500
-        context.user_data["subscription_name"] = "Monthly"
-        context.user_data["subscription_currency"] = "LKR"
-    elif plan_data == FREEPIK_YEARLY:
-        context.user_data["subscription_service"] = "freepik"
-        context.user_data["subscription_plan"] = "yearly"
-        context.user_data["subscription_amount"] = 5800
-        context.user_data["subscription_name"] = "Yearly"
-        context.user_data["subscription_currency"] = "LKR"
     else:
         # Invalid plan
         await query.edit_message_text(
             "❌ Invalid plan selection. Please try again.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Back to Plans", callback_data=SUBSCRIPTION_PLANS)]
-            ])
+            reply_markup=_KB_BACK_PLANS
         )
         return SUBSCRIPTION_MENU
     
@@ -990,38 +1214,16 @@ async def process_subscription_selection(update: Update, context: ContextTypes.D
     amount = context.user_data["subscription_amount"]
     currency = context.user_data.get("subscription_currency", "LKR")
     
-    # Bank details
-    bank_name = BANK_DETAILS.get("bank_name", "Bank of Ceylon")
-    branch_name = BANK_DETAILS.get("branch_name", "Main Branch")
-    account_name = BANK_DETAILS.get("account_name", "Your Name")
-    account_number = BANK_DETAILS.get("account_number", "1234567890")
-    
-    # Debugging
-    logger.info(f"Bank details: {BANK_DETAILS}")
     logger.info(f"Showing payment instructions for {service} {plan_name}, {currency} {amount}")
     
-    # Format amount with commas
-    formatted_amount = f"{amount:,}"
-    
     await query.edit_message_text(
         f"💳 *Subscribe to {service} {plan_name}*\n\n"
-        f"Amount: {currency} {formatted_amount}\n\n"
-        "*Payment Instructions:*\n"
-        "1. Make a payment to the bank account below\n"
-        "2. Add your Telegram User ID as the reference\n"
-        "3. Take a screenshot/photo of the payment receipt\n"
-        "4. Send the screenshot/photo to this chat\n\n"
-        "*Bank Details:*\n"
-        f"Bank: {bank_name}\n"
-        f"Branch: {branch_name}\n"
-        f"Name: {account_name}\n"
-        f"Account Number: {account_number}\n\n"
+        f"Amount: {currency} {amount:,}\n\n"
+        f"{_PAYMENT_INSTRUCTIONS}"
         f"Reference: {query.from_user.id} (Your Telegram User ID)\n\n"
         "Please send a photo of your payment receipt.",
         parse_mode=constants.ParseMode.MARKDOWN,
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("❌ Cancel", callback_data=SUBSCRIPTION_INFO)]
-        ])
+        reply_markup=_KB_CANCEL_PAYMENT
     )
     
     # Return the next state
@@ -1035,6 +1237,27 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
     # Let the user know we received their callback
     await query.answer()
 
+def save_receipt(receipt_path, image_data):
+    """Write a payment receipt, creating the receipts directory on first use."""
+    global _receipts_dir_ready
+    if not _receipts_dir_ready:
+        os.makedirs(RECEIPTS_DIR, exist_ok=True)
+        _receipts_dir_ready = True
+    
+    with open(receipt_path, "wb") as f:
+        f.write(image_data)
+
+async def download_telegram_file(tg_file, attempts=3):
+    """Download a Telegram file over the bot's pooled connection, retrying network errors."""
+    for attempt in range(attempts):
+        try:
+            return bytes(await tg_file.download_as_bytearray())
+        except NetworkError as e:
+            if attempt == attempts - 1:
+                raise
+            logger.warning(f"Telegram file download failed (attempt {attempt + 1}/{attempts}): {e}")
+            await asyncio.sleep(2 ** attempt)
+
 async def handle_payment_proof(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle payment proof image uploads with enhanced storage."""
     user_id = update.effective_user.id
@@ -1050,9 +1273,7 @@ async def handle_payment_proof(update: Update, context: ContextTypes.DEFAULT_TYP
     if not context.user_data.get("subscription_service"):
         await update.message.reply_text(
             "Please use the menu to select a subscription plan first.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("View Plans", callback_data=SUBSCRIPTION_PLANS)]
-            ])
+            reply_markup=_KB_VIEW_PLANS
         )
         return MAIN_MENU
     
@@ -1060,9 +1281,7 @@ async def handle_payment_proof(update: Update, context: ContextTypes.DEFAULT_TYP
     if not update.message.photo:
         await update.message.reply_text(
             "Please send a photo/screenshot of your payment receipt.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Cancel", callback_data=SUBSCRIPTION_INFO)]
-            ])
+            reply_markup=_KB_CANCEL_SUB
         )
         return AWAITING_PAYMENT
     
@@ -1088,7 +1307,8 @@ async def handle_payment_proof(update: Update, context: ContextTypes.DEFAULT_TYP
         
         # Save user information in database with enhanced details
         if db:
-            db.create_or_update_user(
+            await run_db(
+                db.create_or_update_user,
                 user_id=user_id,
                 username=username,
                 name=full_name,
@@ -1100,94 +1320,53 @@ async def handle_payment_proof(update: Update, context: ContextTypes.DEFAULT_TYP
                 }
             )
         
-        # Create payment record in database
-        payment_id = None
-        subscription_id = None
+        # One timestamp for both the receipt filename and the payment record
+        received_at = datetime.datetime.utcnow()
         
         # Download the actual image file with timeout handling
+        receipt_path = None
         try:
-            # Use a session with longer timeout
-            import requests
-            from requests.adapters import HTTPAdapter
-            from urllib3.util.retry import Retry
-            
-            session = requests.Session()
-            retry_strategy = Retry(
-                total=3,
-                backoff_factor=1,
-                status_forcelist=[429, 500, 502, 503, 504],
-            )
-            adapter = HTTPAdapter(max_retries=retry_strategy)
-            session.mount("http://", adapter)
-            session.mount("https://", adapter)
-            
-            # Download with extended timeout (30 seconds)
-            response = session.get(file_url, timeout=30)
-            image_data = response.content
+            image_data = await download_telegram_file(photo_file)
             
             # Create a unique filename for the payment receipt
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            timestamp = received_at.strftime("%Y%m%d_%H%M%S")
             receipt_filename = f"payment_receipt_{user_id}_{timestamp}.jpg"
             
-            # Save the image to a local directory
-            receipts_dir = os.path.join("downloads", "payment_receipts")
-            os.makedirs(receipts_dir, exist_ok=True)
-            receipt_path = os.path.join(receipts_dir, receipt_filename)
+            # Save the image to a local directory, off the event loop
+            receipt_path = os.path.join(RECEIPTS_DIR, receipt_filename)
+            await asyncio.to_thread(save_receipt, receipt_path, image_data)
             
-            with open(receipt_path, "wb") as f:
-                f.write(image_data)
-                
             # Log the saved file path
             logger.info(f"Payment receipt saved locally at: {receipt_path}")
-            
-            if db:
-                # Create payment record with enhanced information
-                payment = db.create_payment(
-                    user_id=user_id, 
-                    amount=amount, 
-                    currency=currency,
-                    service=service, 
-                    plan=plan, 
-                    image_url=file_url,
-                    image_file_id=photo.file_id,  # Store Telegram file ID
-                    image_file_path=receipt_path,  # Store local file path
-                    notes=update.message.caption or "",  # Include any caption as notes
-                    payment_date=datetime.datetime.utcnow()
-                )
-                payment_id = payment["_id"]
-                
-                # Create subscription record linked to payment
-                subscription = db.create_subscription(user_id, service, plan, payment_id)
-                subscription_id = subscription["_id"]
-        except requests.exceptions.Timeout:
+        except TimedOut:
             logger.error(f"Timeout downloading payment receipt image for user {user_id}")
             await update.message.reply_text(
                 "❌ The image download timed out. Please try sending a smaller image or contact support.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-                ])
+                reply_markup=_KB_BACK_MAIN
             )
             return MAIN_MENU
         except Exception as e:
-            logger.error(f"Error downloading payment image: {e}")
             # Fall back to just storing the Telegram file ID
-            if db:
-                payment = db.create_payment(
-                    user_id=user_id, 
-                    amount=amount, 
-                    currency=currency,
-                    service=service, 
-                    plan=plan, 
-                    image_url=file_url,
-                    image_file_id=photo.file_id,
-                    notes=update.message.caption or "",
-                    payment_date=datetime.datetime.utcnow()
-                )
-                payment_id = payment["_id"]
-                
-                # Create subscription record linked to payment
-                subscription = db.create_subscription(user_id, service, plan, payment_id)
-                subscription_id = subscription["_id"]
+            logger.error(f"Error downloading payment image: {e}")
+            receipt_path = None
+        
+        # Create the payment record and its linked subscription together
+        payment_id = None
+        if db:
+            payment, subscription = await run_db(
+                db.create_payment_and_subscription,
+                user_id=user_id, 
+                amount=amount, 
+                currency=currency,
+                service=service, 
+                plan=plan, 
+                image_url=file_url,
+                image_file_id=photo.file_id,  # Store Telegram file ID
+                image_file_path=receipt_path,  # Store local file path, if saved
+                notes=update.message.caption or "",  # Include any caption as notes
+                payment_date=received_at
+            )
+            payment_id = payment["_id"]
         
         # Clean up context
         context.user_data.pop("subscription_service", None)
@@ -1202,14 +1381,15 @@ async def handle_payment_proof(update: Update, context: ContextTypes.DEFAULT_TYP
             "This usually takes 1-24 hours during business days.\n\n"
             "You'll receive a notification once your subscription is active.",
             parse_mode=constants.ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-            ])
+            reply_markup=_KB_BACK_MAIN
         )
         
         # Notify admin about new payment in a separate task to avoid timeout
         context.application.create_task(
-            notify_admin_about_payment(context, user_id, payment_id, service, plan, amount, currency)
+            notify_admin_about_payment(
+                context, user_id, payment_id, service, plan, amount, currency,
+                update.message.chat_id, update.message.message_id, photo.file_id
+            )
         )
         
         return MAIN_MENU
@@ -1218,18 +1398,18 @@ async def handle_payment_proof(update: Update, context: ContextTypes.DEFAULT_TYP
         logger.error(f"Error processing payment proof: {e}", exc_info=True)
         await update.message.reply_text(
             "❌ There was an error processing your payment proof. Please try again later or contact support.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-            ])
+            reply_markup=_KB_BACK_MAIN
         )
         return MAIN_MENU
 
-async def notify_admin_about_payment(context, user_id, payment_id, service, plan, amount, currency):
-    """Send notification to admin(s) about new payment with better error handling."""
-    # Get admin chat IDs from config
-    admin_chat_ids = ADMIN_CHAT_IDS
+async def notify_admin_about_payment(context, user_id, payment_id, service, plan, amount, currency, receipt_chat_id, receipt_message_id, receipt_file_id):
+    """Send notification to admin(s) about new payment with better error handling.
     
-    if not admin_chat_ids or (len(admin_chat_ids) == 1 and admin_chat_ids[0] == ""):
+    Each admin gets a copy of the user's receipt message with the notification as
+    its caption; if copying fails, the notification and photo are sent separately.
+    """
+    # Admin chat IDs were parsed from config in init_bot
+    if not ADMIN_IDS:
         logger.warning("No admin chat IDs configured for payment notifications")
         return
     
@@ -1237,7 +1417,7 @@ async def notify_admin_about_payment(context, user_id, payment_id, service, plan
     user_info = ""
     if db:
         try:
-            user = db.get_user(user_id)
+            user = await run_db(db.get_user, user_id, fields=["username", "name"])
             if user:
                 username = user.get("username", "No username")
                 name = user.get("name", "Unknown")
@@ -1266,42 +1446,99 @@ async def notify_admin_about_payment(context, user_id, payment_id, service, plan
         ]
     ])
     
-    # Send notification to all admins
-    for admin_id in admin_chat_ids:
+    async def _send_one(admin_id):
+        # One call delivers the receipt, the details and the buttons together
         try:
-            admin_id = admin_id.strip()
-            if admin_id.isdigit():
-                await context.bot.send_message(
-                    chat_id=int(admin_id),
-                    text=notification,
-                    parse_mode=constants.ParseMode.MARKDOWN,
-                    reply_markup=keyboard
-                )
-                logger.info(f"Payment notification sent to admin {admin_id}")
-                
-                # Send the payment receipt image separately with error handling
-                if db:
+            await context.bot.copy_message(
+                chat_id=admin_id,
+                from_chat_id=receipt_chat_id,
+                message_id=receipt_message_id,
+                caption=notification,
+                parse_mode=constants.ParseMode.MARKDOWN,
+                reply_markup=keyboard
+            )
+            logger.info(f"Payment receipt and notification sent to admin {admin_id}")
+            return
+        except Exception as e:
+            logger.warning(f"Could not copy payment receipt to admin {admin_id}, sending separately: {e}")
+        
+        try:
+            await context.bot.send_message(
+                chat_id=admin_id,
+                text=notification,
+                parse_mode=constants.ParseMode.MARKDOWN,
+                reply_markup=keyboard
+            )
+            logger.info(f"Payment notification sent to admin {admin_id}")
+            
+            # Send the payment receipt image separately with error handling
+            if receipt_file_id:
+                try:
+                    await context.bot.send_photo(
+                        chat_id=admin_id,
+                        photo=receipt_file_id,
+                        caption=f"Payment receipt for Payment ID: {payment_id}"
+                    )
+                    logger.info(f"Payment receipt image sent to admin {admin_id}")
+                except Exception as img_error:
+                    logger.error(f"Error sending payment image to admin {admin_id}: {img_error}")
+                    # Try to send a message about the error
                     try:
-                        payment = db.get_payment(payment_id)
-                        if payment and "image_file_id" in payment:
-                            await context.bot.send_photo(
-                                chat_id=int(admin_id),
-                                photo=payment["image_file_id"],
-                                caption=f"Payment receipt for Payment ID: {payment_id}"
-                            )
-                            logger.info(f"Payment receipt image sent to admin {admin_id}")
-                    except Exception as img_error:
-                        logger.error(f"Error sending payment image to admin {admin_id}: {img_error}")
-                        # Try to send a message about the error
-                        try:
-                            await context.bot.send_message(
-                                chat_id=int(admin_id),
-                                text=f"Failed to send payment receipt image: {img_error}"
-                            )
-                        except:
-                            pass
+                        await context.bot.send_message(
+                            chat_id=admin_id,
+                            text=f"Failed to send payment receipt image: {img_error}"
+                        )
+                    except:
+                        pass
         except Exception as e:
             logger.error(f"Failed to send payment notification to admin {admin_id}: {e}")
+    
+    # Send notification to all admins concurrently
+    await asyncio.gather(
+        *[_send_one(admin_id) for admin_id in ADMIN_IDS],
+        return_exceptions=True
+    )
+
+async def _edit_admin_message(query, text):
+    """Replace an admin payment message's text, or its caption if it carries the receipt, and drop its buttons."""
+    if query.message.caption is not None or query.message.photo:
+        await query.edit_message_caption(caption=text, reply_markup=None)
+    else:
+        await query.edit_message_text(text, reply_markup=None)
+
+async def _finish_admin_action(query, context, payment_user_id, kind, user_text, admin_text, fallback_text):
+    """Notify the payment's user and update the admin's message concurrently."""
+    async def notify_user():
+        try:
+            await context.bot.send_message(
+                chat_id=payment_user_id,
+                text=user_text,
+                parse_mode=constants.ParseMode.MARKDOWN
+            )
+            logger.info(f"Sent {kind} notification to user {payment_user_id}")
+        except Exception as e:
+            logger.error(f"Failed to send {kind} notification to user {payment_user_id}: {e}")
+    
+    async def update_admin():
+        # Only edit the text if it changes, to avoid a BadRequest error
+        if (query.message.text or query.message.caption) != admin_text:
+            try:
+                await _edit_admin_message(query, admin_text)
+            except Exception as e:
+                logger.error(f"Failed to update admin message: {e}")
+                # Alternative approach: send a new message instead of editing
+                await context.bot.send_message(chat_id=query.message.chat_id, text=fallback_text)
+        elif query.message.reply_markup is not None:
+            # The message already states the outcome, so only its buttons need to go
+            try:
+                await query.edit_message_reply_markup(reply_markup=None)
+            except Exception as e:
+                logger.error(f"Failed to update message reply markup: {e}")
+    
+    results = await asyncio.gather(notify_user(), update_admin(), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Error finishing payment {kind}: {result}")
 
 async def handle_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle admin approval/rejection of payments directly from Telegram."""
@@ -1310,32 +1547,27 @@ async def handle_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     # Extract action and payment ID from callback data
     # Format: admin_approve_paymentid or admin_reject_paymentid
-    callback_data = query.data
-    parts = callback_data.split('_', 2)
+    action, _, payment_id = query.data[len("admin_"):].partition("_")
     
-    if len(parts) != 3:
-        await query.edit_message_text("Invalid callback data format.")
+    if not action or not payment_id:
+        await _edit_admin_message(query, "Invalid callback data format.")
         return
     
-    action = parts[1]
-    payment_id = parts[2]
-    
     # Verify this is an admin
-    admin_chat_ids = [str(admin_id).strip() for admin_id in ADMIN_CHAT_IDS if admin_id]
     user_id = query.from_user.id
     
-    if str(user_id) not in admin_chat_ids:
-        await query.edit_message_text("You don't have permission to perform this action.")
+    if user_id not in ADMIN_IDS:
+        await _edit_admin_message(query, "You don't have permission to perform this action.")
         return
     
     if not db:
-        await query.edit_message_text("Database connection not available.")
+        await _edit_admin_message(query, "Database connection not available.")
         return
     
-    # Get payment details
-    payment = db.get_payment(payment_id)
+    # Get payment details, with the linked subscription, in one query
+    payment = await run_db(db.get_payment_with_subscription, payment_id)
     if not payment:
-        await query.edit_message_text(f"Payment with ID {payment_id} not found.")
+        await _edit_admin_message(query, f"Payment with ID {payment_id} not found.")
         return
     
     # Get user ID and subscription details from payment
@@ -1347,20 +1579,23 @@ async def handle_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     # Process based on action type
     if action == "approve":
-        # Update payment status
-        db.update_payment_status(payment_id, "approved", f"Approved by admin {user_id} via Telegram")
+        # Update payment status and activate the linked subscription together
+        sub = payment["subscription"]
+        updates = [run_db(db.update_payment_status, payment_id, "approved", f"Approved by admin {user_id} via Telegram")]
+        if sub:
+            updates.append(run_db(db.activate_subscription, sub["_id"]))
+        await asyncio.gather(*updates)
         
-        # Find and activate subscription associated with this payment
         success = False
-        subscriptions = db.get_all_user_subscriptions(payment_user_id)
-        
-        for sub in subscriptions:
-            if str(sub.get("payment_id")) == str(payment_id):
-                db.activate_subscription(sub["_id"])
-                # Add additional user details to users table
-                try:
+        if sub:
+            invalidate_user_freepik_state(payment_user_id)
+            # handle_payment_proof already stored the user's details, so just record
+            # the approval; only fetch them from Telegram if the user record is missing
+            try:
+                if not await run_db(db.mark_payment_approved, payment_user_id, payment_id):
                     user = await context.bot.get_chat(payment_user_id)
-                    db.create_or_update_user(
+                    await run_db(
+                        db.create_or_update_user,
                         user_id=payment_user_id,
                         username=user.username,
                         name=user.full_name,
@@ -1373,102 +1608,41 @@ async def handle_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE
                             "payment_approved_at": datetime.datetime.utcnow()
                         }
                     )
-                    logger.info(f"Updated user {payment_user_id} details after payment approval")
-                except Exception as user_error:
-                    logger.error(f"Failed to update user details after payment: {user_error}")
-                success = True
-                break
+                logger.info(f"Updated user {payment_user_id} details after payment approval")
+            except Exception as user_error:
+                logger.error(f"Failed to update user details after payment: {user_error}")
+            success = True
         
-        # Notify user that their payment has been approved
-        try:
-            await context.bot.send_message(
-                chat_id=payment_user_id,
-                text=(
-                    "✅ *Payment Approved!*\n\n"
-                    f"Your payment for {service.capitalize()} {plan.capitalize()} subscription has been approved.\n\n"
-                    "Your subscription is now active! You can now use the service."
-                ),
-                parse_mode=constants.ParseMode.MARKDOWN
-            )
-            logger.info(f"Sent approval notification to user {payment_user_id}")
-        except Exception as e:
-            logger.error(f"Failed to send approval notification to user {payment_user_id}: {e}")
-        
-        # Update admin message - with a modified text to avoid BadRequest error
-        current_text = query.message.text
-        new_text = f"✅ Payment {payment_id} approved successfully.\n\nUser {payment_user_id} has been notified and their subscription is now active."
-        
-        # Only update if the text is different
-        if current_text != new_text:
-            try:
-                await query.edit_message_text(new_text, reply_markup=None)
-            except Exception as e:
-                logger.error(f"Failed to update admin message: {e}")
-                # Alternative approach: send a new message instead of editing
-                await context.bot.send_message(
-                    chat_id=query.message.chat_id,
-                    text=f"✅ Action completed: Payment {payment_id} approved.\n\nUser {payment_user_id} has been notified."
-                )
-        else:
-            # If text would be the same, just remove the buttons
-            try:
-                await query.edit_message_reply_markup(reply_markup=None)
-            except Exception as e:
-                logger.error(f"Failed to update message reply markup: {e}")
-                # Send a confirmation as a new message
-                await context.bot.send_message(
-                    chat_id=query.message.chat_id,
-                    text=f"✅ Action completed: Payment approved."
-                )
+        # Tell the user and update the admin's message at the same time
+        await _finish_admin_action(
+            query, context, payment_user_id, "approval",
+            user_text=(
+                "✅ *Payment Approved!*\n\n"
+                f"Your payment for {service.capitalize()} {plan.capitalize()} subscription has been approved.\n\n"
+                "Your subscription is now active! You can now use the service."
+            ),
+            admin_text=f"✅ Payment {payment_id} approved successfully.\n\nUser {payment_user_id} has been notified and their subscription is now active.",
+            fallback_text=f"✅ Action completed: Payment {payment_id} approved.\n\nUser {payment_user_id} has been notified."
+        )
     
     elif action == "reject":
         # Update payment status
-        db.update_payment_status(payment_id, "rejected", f"Rejected by admin {user_id} via Telegram")
-        
-        # Notify user that their payment has been rejected
-        try:
-            await context.bot.send_message(
-                chat_id=payment_user_id,
-                text=(
-                    "❌ *Payment Rejected*\n\n"
-                    f"Your payment for {service.capitalize()} {plan.capitalize()} subscription could not be verified.\n\n"
-                    "Please contact support if you believe this is an error or try again with a clearer payment proof."
-                ),
-                parse_mode=constants.ParseMode.MARKDOWN
-            )
-            logger.info(f"Sent rejection notification to user {payment_user_id}")
-        except Exception as e:
-            logger.error(f"Failed to send rejection notification to user {payment_user_id}: {e}")
+        await run_db(db.update_payment_status, payment_id, "rejected", f"Rejected by admin {user_id} via Telegram")
         
-        # Update admin message - with a modified text to avoid BadRequest error
-        current_text = query.message.text
-        new_text = f"❌ Payment {payment_id} has been rejected.\n\nUser {payment_user_id} has been notified."
-        
-        # Only update if the text is different
-        if current_text != new_text:
-            try:
-                await query.edit_message_text(new_text, reply_markup=None)
-            except Exception as e:
-                logger.error(f"Failed to update admin message: {e}")
-                # Alternative approach: send a new message instead of editing
-                await context.bot.send_message(
-                    chat_id=query.message.chat_id,
-                    text=f"❌ Action completed: Payment {payment_id} rejected.\n\nUser {payment_user_id} has been notified."
-                )
-        else:
-            # If text would be the same, just remove the buttons
-            try:
-                await query.edit_message_reply_markup(reply_markup=None)
-            except Exception as e:
-                logger.error(f"Failed to update message reply markup: {e}")
-                # Send a confirmation as a new message
-                await context.bot.send_message(
-                    chat_id=query.message.chat_id,
-                    text=f"❌ Action completed: Payment rejected."
-                )
+        # Tell the user and update the admin's message at the same time
+        await _finish_admin_action(
+            query, context, payment_user_id, "rejection",
+            user_text=(
+                "❌ *Payment Rejected*\n\n"
+                f"Your payment for {service.capitalize()} {plan.capitalize()} subscription could not be verified.\n\n"
+                "Please contact support if you believe this is an error or try again with a clearer payment proof."
+            ),
+            admin_text=f"❌ Payment {payment_id} has been rejected.\n\nUser {payment_user_id} has been notified.",
+            fallback_text=f"❌ Action completed: Payment {payment_id} rejected.\n\nUser {payment_user_id} has been notified."
+        )
     
     else:
-        await query.edit_message_text("Unknown action type.")
+        await _edit_admin_message(query, "Unknown action type.")
 
 async def handle_license_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle license confirmation after resource download."""
@@ -1485,42 +1659,30 @@ async def handle_license_confirmation(update: Update, context: ContextTypes.DEFA
         await query.edit_message_text(
             "⏳ Processing License Download\n\n"
             "Please wait while I download the license file for you...\n"
-            "This may take up to 5 minutes to complete.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Cancel", callback_data=LICENSE_NO)]
-            ])
+            "This may take up to 5 minutes to complete.\n\n"
+            "ℹ️ License downloads require visiting the Freepik downloads page, which can take some time. Please be patient while I retrieve your license file.",
+            reply_markup=_KB_CANCEL_LICENSE
         )
         
         # Add to download queue with special flag for license only
         resource_url = context.user_data.get("last_download_url", "")
         
         if resource_url:
-            with queue_lock:
-                try:
-                    # Special flag in the tuple to indicate license-only download
-                    download_queue.put_nowait((user_id, chat_id, resource_url, query.message.message_id, True))
-                    logger.info(f"Added license-only download to queue for user {user_id}")
-                    
-                    # Send a follow-up message explaining the wait
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text="ℹ️ License downloads require visiting the Freepik downloads page, which can take some time. Please be patient while I retrieve your license file."
-                    )
-                except queue.Full:
-                    await query.edit_message_text(
-                        "😔 I'm sorry, but the download queue is currently full.\n\n"
-                        "Please try again in a few minutes!",
-                        reply_markup=InlineKeyboardMarkup([
-                            [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-                        ])
-                    )
+            try:
+                # Special flag in the tuple to indicate license-only download
+                download_queue.put_nowait((user_id, chat_id, resource_url, query.message.message_id, True))
+                logger.info(f"Added license-only download to queue for user {user_id}")
+            except queue.Full:
+                await query.edit_message_text(
+                    "😔 I'm sorry, but the download queue is currently full.\n\n"
+                    "Please try again in a few minutes!",
+                    reply_markup=_KB_BACK_MAIN
+                )
         else:
             await query.edit_message_text(
                 "❌ Error: Could not find the resource URL for license download.\n\n"
                 "Please try downloading the resource again.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-                ])
+                reply_markup=_KB_BACK_MAIN
             )
     else:
         # User doesn't want the license file
@@ -1528,9 +1690,7 @@ async def handle_license_confirmation(update: Update, context: ContextTypes.DEFA
             "✅ Download Complete\n\n"
             "Thank you for using our service!\n"
             "You can download more resources from the main menu.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Back to Main Menu", callback_data=BACK_MAIN_MENU)]
-            ])
+            reply_markup=_KB_BACK_MAIN
         )
     
     return MAIN_MENU
@@ -1539,23 +1699,167 @@ async def handle_license_confirmation(update: Update, context: ContextTypes.DEFA
 # Utility Functions
 # --------------------------------
 
+class _SendThrottle:
+    """Spaces calls from many threads so none breaks the global or per-chat rate.
+    
+    Every reserved slot is later than the one before it, so keeping the per-chat
+    times in the order they were last reserved also keeps them sorted. Expired
+    chats are then always at the front and are dropped as calls come in.
+    """
+    
+    def __init__(self, global_interval, chat_interval):
+        self._global_interval = global_interval
+        self._chat_interval = chat_interval
+        self._lock = threading.Lock()
+        self._next_global = 0.0
+        self._next_chat = collections.OrderedDict()  # chat_id -> earliest time of its next call
+    
+    def wait(self, chat_id):
+        """Block until this chat's next call may be made, reserving that slot."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_global, self._next_chat.get(chat_id, 0.0))
+            self._next_global = slot + self._global_interval
+            self._next_chat[chat_id] = slot + self._chat_interval
+            self._next_chat.move_to_end(chat_id)
+            # A chat whose next call time has passed is no longer throttled
+            while next(iter(self._next_chat.values())) <= now:
+                self._next_chat.popitem(last=False)
+        if slot > now:
+            time.sleep(slot - now)
+
+_api_throttle = _SendThrottle(API_GLOBAL_INTERVAL_SEC, API_CHAT_INTERVAL_SEC)
+
+class _MultipartUpload:
+    """A multipart/form-data body that streams its files from disk.
+    
+    requests builds multipart bodies in memory, so a large upload would be held
+    in RAM in full. This encodes the fields and part headers the same way
+    (via urllib3) but reads the files only as the body is sent. It has a length,
+    so it goes out with a Content-Length rather than chunked.
+    """
+    
+    def __init__(self, fields, files):
+        boundary = choose_boundary()
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._parts = []
+        self._length = 0
+        for name, value in fields.items():
+            field = RequestField(name=name, data=str(value))
+            field.make_multipart()
+            self._add_bytes(f"--{boundary}\r\n{field.render_headers()}{value}\r\n")
+        for name, f in files.items():
+            field = RequestField(name=name, data=b"", filename=os.path.basename(f.name))
+            field.make_multipart(content_type="application/octet-stream")
+            self._add_bytes(f"--{boundary}\r\n{field.render_headers()}")
+            self._parts.append(f)
+            self._length += os.fstat(f.fileno()).st_size
+            self._add_bytes("\r\n")
+        self._add_bytes(f"--{boundary}--\r\n")
+        self._index = 0
+    
+    def _add_bytes(self, text):
+        data = text.encode("utf-8")
+        self._parts.append(io.BytesIO(data))
+        self._length += len(data)
+    
+    def __len__(self):
+        return self._length
+    
+    def __iter__(self):
+        while True:
+            block = self.read(64 * 1024)
+            if not block:
+                return
+            yield block
+    
+    def read(self, size=-1):
+        chunks = []
+        while self._index < len(self._parts) and size != 0:
+            chunk = self._parts[self._index].read(size)
+            if not chunk:
+                self._index += 1
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b"".join(chunks)
+    
+    def seek(self, offset):
+        """Rewind to the start (the only seek a retry needs)."""
+        for part in self._parts:
+            part.seek(0)
+        self._index = 0
+
+def _bot_api_post(method, data, files=None, timeout=30):
+    """Call a Bot API method from a worker thread over the shared keep-alive session.
+    
+    Calls are paced by _api_throttle, and a 429 reply is retried after the
+    retry_after Telegram asks for. Files are streamed from disk as they upload.
+    """
+    chat_id = data.get("chat_id")
+    url = _API_METHOD_URLS.get(method) or f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/{method}"
+    headers = None
+    if files:
+        data = _MultipartUpload(data, files)
+        headers = {"Content-Type": data.content_type}
+    
+    for attempt in range(API_MAX_RETRIES + 1):
+        _api_throttle.wait(chat_id)
+        response = _API_SESSION.post(
+            url,
+            data=data,
+            headers=headers,
+            timeout=timeout
+        )
+        if response.status_code != 429 or attempt == API_MAX_RETRIES:
+            break
+        
+        retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+        logger.warning(f"Telegram rate limited {method}, retrying in {retry_after}s")
+        time.sleep(retry_after)
+        # Rewind the upload so the retry sends it in full
+        if files:
+            data.seek(0)
+    
+    response.raise_for_status()
+    return response
+
 def send_user_message(chat_id, message: str):
     """Send a message to the user via Telegram."""
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
     payload = {
         "chat_id": chat_id,
         "text": f"[BOT] {message}",
         "parse_mode": "Markdown"
     }
     try:
-        requests.post(url, data=payload)
+        _bot_api_post("sendMessage", payload)
     except Exception as e:
         logger.error(f"Failed to send message to user: {e}")
 
+def _send_documents(chat_id, batch):
+    """Send (path, name, caption) files in one call, as an album when there are several."""
+    with contextlib.ExitStack() as stack:
+        files = {f"file{i}": stack.enter_context(open(path, "rb")) for i, (path, _, _) in enumerate(batch)}
+        if len(batch) == 1:
+            data = {"chat_id": chat_id, "caption": batch[0][2]}
+            files = {"document": files["file0"]}
+            method = "sendDocument"
+        else:
+            media = [
+                {"type": "document", "media": f"attach://file{i}", "caption": caption}
+                for i, (_, _, caption) in enumerate(batch)
+            ]
+            data = {"chat_id": chat_id, "media": orjson.dumps(media).decode()}
+            method = "sendMediaGroup"
+        _bot_api_post(method, data=data, files=files, timeout=300)  # 5 minutes timeout for large files
+
 def upload_to_telegram(chat_id, file_paths, context=None, is_resource=True):
     """
     Send the specified files to a Telegram chat.
     
+    Several files are sent as albums, up to MEDIA_GROUP_MAX_FILES per API call.
+    
     Args:
         chat_id: Telegram chat ID to send files to
         file_paths: List of file paths to upload
@@ -1567,87 +1871,91 @@ def upload_to_telegram(chat_id, file_paths, context=None, is_resource=True):
         return False
         
     logger.info(f"Uploading {len(file_paths)} files to Telegram chat {chat_id}...")
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendDocument"
     success = True
+    has_bot_context = context is not None and hasattr(context, 'bot')
+    # The license prompt is offered only after a lone resource file
+    offer_license = is_resource and len(file_paths) == 1 and has_bot_context
     
+    uploads = []
     for i, file_path in enumerate(file_paths):
-        if not file_path or not os.path.exists(file_path):
+        # One stat both checks the file exists and gives its size
+        try:
+            file_size_mb = os.stat(file_path).st_size / (1024 * 1024)
+        except (OSError, TypeError, ValueError):
             logger.error(f"File {file_path} doesn't exist, skipping.")
             continue
-            
+        file_name = os.path.basename(file_path)
+        is_license = "license" in file_name.lower()
+        # Different caption based on file type
+        caption = "📝 Here's your license file." if is_license else "🎁 Here's your downloaded resource file!"
+        
+        logger.info(f"Uploading file {i+1}/{len(file_paths)}: {file_name} ({file_size_mb:.1f} MB)")
+        
+        # If file is large, notify user first
+        if file_size_mb > 10 and has_bot_context:
+            try:
+                _bot_api_post("sendMessage", {
+                    "chat_id": chat_id,
+                    "text": f"📤 Uploading {file_name} ({file_size_mb:.1f} MB)...\nThis may take a few minutes."
+                })
+            except Exception as e:
+                logger.error(f"Failed to send upload notice for {file_name}: {e}")
+        uploads.append((file_path, file_name, caption))
+    
+    for start in range(0, len(uploads), MEDIA_GROUP_MAX_FILES):
+        batch = uploads[start:start + MEDIA_GROUP_MAX_FILES]
+        names = ", ".join(name for _, name, _ in batch)
         try:
-            # Calculate file size in MB
-            file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
-            file_name = os.path.basename(file_path)
-            
-            logger.info(f"Uploading file {i+1}/{len(file_paths)}: {file_name} ({file_size_mb:.1f} MB)")
-            
-            # If file is large, notify user first
-            if file_size_mb > 10 and context and hasattr(context, 'bot'):
-                context.bot.send_message(
-                    chat_id=chat_id,
-                    text=f"📤 Uploading {file_name} ({file_size_mb:.1f} MB)...\nThis may take a few minutes."
-                )
-            
-            with open(file_path, "rb") as f:
-                # Different caption based on file type 
-                if "license" in file_name.lower():
-                    caption = "📝 Here's your license file."
-                else:
-                    caption = "🎁 Here's your downloaded resource file!"
-                    
-                response = requests.post(
-                    url, 
-                    data={"chat_id": chat_id, "caption": caption},
-                    files={"document": f},
-                    timeout=300  # 5 minutes timeout for large files
-                )
-            response.raise_for_status()
-            logger.info(f"Successfully uploaded {file_name} to chat {chat_id}.")
+            _send_documents(chat_id, batch)
+            logger.info(f"Successfully uploaded {names} to chat {chat_id}.")
             
             # Only show license confirmation buttons if we've uploaded only the resource file
             # and we didn't include a license file in this batch
-            show_license_buttons = (
-                is_resource and 
-                len(file_paths) == 1 and 
-                "license" not in file_name.lower() and
-                context and 
-                hasattr(context, 'bot')
-            )
-            
-            if show_license_buttons:
+            if offer_license and "license" not in names.lower():
                 last_url = context.user_data.get("freepik_url")
                 
                 if last_url:
                     context.user_data["last_download_url"] = last_url
                     
                     # Send message with license confirmation buttons
-                    context.bot.send_message(
-                        chat_id=chat_id,
-                        text="Would you like me to download the license file as well?\n\n⚠️ Note: This may take a few minutes.",
-                        reply_markup=InlineKeyboardMarkup([
-                            [
-                                InlineKeyboardButton("Yes", callback_data=LICENSE_YES),
-                                InlineKeyboardButton("No", callback_data=LICENSE_NO)
-                            ]
-                        ])
-                    )
+                    _bot_api_post("sendMessage", {
+                        "chat_id": chat_id,
+                        "text": "Would you like me to download the license file as well?\n\n⚠️ Note: This may take a few minutes.",
+                        "reply_markup": _KB_LICENSE_CONFIRM_JSON
+                    })
         except requests.exceptions.ReadTimeout:
-            logger.error(f"Timeout uploading {os.path.basename(file_path)}")
+            logger.error(f"Timeout uploading {names}")
             try:
-                if context and hasattr(context, 'bot'):
-                    context.bot.send_message(
-                        chat_id=chat_id,
-                        text=f"⚠️ The file upload timed out. The file might be too large for Telegram. Try downloading again or try a different resource."
-                    )
+                if has_bot_context:
+                    _bot_api_post("sendMessage", {
+                        "chat_id": chat_id,
+                        "text": f"⚠️ The file upload timed out. The file might be too large for Telegram. Try downloading again or try a different resource."
+                    })
                 else:
                     send_user_message(chat_id, f"⚠️ The file upload timed out. The file might be too large for Telegram.")
             except Exception as e:
                 logger.error(f"Failed to send timeout message: {e}")
             success = False
         except Exception as e:
-            logger.error(f"Failed to upload {os.path.basename(file_path)}: {e}")
-            success = False
+            logger.error(f"Failed to upload {names}: {e}")
+            # Telegram rejects the whole album if one file is refused (too large,
+            # say), so then send the files one by one to deliver the rest. Any other
+            # error may have come after the album arrived, so nothing is resent
+            rejected = (
+                isinstance(e, requests.exceptions.HTTPError)
+                and e.response is not None
+                and 400 <= e.response.status_code < 500
+            )
+            if len(batch) == 1 or not rejected:
+                success = False
+                continue
+            for item in batch:
+                try:
+                    _send_documents(chat_id, [item])
+                    logger.info(f"Successfully uploaded {item[1]} to chat {chat_id}.")
+                except Exception as e:
+                    logger.error(f"Failed to upload {item[1]}: {e}")
+                    success = False
             
     return success
 
@@ -1655,6 +1963,19 @@ def upload_to_telegram(chat_id, file_paths, context=None, is_resource=True):
 # Telegram Bot Setup
 # --------------------------------
 
+async def drop_repeated_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Stop handling a callback query that repeats the user's last press within CALLBACK_DEBOUNCE_SEC."""
+    query = update.callback_query
+    if query is None or context.user_data is None:
+        return
+    
+    now = time.monotonic()
+    last = context.user_data.get("last_callback")
+    context.user_data["last_callback"] = (query.data, now)
+    if last and last[0] == query.data and now - last[1] < CALLBACK_DEBOUNCE_SEC:
+        logger.debug(f"Dropping repeated callback {query.data} from user {update.effective_user.id}")
+        raise ApplicationHandlerStop
+
 def setup_bot_handlers(application):
     """Set up the bot command handlers with improved error handling."""
     logger.info("Setting up bot handlers...")
@@ -1684,6 +2005,15 @@ def setup_bot_handlers(application):
                 except Exception as e:
                     logger.error(f"Error sending error message: {e}")
     
+    # Drop double-pressed buttons before any other handler sees them
+    application.add_handler(TypeHandler(Update, drop_repeated_callback), group=-1)
+    
+    # Handlers offered in more than one state are built once and shared. The
+    # Back to Main Menu button is only in the fallbacks, which every state reaches
+    show_plans = CallbackQueryHandler(show_subscription_plans, pattern=f"^{SUBSCRIPTION_PLANS}$")
+    show_sub_info = CallbackQueryHandler(show_subscription_info, pattern=f"^{SUBSCRIPTION_INFO}$")
+    back_to_freepik = CallbackQueryHandler(show_freepik_menu, pattern=f"^{BACK_FREEPIK}$")
+    
     # Define conversation handler
     conv_handler = ConversationHandler(
         entry_points=[
@@ -1693,44 +2023,46 @@ def setup_bot_handlers(application):
         states={
             MAIN_MENU: [
                 CallbackQueryHandler(continue_to_menu, pattern="^continue_to_menu$"),
-                CallbackQueryHandler(my_info, pattern="^my_info$"),
-                CallbackQueryHandler(handle_service_selection, pattern=f"^{FREEPIK_SERVICE}$|^{ENVATO_SERVICE}$|^{STORYBLOCKS_SERVICE}$"),
-                CallbackQueryHandler(show_subscription_info, pattern=f"^{SUBSCRIPTION_INFO}$"),
+                CallbackQueryHandler(my_info, pattern="^my_info$", block=False),
+                CallbackQueryHandler(handle_service_selection, pattern=f"^(?:{FREEPIK_SERVICE}|{ENVATO_SERVICE}|{STORYBLOCKS_SERVICE})$"),
+                show_sub_info,
                 CallbackQueryHandler(help_command, pattern="^help$"),
             ],
             SERVICE_MENU: [
                 CallbackQueryHandler(show_freepik_menu, pattern=f"^{FREEPIK_SERVICE}$"),
-                CallbackQueryHandler(continue_to_menu, pattern=f"^{BACK_MAIN_MENU}$"),
             ],
             FREEPIK_MENU: [
                 CallbackQueryHandler(prompt_for_url, pattern=f"^{FREEPIK_SEND_URL}$"),
-                CallbackQueryHandler(show_user_downloads, pattern=f"^{FREEPIK_DOWNLOADS}$"),
+                CallbackQueryHandler(show_user_downloads, pattern=f"^{FREEPIK_DOWNLOADS}$", block=False),
                 CallbackQueryHandler(show_freepik_info, pattern=f"^{FREEPIK_INFO}$"),
-                CallbackQueryHandler(show_subscription_plans, pattern=f"^{SUBSCRIPTION_PLANS}$"),
-                CallbackQueryHandler(show_freepik_menu, pattern=f"^{BACK_FREEPIK}$"),
-                CallbackQueryHandler(continue_to_menu, pattern=f"^{BACK_MAIN_MENU}$"),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_url),
+                show_plans,
+                back_to_freepik,
+                MessageHandler(filters.TEXT & ~filters.COMMAND, use_menu_reminder),
+            ],
+            AWAITING_URL: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND & filters.Regex(FREEPIK_URL_RE), handle_url),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, reject_non_url),
+                back_to_freepik,
             ],
             SUBSCRIPTION_MENU: [
-                CallbackQueryHandler(show_subscription_plans, pattern=f"^{SUBSCRIPTION_PLANS}$"),
-                CallbackQueryHandler(show_subscription_info, pattern=f"^{SUBSCRIPTION_INFO}$"),
+                show_plans,
+                show_sub_info,
                 # Update pattern to match both legacy and dynamic plan patterns
-                CallbackQueryHandler(process_subscription_selection, pattern=f"^{FREEPIK_MONTHLY}$|^{FREEPIK_YEARLY}$|^plan_"),
-                CallbackQueryHandler(continue_to_menu, pattern=f"^{BACK_MAIN_MENU}$"),
+                CallbackQueryHandler(process_subscription_selection, pattern=f"^(?:{FREEPIK_MONTHLY}$|{FREEPIK_YEARLY}$|plan_)"),
             ],
             AWAITING_PAYMENT: [
-                CallbackQueryHandler(show_subscription_info, pattern=f"^{SUBSCRIPTION_INFO}$"),
+                show_sub_info,
                 MessageHandler(filters.PHOTO, handle_payment_proof),
             ],
             AWAITING_LICENSE_CONFIRM: [
-                CallbackQueryHandler(handle_license_confirmation, pattern=f"^{LICENSE_YES}$|^{LICENSE_NO}$"),
+                CallbackQueryHandler(handle_license_confirmation, pattern=f"^(?:{LICENSE_YES}|{LICENSE_NO})$"),
             ],
         },
         fallbacks=[
             CommandHandler("start", start_command),
-            CommandHandler("help", help_command),
-            CommandHandler("status", status_command),
-            CommandHandler("queue", queue_command),
+            CommandHandler("help", help_command, block=False),
+            CommandHandler("status", status_command, block=False),
+            CommandHandler("queue", queue_command, block=False),
             CommandHandler("subscriptions", subscriptions_command),
             CallbackQueryHandler(continue_to_menu, pattern=f"^{BACK_MAIN_MENU}$"),
         ],
@@ -1742,10 +2074,11 @@ def setup_bot_handlers(application):
     # Add the conversation handler to the application
     application.add_handler(conv_handler)
     
-    # Add standalone command handlers
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("status", status_command))
-    application.add_handler(CommandHandler("queue", queue_command))
+    # Add standalone command handlers. These only read state, so they run as
+    # background tasks instead of holding up the next update
+    application.add_handler(CommandHandler("help", help_command, block=False))
+    application.add_handler(CommandHandler("status", status_command, block=False))
+    application.add_handler(CommandHandler("queue", queue_command, block=False))
     
     # Add handler for admin actions (for payment approval/rejection)
     application.add_handler(CallbackQueryHandler(handle_admin_action, pattern="^admin_"))
@@ -1759,18 +2092,50 @@ def setup_bot_handlers(application):
     
     logger.info("Bot handlers setup complete")
 
-def run_bot(token):
-    """Start the bot with improved error handling."""
+async def serve_bot(application, stop_event):
+    """Poll for updates in the running event loop until stop_event is set."""
+    async with application:
+        # Let download workers wake status followers on this loop
+        active_downloads.bind_loop(asyncio.get_running_loop())
+        await setup_commands(application.bot)
+        await application.start()
+        # Check the database in the background so polling starts right away
+        application.create_task(_db_healthcheck(db))
+        await application.updater.start_polling(
+            timeout=POLL_TIMEOUT_SEC,
+            allowed_updates=Update.ALL_TYPES
+        )
+        try:
+            # stop_event is a threading.Event set by the signal handler
+            while not stop_event.is_set():
+                await asyncio.sleep(1)
+        finally:
+            await application.updater.stop()
+            await application.stop()
+
+def run_bot(token, stop_event=None):
+    """Start the bot and block until stop_event is set."""
     try:
         # Create the Application and pass it your bot's token
-        application = Application.builder().token(token).build()
+        timeouts = dict(pool_timeout=20.0, connect_timeout=10.0, read_timeout=30.0, write_timeout=30.0)
+        application = (
+            Application.builder()
+            .token(token)
+            .request(OrjsonRequest(connection_pool_size=BOT_CONNECTION_POOL_SIZE, **timeouts))
+            .get_updates_request(OrjsonRequest(connection_pool_size=1, **timeouts))
+            # Queue outbound calls within Telegram's global and per-chat limits
+            # and retry the occasional 429 instead of failing the handler
+            .rate_limiter(AIORateLimiter(max_retries=2))
+            .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+            .build()
+        )
 
         # Set up handlers
         setup_bot_handlers(application)
         
         # Start the Bot
         logger.info("Starting bot...")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        asyncio.run(serve_bot(application, stop_event or threading.Event()))
         
         return application
     except Exception as e:
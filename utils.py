@@ -1,6 +1,11 @@
 import os
 import sys
+import json
+import math
+import asyncio
+import atexit
 import logging
+import logging.handlers
 import threading
 import queue
 from dotenv import load_dotenv
@@ -8,17 +13,48 @@ from database import Database
 import urllib.parse  # Add this import for URL encoding
 import traceback  # Add this import for full error tracebacks
 
+# Background listener that performs the actual log I/O
+_log_listener = None
+
+# The log file rolls over at this size, keeping this many old files
+_LOG_MAX_BYTES = 50 * 1024 * 1024
+_LOG_BACKUP_COUNT = 5
+
+# Assumed seconds per download until real ones are measured, and how much weight
+# each finished download gets in the running average
+_JOB_SEC_INITIAL = 120.0
+_JOB_SEC_SMOOTHING = 0.2
+
 # Configure logging
 def setup_logging(log_level=logging.INFO):
-    """Configure logging for the application."""
-    logging.basicConfig(
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        level=log_level,
-        handlers=[
-            logging.StreamHandler(sys.stdout),
-            logging.FileHandler("freepik_bot.log")
-        ]
-    )
+    """Configure logging for the application.
+    
+    Records are pushed onto an in-memory queue and written to stdout and the
+    log file by a QueueListener thread, so callers never block on log I/O.
+    The log file is rotated so it can't grow without bound.
+    """
+    global _log_listener
+    
+    if _log_listener is None:
+        formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(formatter)
+        file_handler = logging.handlers.RotatingFileHandler(
+            "freepik_bot.log", maxBytes=_LOG_MAX_BYTES, backupCount=_LOG_BACKUP_COUNT
+        )
+        file_handler.setFormatter(formatter)
+        
+        log_queue = queue.SimpleQueue()
+        _log_listener = logging.handlers.QueueListener(
+            log_queue, stream_handler, file_handler, respect_handler_level=True
+        )
+        _log_listener.start()
+        atexit.register(_log_listener.stop)
+        
+        logging.basicConfig(
+            level=log_level,
+            handlers=[logging.handlers.QueueHandler(log_queue)]
+        )
     
     # Set specific loggers to a different level if needed
     # For example, to reduce noise from some libraries:
@@ -59,6 +95,9 @@ def load_config():
     config['download_dir'] = os.getenv("DOWNLOAD_DIR", "downloads")
     config['max_queue_size'] = int(os.getenv("MAX_QUEUE_SIZE", "10"))
     config['headless'] = os.getenv("HEADLESS", "true").lower() == "true"
+    config['max_concurrent_downloads'] = max(1, int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "1")))
+    config['browser_recycle_after'] = max(1, int(os.getenv("BROWSER_RECYCLE_AFTER", "50")))
+    config['max_concurrent_uploads'] = max(1, int(os.getenv("MAX_CONCURRENT_UPLOADS", "4")))
     
     # Bank details for payments
     config['bank_name'] = os.getenv("BANK_NAME", "Bank of Ceylon")
@@ -74,52 +113,182 @@ def load_config():
     
     return config
 
-def create_shared_resources(max_queue_size, mongodb_uri):
+class DownloadQueue(queue.Queue):
+    """FIFO download queue that tracks each queued user's position in O(1).
+    
+    Items are tuples whose first element is the user ID. Every put is given a
+    sequence number, so a user's position is their number minus the count of
+    items taken so far. The bookkeeping runs in _put/_get, which Queue calls
+    while holding its own mutex. Items a worker has taken stay in flight until
+    it calls finish, so a shutdown can save them along with the waiting ones.
+    Workers report how long each download took, which keeps a moving average
+    for wait time estimates; those assume `workers` downloads run at a time.
+    """
+    
+    def __init__(self, maxsize=0, workers=1):
+        self.workers = max(1, workers)
+        super().__init__(maxsize)
+    
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self._user_seq = {}
+        self._put_count = 0
+        self._get_count = 0
+        self._inflight = []
+        self._avg_job_sec = _JOB_SEC_INITIAL
+    
+    def _put(self, item):
+        super()._put(item)
+        self._put_count += 1
+        self._user_seq[item[0]] = self._put_count
+    
+    def _get(self):
+        item = super()._get()
+        self._get_count += 1
+        if self._user_seq.get(item[0]) == self._get_count:
+            del self._user_seq[item[0]]
+        self._inflight.append(item)
+        return item
+    
+    def __contains__(self, user_id):
+        """Return True if the user has an item waiting in the queue."""
+        with self.mutex:
+            return user_id in self._user_seq
+    
+    def position(self, user_id):
+        """Return the user's 1-based position in the queue, or 0 if not queued."""
+        with self.mutex:
+            seq = self._user_seq.get(user_id)
+            return seq - self._get_count if seq else 0
+    
+    def finish(self, item):
+        """Mark an item taken with get() as processed (this also calls task_done)."""
+        with self.mutex:
+            self._inflight.remove(item)
+        self.task_done()
+    
+    def record_duration(self, seconds):
+        """Fold a finished download's duration into the moving average."""
+        with self.mutex:
+            self._avg_job_sec += _JOB_SEC_SMOOTHING * (seconds - self._avg_job_sec)
+    
+    def estimated_wait_minutes(self, jobs):
+        """Estimate the minutes the workers need to get through the given number of downloads."""
+        return max(1, round(math.ceil(jobs / self.workers) * self._avg_job_sec / 60))
+    
+    def save_pending(self, path):
+        """Write the items in flight and those still waiting to path. Returns the count.
+        
+        Waiting items are drained from the queue. Items in flight are left to
+        their workers, which may still finish them before the process exits,
+        so a saved download can run twice but is never lost.
+        """
+        with self.mutex:
+            items = list(self._inflight)
+        while True:
+            try:
+                item = self.get_nowait()
+            except queue.Empty:
+                break
+            items.append(item)
+            self.finish(item)
+        
+        if items:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(items, f)
+        return len(items)
+    
+    def restore_pending(self, path):
+        """Queue the items saved by save_pending and delete the file. Returns the count."""
+        if not os.path.exists(path):
+            return 0
+        
+        with open(path, encoding="utf-8") as f:
+            items = json.load(f)
+        os.remove(path)
+        
+        restored = 0
+        for item in items:
+            try:
+                self.put_nowait(tuple(item))
+                restored += 1
+            except queue.Full:
+                logging.getLogger(__name__).warning(f"Download queue full, dropped saved download: {item}")
+        return restored
+
+class DownloadStatusBoard(dict):
+    """Maps user ID to download status and lets the bot wait for status changes.
+    
+    Download workers write and delete statuses like a normal dict. Each write or
+    delete wakes any coroutine waiting in wait_for_change for that user, via the
+    bot's event loop, so status messages can follow a download without polling.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self._loop = None
+        self._waiters = {}  # user_id -> set of asyncio.Event
+    
+    def bind_loop(self, loop):
+        """Set the event loop that waiting coroutines run on."""
+        self._loop = loop
+    
+    def __setitem__(self, user_id, status):
+        super().__setitem__(user_id, status)
+        self._notify(user_id)
+    
+    def __delitem__(self, user_id):
+        super().__delitem__(user_id)
+        self._notify(user_id)
+    
+    def _notify(self, user_id):
+        events = self._waiters.get(user_id)
+        if events and self._loop is not None:
+            for event in list(events):
+                self._loop.call_soon_threadsafe(event.set)
+    
+    async def wait_for_change(self, user_id, timeout):
+        """Wait until the user's status is written or removed. Returns False on timeout."""
+        event = asyncio.Event()
+        waiters = self._waiters.setdefault(user_id, set())
+        waiters.add(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiters.discard(event)
+            if not waiters:
+                self._waiters.pop(user_id, None)
+
+def create_shared_resources(max_queue_size, mongodb_uri, workers=1):
     """Create and return shared resources for thread communication."""
     # Get a logger instance for this function
     logger = logging.getLogger(__name__)
     
-    download_queue = queue.Queue(maxsize=max_queue_size)
-    active_downloads = {}  # userid -> status
+    download_queue = DownloadQueue(maxsize=max_queue_size, workers=workers)
+    active_downloads = DownloadStatusBoard()  # userid -> status
     queue_lock = threading.Lock()
     
     # Fix MongoDB URI by properly encoding username and password
     try:
+        # Split off the credentials at the last @, since the raw password may contain
+        # @ (and /, ? or #, which is why urlsplit can't be used here)
+        protocol, _, rest = mongodb_uri.partition("://")
+        credentials, has_credentials, host_part = rest.rpartition('@')
+        
         # Log the original (masked) URI for debugging
-        masked_uri = mongodb_uri
-        if '@' in masked_uri:
-            parts = masked_uri.split('@')
-            credentials = parts[0].split('://')
-            masked_uri = f"{credentials[0]}://****:****@{parts[1]}"
+        masked_uri = f"{protocol}://****:****@{host_part}" if has_credentials else mongodb_uri
         logger.info(f"Original MongoDB URI format: {masked_uri}")
         
-        # Fix MongoDB URI by properly encoding username and password
-        if '@' in mongodb_uri:
-            # Parse the URI to encode credentials
-            parts = mongodb_uri.split("://")
-            protocol = parts[0]
-            rest = parts[1]
-            
-            # Handle case where @ might appear in password
-            if rest.count('@') > 1:
-                # Find the last @ which separates credentials from host
-                last_at_index = rest.rindex('@')
-                credentials = rest[:last_at_index]
-                host_part = rest[last_at_index+1:]
-            else:
-                credentials, host_part = rest.split('@', 1)
-            
+        if has_credentials:
             # Make sure credentials contain a colon for username:password
             if ':' in credentials:
                 username, password = credentials.split(':', 1)
                 
-                # URL encode the username and password
-                encoded_username = urllib.parse.quote_plus(username)
-                encoded_password = urllib.parse.quote_plus(password)
-                
-                # Reconstruct the URI
-                fixed_uri = f"{protocol}://{encoded_username}:{encoded_password}@{host_part}"
-                mongodb_uri = fixed_uri
+                # URL encode the username and password and reconstruct the URI
+                mongodb_uri = f"{protocol}://{urllib.parse.quote_plus(username)}:{urllib.parse.quote_plus(password)}@{host_part}"
                 logger.info("MongoDB URI credentials encoded successfully")
             else:
                 logger.warning("MongoDB URI has @ but no username:password format detected")
@@ -128,28 +297,10 @@ def create_shared_resources(max_queue_size, mongodb_uri):
         logger.info("Initializing database connection...")
         db = Database(mongodb_uri)
         
-        # Verify connection is successful
+        # Verify connection is successful; the test write runs in the background
+        # once the bot is up (see telegram_bot._db_healthcheck)
         if db.is_connected:
             logger.info("MongoDB connection successful!")
-            
-            # Test a real write operation
-            try:
-                test_user = db.create_or_update_user(
-                    user_id=999999,  # Test user ID
-                    username="test_user",
-                    name="Test User",
-                    first_name="Test",
-                    last_name="User"
-                )
-                logger.info(f"MongoDB test write successful! Test user registered/updated")
-                
-                # Get collections for debugging
-                collections = db.db.list_collection_names()
-                logger.info(f"MongoDB collections: {collections}")
-            except Exception as e:
-                logger.error(f"MongoDB test write failed: {e}")
-                logger.error(traceback.format_exc())
-                
         else:
             logger.error("Database initialized but is_connected=False! Using mock database.")
         